@@ -0,0 +1,4 @@
+"""
+Benchmarks of the hot paths of DeSPiste, with JSON baselines to catch throughput regressions.
+See benchmarks.runner for the commands.
+"""
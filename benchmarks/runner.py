@@ -0,0 +1,195 @@
+"""
+Runs the benchmarks, saves their results as JSON and compares them with a baseline.
+
+    python -m benchmarks run [-r REPEAT] [-k FILTER] [-o results.json] [--baseline baseline.json]
+    python -m benchmarks compare baseline.json results.json [--threshold 0.25]
+
+Each benchmark is timed with timeit, running it enough times to last at least 0.2 s, and the median of REPEAT
+measures is kept. Before each measure, a fixed amount of plain Python work is timed too: throughputs are scaled to a
+machine doing it in CALIBRATION_SECONDS, so that a busier or slower machine doesn't look like a regression.
+A benchmark regresses when its scaled throughput, in instructions per second, drops by more than the threshold,
+which fails the command. The threshold covers the noise measured on a shared single CPU machine, where running the
+same code twice differs by up to 18%. The scaling doesn't make machines with another CPU or Python version
+comparable: benchmarks/baseline.json holds the results of the machine it names, make a baseline locally with -o
+before comparing on another one.
+"""
+import argparse
+import json
+import platform
+import statistics
+import sys
+import timeit
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional
+
+from benchmarks.suite import Benchmark, benchmarks
+
+FORMAT_VERSION = 2
+DEFAULT_THRESHOLD = 0.25
+DEFAULT_REPEAT = 7
+# Time of a calibration run on the machine the scaled throughputs are given for
+CALIBRATION_SECONDS = 0.001
+
+
+class Result(NamedTuple):
+    name: str
+    items: int
+    seconds: float  # Median time of a run
+    calibration: float  # Median time of a calibration run, measured along
+
+    @property
+    def throughput(self) -> float:
+        return self.items / self.seconds
+
+    @property
+    def scaled_throughput(self) -> float:
+        return self.throughput * self.calibration / CALIBRATION_SECONDS
+
+
+class Comparison(NamedTuple):
+    name: str
+    baseline: Optional[float]  # Throughputs, None for a benchmark missing from the results
+    current: Optional[float]
+
+    @property
+    def change(self) -> Optional[float]:
+        if self.baseline is None or self.current is None:
+            return None
+        return self.current / self.baseline - 1
+
+    def regressed(self, threshold: float) -> bool:
+        return self.change is not None and self.change < -threshold
+
+
+def calibration():
+    """
+    Plain Python work like that of the assembler: splitting strings and updating a dictionary.
+    """
+    counts = {}
+    for index in range(1000):
+        name, _, operand = f"MOV {index},MC{index % 4}".partition(" ")
+        for part in operand.split(","):
+            counts[part] = counts.get(part, 0) + len(name)
+    return counts
+
+
+def measure(benchmark: Benchmark, repeat: int = DEFAULT_REPEAT) -> Result:
+    """
+    Times the benchmark and the calibration one after the other, so that both see the same load.
+    """
+    timer = timeit.Timer(benchmark.run)
+    number, _ = timer.autorange()
+    reference = timeit.Timer(calibration)
+    reference_number, _ = reference.autorange()
+    seconds = []
+    calibrations = []
+    for _ in range(repeat):
+        calibrations.append(reference.timeit(reference_number) / reference_number)
+        seconds.append(timer.timeit(number) / number)
+    return Result(benchmark.name, benchmark.items, statistics.median(seconds), statistics.median(calibrations))
+
+
+def run_benchmarks(repeat: int = DEFAULT_REPEAT, name_filter: Optional[str] = None) -> List[Result]:
+    results = []
+    for benchmark in benchmarks():
+        if name_filter and name_filter not in benchmark.name:
+            continue
+        result = measure(benchmark, repeat)
+        print(f"{result.name:<28}{result.seconds * 1000:>12.3f} ms{result.throughput:>16,.0f} instructions/s"
+              f"{result.scaled_throughput:>16,.0f} scaled")
+        results.append(result)
+    return results
+
+
+def results_to_json(results: List[Result]) -> dict:
+    return {
+        "version": FORMAT_VERSION,
+        "python": platform.python_version(),
+        "machine": platform.platform(),
+        "results": {result.name: {"items": result.items, "seconds": result.seconds, "calibration": result.calibration,
+                                  "throughput": result.throughput, "scaled_throughput": result.scaled_throughput}
+                    for result in results},
+    }
+
+
+def load_throughputs(path: str) -> Dict[str, float]:
+    """
+    :return: The scaled throughput of each benchmark
+    """
+    data = json.loads(Path(path).read_text(encoding="utf-8"))
+    if data.get("version") != FORMAT_VERSION:
+        raise Exception(f"Unsupported benchmark results format in {path}")
+    return {name: result["scaled_throughput"] for name, result in data["results"].items()}
+
+
+def compare(baseline: Dict[str, float], current: Dict[str, float]) -> List[Comparison]:
+    """
+    Compares the scaled throughputs of the benchmarks, including those found in only one of the results.
+    """
+    names = list(baseline) + [name for name in current if name not in baseline]
+    return [Comparison(name, baseline.get(name), current.get(name)) for name in names]
+
+
+def report_comparisons(comparisons: List[Comparison], threshold: float) -> bool:
+    """
+    Prints the comparisons.
+    :return: Whether a benchmark regressed beyond the threshold
+    """
+    regressed = False
+    for comparison in comparisons:
+        if comparison.change is None:
+            side = "baseline" if comparison.current is None else "results"
+            throughput = comparison.baseline if comparison.current is None else comparison.current
+            print(f"{comparison.name:<28}{throughput:>16,.0f}  only in the {side}")
+            continue
+        mark = ""
+        if comparison.regressed(threshold):
+            mark = "  REGRESSION"
+            regressed = True
+        print(f"{comparison.name:<28}{comparison.baseline:>16,.0f}{comparison.current:>16,.0f}"
+              f"{comparison.change:>+9.1%}{mark}")
+    return regressed
+
+
+def do_run(args: List[str]):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks run", description="Runs the benchmarks.")
+    parser.add_argument("-r", "--repeat", type=int, default=DEFAULT_REPEAT,
+                        help="Measures per benchmark, the median is kept")
+    parser.add_argument("-k", "--filter", help="Only runs the benchmarks whose name contains this text")
+    parser.add_argument("-o", "--output", help="JSON file to save the results to, for example a new baseline")
+    parser.add_argument("--baseline", help="JSON results to compare with, failing on regressions")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="Throughput drop counted as a regression, 0.1 for 10%%")
+    options = parser.parse_args(args)
+
+    results = run_benchmarks(options.repeat, options.filter)
+    if options.output:
+        Path(options.output).write_text(json.dumps(results_to_json(results), indent=2) + "\n", encoding="utf-8")
+    if options.baseline:
+        current = {result.name: result.scaled_throughput for result in results}
+        baseline = {name: throughput for name, throughput in load_throughputs(options.baseline).items()
+                    if not options.filter or options.filter in name}
+        if report_comparisons(compare(baseline, current), options.threshold):
+            raise SystemExit(1)
+    raise SystemExit(0)
+
+
+def do_compare(args: List[str]):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks compare",
+                                     description="Compares benchmark results with a baseline.")
+    parser.add_argument("baseline")
+    parser.add_argument("current")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="Throughput drop counted as a regression, 0.1 for 10%%")
+    options = parser.parse_args(args)
+
+    comparisons = compare(load_throughputs(options.baseline), load_throughputs(options.current))
+    raise SystemExit(1 if report_comparisons(comparisons, options.threshold) else 0)
+
+
+def main(argv: List[str]):
+    commands = {"run": do_run, "compare": do_compare}
+    if len(argv) < 2 or argv[1] not in commands:
+        print(__doc__, file=sys.stderr)
+        raise SystemExit(1)
+    commands[argv[1]](argv[2:])
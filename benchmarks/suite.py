@@ -0,0 +1,124 @@
+"""
+The benchmarks: the assembler, the decoders, the encoder and the text rendering on the test programs, a synthetic
+program filling the 256 words of the program RAM with every command type, and corpora of a few MB.
+"""
+from itertools import cycle
+from pathlib import Path
+from typing import Callable, List, NamedTuple
+
+from despiste.assembler import LineKind, assemble, parse_lines
+from despiste.commands import AluOpcodes
+from despiste.decompile import program_to_text
+from despiste.instruction import Instruction
+from despiste.instruction_context import InstructionContext
+from despiste.program import Program
+
+RESOURCES = Path(__file__).parent.parent / "tests" / "resources"
+
+PROGRAM_SIZE = 256
+CORPUS_SIZE = 2 * 1024 * 1024  # Bytes of text or binary
+
+
+class Benchmark(NamedTuple):
+    name: str
+    items: int  # Instructions handled by a run
+    run: Callable[[], object]
+
+
+def assemblable_lines(path: Path) -> List[str]:
+    """
+    Reads a source file, commenting out the instructions the assembler rejects so that the line numbers are kept.
+    cmpnm.asm moves to Y and clears A in the same instruction twice.
+    """
+    lines = path.read_text(encoding="utf-8").splitlines()
+    parsed = list(parse_lines(lines))
+    context = InstructionContext()
+    offset = 0
+    for _, kind, payload in parsed:
+        if kind == LineKind.LABEL:
+            context.register_label(payload, offset)
+        elif kind == LineKind.CONSTANT:
+            context.register_constant(payload)
+        else:
+            offset += 1
+    for line_number, kind, payload in parsed:
+        if kind not in (LineKind.LABEL, LineKind.CONSTANT):
+            try:
+                Instruction.from_text(payload, context)
+            except Exception:
+                lines[line_number - 1] = ";" + lines[line_number - 1]
+    return lines
+
+
+def synthetic_program(size: int = PROGRAM_SIZE) -> List[str]:
+    """
+    Returns the source of a program using every command type, without labels so that copies can be concatenated.
+    """
+    sources = cycle(["M0", "M1", "M2", "M3", "MC0", "MC1", "MC2", "MC3"])
+    d1_sources = cycle(["M0", "M1", "M2", "M3", "MC0", "MC1", "MC2", "MC3", "ALL", "ALH"])
+    destinations = cycle(["MC0", "MC1", "MC2", "MC3", "RX", "PL", "RA0", "WA0", "LOP", "TOP", "CT0", "CT1", "CT2",
+                          "CT3"])
+    alu = cycle([op.name for op in AluOpcodes])
+    x_bus = cycle(["", "MOV MUL,P", "MOV {},P", "MOV {},X"])
+    y_bus = cycle(["", "CLR A", "MOV ALU,A", "MOV {},A", "MOV {},Y"])
+    d1_bus = cycle(["", "MOV {source},{destination}", "MOV {immediate},{destination}"])
+    specials = cycle([
+        "MVI {n},MC{b}", "MVI {n},PL,NZ", "MVI {n},RX,T0", "MVI {n},LOP,ZS", "MVI {n},PC,NC",
+        "JMP {n}", "JMP NZ,{n}", "JMP S,{n}", "JMP NT0,{n}",
+        "DMA D0,MC{b},{n}", "DMAH MC{b},D0,{n}", "DMA D0,MC{b},MC{c}", "DMAH D0,PRG,{n}", "DMA MC{b},D0,CT{c}",
+        "LPS", "BTM",
+    ])
+
+    lines = []
+    for index in range(size - 2):
+        if index % 4 == 3:
+            lines.append(" " + next(specials).format(n=index % 200, b=index % 4, c=(index + 1) % 4))
+            continue
+        commands = [
+            next(alu),
+            next(x_bus).format(next(sources)),
+            next(y_bus).format(next(sources)),
+            next(d1_bus).format(source=next(d1_sources), immediate=index % 256 - 128, destination=next(destinations)),
+        ]
+        lines.append(" " + " ".join(command for command in commands if command))
+    return lines + [" ENDI", " END"]
+
+
+def decoded(program: Program) -> List:
+    """
+    Decodes every instruction, which programs built from words only do when they are accessed.
+    """
+    return list(program.instructions)
+
+
+def benchmarks() -> List[Benchmark]:
+    """
+    Builds the inputs of every benchmark, which aren't part of the measured time.
+    """
+    cmpnm = assemblable_lines(RESOURCES / "cmpnm.asm")
+    udiv = (RESOURCES / "udiv.asm").read_text(encoding="utf-8").splitlines()
+    udiv_bin = (RESOURCES / "udiv.bin").read_bytes()
+    # The first instruction is at the end of the string
+    udiv_bits = "".join(format(word, "032b") for word in reversed(Program.from_bytes(udiv_bin).to_words()))
+    synthetic = synthetic_program()
+    program = Program.from_text(synthetic)
+    words = program.to_words()
+
+    text_copies = CORPUS_SIZE // len("\n".join(synthetic))
+    corpus_text = synthetic * text_copies
+    corpus_bytes = udiv_bin * (CORPUS_SIZE // len(udiv_bin))
+
+    return [
+        Benchmark("from_text cmpnm.asm", len(Program.from_text(cmpnm).instructions), lambda: Program.from_text(cmpnm)),
+        Benchmark("from_text udiv.asm", len(Program.from_text(udiv).instructions), lambda: Program.from_text(udiv)),
+        Benchmark("assemble udiv.asm", len(assemble(udiv)), lambda: assemble(udiv)),
+        Benchmark("from_binary udiv.bin", len(udiv_bin) // 4, lambda: decoded(Program.from_binary(udiv_bits))),
+        Benchmark("from_bytes udiv.bin", len(udiv_bin) // 4, lambda: decoded(Program.from_bytes(udiv_bin))),
+        Benchmark("from_text synthetic", len(words), lambda: Program.from_text(synthetic)),
+        Benchmark("to_words synthetic", len(words), program.to_words),
+        Benchmark("from_words synthetic", len(words), lambda: decoded(Program.from_words(words))),
+        Benchmark("program_to_text synthetic", len(words), lambda: program_to_text(program)),
+        Benchmark("from_text corpus", len(words) * text_copies, lambda: Program.from_text(corpus_text)),
+        Benchmark("from_bytes corpus", len(corpus_bytes) // 4, lambda: decoded(Program.from_bytes(corpus_bytes))),
+        Benchmark("copy corpus", len(corpus_bytes) // 4, lambda: Program.from_bytes(corpus_bytes).to_bytes()),
+    ]
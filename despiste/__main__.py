@@ -1,30 +1,108 @@
+import logging
 import sys
 
-from despiste.compile import do_compile
-from despiste.decompile import do_decompile
-from despiste.utils import print_help_message
+from despiste.stats import Profiler, phase, split_stats_flags
+from despiste.utils import print_help_message, setup_logging, split_verbosity_flags
+
+# The commands are imported when they run: startup only pays for the one used (scan brings NumPy, many brings
+# multiprocessing, and the optimizer brings the simulator)
+
+logger = logging.getLogger("despiste")
 
 
 def main():
-    print("\n *** DeSPiste. A cross-platform Sega Saturn SCU DSP compiler and decompiler ***\n")
-    args_count = len(sys.argv)
+    verbosity, argv = split_verbosity_flags(sys.argv)
+    setup_logging(verbosity)
+    stats, profile_file, argv = split_stats_flags(argv)
+
+    logger.info("\n *** DeSPiste. A cross-platform Sega Saturn SCU DSP compiler and decompiler ***\n")
+    if not stats:
+        run(argv)
+        return
+    profiler = Profiler(profile_file=profile_file)
+    try:
+        with profiler:
+            run(argv)
+    finally:
+        # Asked for explicitly, so shown even with -q
+        print(profiler.report(), file=sys.stderr)
+
+
+def _imported(module: str, name: str):
+    """
+    Imports a command, in the import phase of the statistics so that it doesn't count in the throughput.
+    """
+    import importlib
+    with phase("import"):
+        return getattr(importlib.import_module(module), name)
+
+
+def run(argv):
+    command = argv[1] if len(argv) > 1 else None
+    if command in ['compile-many', 'decompile-many']:
+        _imported("despiste.parallel", "do_many")(command.removesuffix('-many'), argv[2:])
+    elif command == 'scan':
+        _imported("despiste.scan", "do_scan")(argv[2:])
+    elif command == 'watch':
+        _imported("despiste.watch", "do_watch")(argv[2:])
+    elif command == 'lsp':
+        _imported("despiste.lsp", "do_lsp")(argv[2:])
+    elif command == 'analyze':
+        _imported("despiste.analyze", "do_analyze")(argv[2:])
+    elif command == 'cache':
+        _imported("despiste.compile_cache", "do_cache")(argv[2:])
+    else:
+        run_single(argv)
+
+
+def run_single(argv):
+    """
+    Runs the compile and decompile commands, which handle a single file.
+    """
+    pack = '--pack' in argv
+    argv = [arg for arg in argv if arg != '--pack']
+    passes = None
+    count_cycles = None
+    if any(arg.startswith('--optimize') for arg in argv):
+        known = _imported("despiste.optimize", "PASSES")
+        passes, report, argv = _imported("despiste.optimize", "split_optimize_flags")(argv)
+        count_cycles = True if report else None
+        unknown = [name for name in passes if name not in known]
+        if unknown:
+            logger.error(f"Error: Unknown optimizer passes {', '.join(unknown)}, expected some of {', '.join(known)}.")
+            print_help_message()
+            raise SystemExit(1)
+
+    cache = None
+    if any(arg.startswith('--cache-') for arg in argv):
+        CompileCache = _imported("despiste.compile_cache", "CompileCache")
+        try:
+            cache_dir, cache_size, argv = _imported("despiste.compile_cache", "split_cache_flags")(argv)
+        except Exception as e:
+            logger.error(f"Error: {e}")
+            print_help_message()
+            raise SystemExit(1)
+        if cache_dir:
+            cache = CompileCache(cache_dir, cache_size)
+
+    args_count = len(argv)
     if args_count not in [3, 4]:
-        print(f"Error: Two or three arguments are expected, got {args_count - 1} instead.")
+        logger.error(f"Error: Two or three arguments are expected, got {args_count - 1} instead.")
         print_help_message()
         raise SystemExit(1)
-    command = sys.argv[1]
-    input_file = sys.argv[2]
+    command = argv[1]
+    input_file = argv[2]
     output_file = None
 
     if args_count == 4:
-        output_file = sys.argv[3]
+        output_file = argv[3]
 
     if command == 'compile':
-        do_compile(input_file, output_file)
+        _imported("despiste.compile", "do_compile")(input_file, output_file, pack, passes, cache, count_cycles)
     elif command == 'decompile':
-        do_decompile(input_file, output_file)
+        _imported("despiste.decompile", "do_decompile")(input_file, output_file)
     else:
-        print(f"Error: First argument must be either 'compile' or 'decompile', got {command} instead.")
+        logger.error(f"Error: First argument must be either 'compile' or 'decompile', got {command} instead.")
         print_help_message()
         raise SystemExit(1)
 
@@ -0,0 +1,405 @@
+"""
+Static analysis of DSP programs: best and worst case cycle counts, without running them.
+
+Execution is followed over abstract states made of the PC, the LOP and TOP registers when they are known
+from immediate values, and the pending jump of a delay slot. Conditions on flags are unknown, so both ways
+are followed. The states form a graph whose edges cost cycles: the best case is its shortest path to a
+stop, and the worst case its longest one, which is unbounded when the graph has a reachable cycle
+(a loop whose exit depends on data).
+
+When LOP is loaded from data, its best case is 0 and its worst case 0xFFF, the largest LOP value.
+A BTM loop isn't followed once per LOP value: after the first pass through its body, the remaining passes
+cost LOP times the cost of one more pass, when the body always goes back to the BTM without changing LOP
+or TOP. A BTM whose target isn't known makes the worst case unknown, except in a subroutine called with
+MVI to PC, where it returns to the caller. So does an LPS repeating a BTM or a MVI to PC.
+Cycle costs are those of the simulator: one cycle per instruction, LOP + 1 times the cost of the instruction
+repeated by LPS, and the transfer size for DMAH, which stalls the DSP.
+"""
+import argparse
+import heapq
+import logging
+import os
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from despiste.commands import D1BusDataDestination, D1BusOpcodes, DMACommand, DMACounterMode, \
+    EndCommand, JumpCommand, LoopCommand, LoopOpcodes, MVICommand, MVIStorageDestination
+from despiste.instruction import Instruction
+from despiste.program import Program
+from despiste.utils import read_file_content, read_file_lines
+
+logger = logging.getLogger(__name__)
+
+MAX_LOP = 0xFFF
+# Largest DMA transfer size read from a data RAM
+MAX_DMA_COUNT = 0xFF
+# Analysis gives up beyond this number of states
+MAX_STATES = 500_000
+# TOP of a subroutine, the address of the delay slot of its caller
+RETURN_ADDRESS = -1
+
+
+class _State(NamedTuple):
+    pc: int
+    lop: Optional[int]  # None when loaded from data, for the worst case
+    top: Optional[int]  # None when unknown, RETURN_ADDRESS in a subroutine
+    branch: Optional[int]  # Pending jump, taken after the current instruction
+
+
+class CycleReport(NamedTuple):
+    entry: int
+    best: Optional[int]  # None when no path stops
+    worst: Optional[int]  # None when unbounded or unknown
+    notes: List[str]
+
+    def to_text(self) -> str:
+        best = "never stops" if self.best is None else f"{self.best} cycles"
+        worst = "unknown" if self.worst is None else f"{self.worst} cycles"
+        lines = [f"Entry {self.entry:#04x}: best {best}, worst {worst}"]
+        lines += [f"  {note}" for note in self.notes]
+        return "\n".join(lines)
+
+
+class CycleAnalyzer:
+    """
+    Builds the state graph of a program from its entry points.
+    """
+
+    def __init__(self, program: Program):
+        self.instructions = program.instructions
+        self.notes: Dict[int, str] = {}  # By address, for the instructions the analysis is unsure about
+        self.unknown = False  # Whether the worst case can't be bounded
+        self._iterations: Dict[Tuple[int, int, bool], Optional[int]] = {}
+
+    def subroutines(self) -> List[int]:
+        """
+        The addresses called with MVI to PC.
+        """
+        called = set()
+        for inst in self.instructions:
+            cmd = inst.specialCommand
+            if isinstance(cmd, MVICommand) and cmd.destination == MVIStorageDestination.PC:
+                called.add(cmd.immediate & 0xFF)
+        return sorted(called)
+
+    def entry_points(self) -> List[int]:
+        """
+        The start of the program, and the subroutines called with MVI to PC.
+        """
+        return sorted({0, *self.subroutines()})
+
+    def dmah_stalls(self) -> List[str]:
+        """
+        Describes the DMAH transfers, which stall the DSP for the whole transfer.
+        """
+        stalls = []
+        for address, inst in enumerate(self.instructions):
+            cmd = inst.specialCommand
+            if isinstance(cmd, DMACommand) and cmd.hold:
+                if cmd.dma_counter_mode == DMACounterMode.IMMEDIATE:
+                    stalls.append(f"DMAH at {address:#04x} stalls {cmd.data_size} cycles")
+                else:
+                    stalls.append(f"DMAH at {address:#04x} stalls up to {MAX_DMA_COUNT} cycles "
+                                  f"(size read from {cmd.dma_counter_ram.name})")
+        return stalls
+
+    def analyze(self, entry: int) -> CycleReport:
+        self.notes = {}
+        self.unknown = False
+        # The start of the program runs from reset, even when it's also called as a subroutine
+        called = entry != 0 and entry in self.subroutines()
+        start = _State(entry, 0, RETURN_ADDRESS if called else None, None)
+        best = _shortest(self._graph(start, False), start)
+        start = start._replace(lop=None)
+        worst, loop = _longest(self._graph(start, True), start)
+        if self.unknown:
+            worst = None
+
+        notes = [self.notes[address] for address in sorted(self.notes)]
+        if loop is not None:
+            notes.insert(0, f"Loop through {loop:#04x} depends on data")
+        return CycleReport(entry, best, worst, notes)
+
+    def _graph(self, start: _State, worst: bool) -> Dict[_State, List[Tuple[int, Optional[_State]]]]:
+        """
+        Builds the graph of the states reachable from a start state. A None successor stops.
+        :param worst: Whether values loaded from data take their worst case value, instead of their best
+        """
+        graph = {}
+        pending = [start]
+        while pending:
+            state = pending.pop()
+            if state in graph:
+                continue
+            if len(graph) >= MAX_STATES:
+                raise Exception(f"The program is too complex to analyze (more than {MAX_STATES} states)")
+            edges = graph[state] = self._successors(state, worst)
+            pending.extend(successor for _, successor in edges if successor is not None and successor not in graph)
+        return graph
+
+    def _successors(self, state: _State, worst: bool) -> List[Tuple[int, Optional[_State]]]:
+        pc, lop, top, branch = state
+        next_pc = (pc + 1) & 0xFF if branch is None else branch
+
+        if pc >= len(self.instructions):
+            if branch is None:
+                self.notes[pc] = f"Runs past the end of the program at {pc:#04x}"
+                return [(1, None)]
+            # The program RAM is cleared, this is a NOP in a delay slot
+            return [(1, _State(next_pc, lop, top, None))]
+
+        inst = self.instructions[pc]
+        cmd = inst.specialCommand
+        if cmd is None:
+            lop, top = _bus_writes(inst, lop, top, None if worst else 0)
+            return [(1, _State(next_pc, lop, top, None))]
+
+        if isinstance(cmd, EndCommand):
+            return [(1, None)]
+
+        if isinstance(cmd, MVICommand):
+            written = _State(next_pc, lop, top, None)
+            if cmd.destination == MVIStorageDestination.LOP:
+                written = written._replace(lop=_sign_extend(cmd.immediate, 19 if cmd.condition else 25) & MAX_LOP)
+            elif cmd.destination == MVIStorageDestination.PC:
+                # A subroutine call: TOP gets the address of the delay slot, the pending target in a delay slot
+                written = _State(next_pc, lop, next_pc, cmd.immediate & 0xFF)
+            skipped = _State(next_pc, lop, top, None)
+            return [(1, written)] if cmd.condition is None else [(1, written), (1, skipped)]
+
+        if isinstance(cmd, JumpCommand):
+            taken = _State(next_pc, lop, top, cmd.immediate & 0xFF)
+            if cmd.condition is None:
+                return [(1, taken)]
+            return [(1, taken), (1, _State(next_pc, lop, top, None))]
+
+        if isinstance(cmd, LoopCommand):
+            if cmd.opcode == LoopOpcodes.BTM:
+                return self._btm(state, worst)
+            return self._lps(state, worst)
+
+        if isinstance(cmd, DMACommand):
+            cost = 1
+            if cmd.hold:
+                if cmd.dma_counter_mode == DMACounterMode.IMMEDIATE:
+                    cost += cmd.data_size
+                elif worst:
+                    cost += MAX_DMA_COUNT
+            return [(cost, _State(next_pc, lop, top, None))]
+
+        raise Exception(f"Unexpected command at {pc:#04x}: {cmd}")
+
+    def _lps(self, state: _State, worst: bool) -> List[Tuple[int, Optional[_State]]]:
+        """
+        LPS runs the next instruction, the jump target when it's in a delay slot, LOP + 1 times.
+        """
+        pc, lop, top, branch = state
+        repeated = (pc + 1) & 0xFF if branch is None else branch
+        count = 1 + (MAX_LOP if lop is None else lop)
+        if repeated >= len(self.instructions):
+            return [(1 + count, _State((repeated + 1) & 0xFF, 0, top, None))]
+        cmd = self.instructions[repeated].specialCommand
+        if isinstance(cmd, LoopCommand) and cmd.opcode == LoopOpcodes.LPS:
+            # An LPS repeated by LPS does nothing
+            return [(1 + count, _State((repeated + 1) & 0xFF, 0, top, None))]
+        if isinstance(cmd, LoopCommand) or (isinstance(cmd, MVICommand)
+                                            and cmd.destination == MVIStorageDestination.PC):
+            self.notes[pc] = f"LPS at {pc:#04x} repeats a jump changing LOP or TOP"
+            self.unknown = True
+            return [(1 + count, None)]
+        # Each time, the instruction costs what it does alone. A jump is taken after the last time.
+        return [(1 + count * cost, None if successor is None else successor._replace(lop=0))
+                for cost, successor in self._successors(_State(repeated, lop, top, None), worst)]
+
+    def _btm(self, state: _State, worst: bool) -> List[Tuple[int, Optional[_State]]]:
+        pc, lop, top, branch = state
+        # In a delay slot, the instruction after the BTM is the target of the pending jump
+        next_pc = (pc + 1) & 0xFF if branch is None else branch
+        falls_through = _State(next_pc, 0, top, None)
+        if lop == 0:
+            return [(1, falls_through)]
+        # LOP is either known and not 0, or loaded from data and maybe 0
+        edges = [] if lop else [(1, falls_through)]
+        if top == RETURN_ADDRESS:
+            # Returning from the subroutine to its caller, with its delay slot
+            return edges + [(2, None)]
+        if top is None:
+            self.notes[pc] = f"BTM at {pc:#04x} jumps to a TOP loaded from data"
+            self.unknown = True
+            # At least the delay slot runs
+            return edges or [(2, None)]
+
+        iteration = None if branch is not None else self._iteration(pc, top, worst)
+        if iteration is not None:
+            # The remaining passes through the body, then the last BTM which falls through
+            return [(1 + (MAX_LOP if lop is None else lop) * (1 + iteration), falls_through)]
+        # Followed pass by pass: with LOP loaded from data, going back to the BTM is a loop depending on data
+        return edges + [(1, _State(next_pc, None if lop is None else lop - 1, top, top))]
+
+    def _iteration(self, btm: int, top: int, worst: bool) -> Optional[int]:
+        """
+        Cost of one more pass through the loop of a BTM: its delay slot, then the body from TOP back to the BTM.
+        :return: None when the body may leave the loop, change LOP or TOP, or loop on data
+        """
+        key = (btm, top, worst)
+        if key not in self._iterations:
+            self._iterations[key] = self._measure_iteration(btm, top, worst)
+        return self._iterations[key]
+
+    def _measure_iteration(self, btm: int, top: int, worst: bool) -> Optional[int]:
+        start = _State((btm + 1) & 0xFF, 0, top, top)
+        graph = {}
+        pending = [start]
+        while pending:
+            state = pending.pop()
+            if state in graph:
+                continue
+            if len(graph) >= MAX_STATES or not self._keeps_loop(state.pc):
+                return None
+            edges = []
+            for cost, successor in self._successors(state, worst):
+                if successor is None:
+                    return None
+                if successor.pc == btm:
+                    if successor.branch is not None:
+                        return None
+                    edges.append((cost, None))
+                    continue
+                edges.append((cost, successor))
+                pending.append(successor)
+            graph[state] = edges
+        if worst:
+            return _longest(graph, start)[0]
+        return _shortest(graph, start)
+
+    def _keeps_loop(self, pc: int) -> bool:
+        """
+        Whether an instruction leaves LOP and TOP alone, and isn't a loop itself.
+        """
+        if pc >= len(self.instructions):
+            return True
+        inst = self.instructions[pc]
+        cmd = inst.specialCommand
+        if cmd is None:
+            d1 = inst.d1BusControlCommand
+            return d1.opcode == D1BusOpcodes.NOP or d1.destination not in (D1BusDataDestination.LOP,
+                                                                            D1BusDataDestination.TOP)
+        if isinstance(cmd, MVICommand):
+            return cmd.destination not in (MVIStorageDestination.LOP, MVIStorageDestination.PC)
+        return not isinstance(cmd, LoopCommand)
+
+
+def _bus_writes(inst: Instruction, lop: Optional[int], top: Optional[int],
+                unknown_lop: Optional[int]) -> Tuple[Optional[int], Optional[int]]:
+    """
+    Follows the D1-Bus writes to LOP and TOP.
+    """
+    d1 = inst.d1BusControlCommand
+    if d1.opcode == D1BusOpcodes.NOP:
+        return lop, top
+    immediate = _sign_extend(d1.immediate, 8) if d1.opcode == D1BusOpcodes.MOV_IMM_DST else None
+    if d1.destination == D1BusDataDestination.LOP:
+        lop = unknown_lop if immediate is None else immediate & MAX_LOP
+    elif d1.destination == D1BusDataDestination.TOP:
+        top = None if immediate is None else immediate & 0xFF
+    return lop, top
+
+
+def _sign_extend(value: int, bits: int) -> int:
+    value &= (1 << bits) - 1
+    return value - (1 << bits) if value & (1 << (bits - 1)) else value
+
+
+def _shortest(graph: Dict[_State, List[Tuple[int, Optional[_State]]]], start: _State) -> Optional[int]:
+    """
+    Dijkstra's algorithm, up to the first stop.
+    """
+    distances = {start: 0}
+    queue = [(0, 0, start)]
+    counter = 1  # Ties are broken by insertion order, states don't need to be comparable
+    while queue:
+        distance, _, state = heapq.heappop(queue)
+        if state is None:
+            return distance
+        if distance > distances[state]:
+            continue
+        for cost, successor in graph[state]:
+            total = distance + cost
+            if successor is None or total < distances.get(successor, total + 1):
+                if successor is not None:
+                    distances[successor] = total
+                heapq.heappush(queue, (total, counter, successor))
+                counter += 1
+    return None
+
+
+def _longest(graph: Dict[_State, List[Tuple[int, Optional[_State]]]], start: _State) -> Tuple[Optional[int],
+                                                                                                Optional[int]]:
+    """
+    Longest path, with a depth first search in post order.
+    :return: The length, and the address of a reachable loop if there is one (then the length is None)
+    """
+    longest: Dict[_State, int] = {}
+    in_progress = set()
+    stack = [(start, 0)]
+    while stack:
+        state, index = stack.pop()
+        edges = graph[state]
+        if index == 0:
+            in_progress.add(state)
+        if index < len(edges):
+            stack.append((state, index + 1))
+            successor = edges[index][1]
+            if successor is None or successor in longest:
+                continue
+            if successor in in_progress:
+                return None, successor.pc
+            stack.append((successor, 0))
+            continue
+
+        in_progress.discard(state)
+        longest[state] = max(cost + (0 if successor is None else longest[successor]) for cost, successor in edges)
+    return longest[start], None
+
+
+def load_program(input_file: str) -> Program:
+    """
+    Reads a program from a binary, or from a source file for any other extension.
+    """
+    if input_file.lower().endswith(".bin"):
+        return Program.from_bytes(read_file_content(input_file))
+    return Program.from_text(list(read_file_lines(input_file)))
+
+
+def do_analyze(args: List[str]):
+    """
+    Entry point for the analyze command.
+    """
+    parser = argparse.ArgumentParser(prog="despiste analyze", description="Analyze a DSP program without running it.")
+    parser.add_argument("input", help="Source or binary (.bin) file")
+    parser.add_argument("--cycles", action="store_true", help="Report best and worst case cycles per entry point")
+    parser.add_argument("--budget", type=int,
+                        help="Exit with code 1 when the worst case of an entry point exceeds this many cycles")
+    options = parser.parse_args(args)
+    if not options.cycles:
+        parser.error("no analysis requested, use --cycles")
+
+    if not os.path.exists(options.input):
+        logger.error(f"Error: Could not find the input file {options.input}")
+        raise SystemExit(2)
+
+    analyzer = CycleAnalyzer(load_program(options.input))
+    failed = False
+    for entry in analyzer.entry_points():
+        try:
+            report = analyzer.analyze(entry)
+        except Exception as e:
+            logger.error(f"Error: Could not analyze entry {entry:#04x}: {e}")
+            failed = True
+            continue
+        print(report.to_text())
+        if options.budget is not None and (report.worst is None or report.worst > options.budget):
+            failed = True
+            logger.error(f"Entry {entry:#04x} is over the budget of {options.budget} cycles")
+    for stall in analyzer.dmah_stalls():
+        print(stall)
+    raise SystemExit(1 if failed else 0)
@@ -0,0 +1,127 @@
+import logging
+from array import array
+from enum import Enum
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+from despiste.commands import MVICommand, JumpCommand
+from despiste.instruction import Instruction
+from despiste.instruction_context import InstructionContext
+
+logger = logging.getLogger(__name__)
+
+
+class LineKind(Enum):
+    LABEL = "label"
+    CONSTANT = "constant"
+    INSTRUCTION = "instruction"
+
+
+def parse_lines(lines: Iterable[str]) -> Iterator[Tuple[int, LineKind, object]]:
+    """
+    Lexes source lines one at a time, skipping comments and empty lines.
+    Yields tuples of (line number, kind, payload) where the payload is:
+     - the label name (with its colon) for LABEL
+     - the whole line for CONSTANT
+     - the list of elements for INSTRUCTION
+    A label followed by an instruction in the same line yields both, label first.
+    """
+    for line_number, line in enumerate(lines, 1):
+        line = line.replace(',', ' ').replace('\t', ' ').upper().strip()
+        # Is it a full line comment? Or perhaps empty?
+        if line.startswith(';') or line == '':
+            continue
+        # Remove any trailing comment
+        line = line.split(';', 1)[0]
+        elements = line.split()
+        # Is it a label line?
+        # The check for spaces is needed to avoid stuff like 'JMP LABEL:'
+        if elements[0].endswith(':'):
+            yield line_number, LineKind.LABEL, elements[0]
+            if len(elements) > 1:
+                yield line_number, LineKind.INSTRUCTION, elements[1:]
+        # Is it a constant?
+        elif '=' in line:
+            yield line_number, LineKind.CONSTANT, line
+        else:
+            yield line_number, LineKind.INSTRUCTION, elements
+
+
+class _FixupContext(InstructionContext):
+    """
+    A context that does not fail on names that are not registered yet.
+    They resolve to 0 and are remembered, so that the instruction can be patched once they are known.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.unresolved: List[Tuple[str, bool]] = []
+
+    def resolve(self, name: str, use_constant: bool = True) -> Optional[int]:
+        value = super().resolve(name, use_constant)
+        if value is None:
+            self.unresolved.append((name, use_constant))
+            return 0
+        return value
+
+
+def _immediate_mask(inst: Instruction) -> int:
+    """
+    Returns the bits holding the immediate value of an instruction that can reference labels or constants.
+    """
+    cmd = inst.specialCommand
+    if isinstance(cmd, MVICommand):
+        return 0x7FFFF if cmd.condition else 0x1FFFFFF
+    if isinstance(cmd, JumpCommand):
+        return 0xFF
+    raise Exception(f"Unexpected reference in {inst.to_text()}")
+
+
+def assemble(lines: Iterable[str], context: Optional[InstructionContext] = None) -> array:
+    """
+    Single pass assembler.
+    Lines are consumed lazily and every instruction is encoded as soon as it is parsed.
+    References to labels or constants that are declared later are recorded in a fixup table,
+    and the encoded words are patched at the end.
+    :param lines: Source lines, e.g. an open file
+    :param context: If given, labels and constants are also registered into it
+    :return: The encoded instructions, as an array of 32 bits words
+    """
+    fixup_context = _FixupContext()
+    words = array("I")
+    fixups = []  # Tuples of (instruction index, name, use_constant, mask, line number)
+
+    for line_number, kind, payload in parse_lines(lines):
+        if kind == LineKind.LABEL:
+            # The label should point to the next instruction to be registered
+            fixup_context.register_label(payload, len(words))
+        elif kind == LineKind.CONSTANT:
+            fixup_context.register_constant(payload)
+        else:
+            fixup_context.unresolved.clear()
+            try:
+                inst = Instruction.from_text(payload, fixup_context)
+            except Exception as e:
+                logger.error(f"An error ({str(e)}) occurred in line {line_number}!\n")
+                logger.error(f"  {' '.join(payload)}")
+                raise e
+
+            if fixup_context.unresolved:
+                mask = _immediate_mask(inst)
+                for name, use_constant in fixup_context.unresolved:
+                    fixups.append((len(words), name, use_constant, mask, line_number))
+            words.append(inst.to_word())
+
+    for index, name, use_constant, mask, line_number in fixups:
+        value = InstructionContext.resolve(fixup_context, name, use_constant)
+        if value is None:
+            use = 'constant' if use_constant else 'label'
+            msg = f"Immediate value uses a {use} that does not exist: {name}"
+            logger.error(f"An error ({msg}) occurred in line {line_number}!\n")
+            raise Exception(msg)
+        words[index] |= value & mask
+
+    if context is not None:
+        context.labels.update(fixup_context.labels)
+        context.constants.update(fixup_context.constants)
+
+    return words
@@ -0,0 +1,291 @@
+"""
+Batch disassembly of large amounts of 32 bits words.
+
+Instead of building an Instruction per word, every word is classified and all its fields are extracted
+into column arrays (one entry per word). Instructions are only built when asked for.
+NumPy is used when it is installed, otherwise the columns are filled with the pure Python table decoder.
+"""
+import struct
+from array import array
+from enum import IntEnum
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from despiste.commands import AluControlCommand, XBusControlCommand, YBusControlCommand, D1BusControlCommand, \
+    MVIStorageDestination, MVIConditionStatus, DMADataRam, build_decode_table, field_table
+from despiste.instruction import Instruction
+from despiste.program import Program
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+HAVE_NUMPY = np is not None
+
+
+class InstructionKind(IntEnum):
+    NORMAL = 0
+    MVI = 1
+    DMA = 2
+    JMP = 3
+    LOOP = 4
+    END = 5
+    INVALID = 6
+
+
+# Instruction kind, indexed by the top 4 bits of the word
+KIND_BY_NIBBLE = (
+    [InstructionKind.NORMAL] * 4
+    + [InstructionKind.INVALID] * 4
+    + [InstructionKind.MVI] * 4
+    + [InstructionKind.DMA, InstructionKind.JMP, InstructionKind.LOOP, InstructionKind.END]
+)
+
+# Columns extracted from the words: name, kind of instruction it belongs to, lowest bit and width.
+# Words of a different kind get a 0 in the column.
+FIELDS = [
+    ("alu", InstructionKind.NORMAL, 26, 4),
+    ("x_opcode", InstructionKind.NORMAL, 23, 3),
+    ("x_source", InstructionKind.NORMAL, 20, 3),
+    ("y_opcode", InstructionKind.NORMAL, 17, 3),
+    ("y_source", InstructionKind.NORMAL, 14, 3),
+    ("d1_opcode", InstructionKind.NORMAL, 12, 2),
+    ("d1_destination", InstructionKind.NORMAL, 8, 4),
+    ("d1_source", InstructionKind.NORMAL, 0, 4),  # Meaningful when d1_opcode is MOV_SRC_DST
+    ("d1_immediate", InstructionKind.NORMAL, 0, 8),  # Meaningful when d1_opcode is MOV_IMM_DST
+    ("mvi_destination", InstructionKind.MVI, 26, 4),
+    ("mvi_conditional", InstructionKind.MVI, 25, 1),
+    ("mvi_condition", InstructionKind.MVI, 19, 6),  # Meaningful when mvi_conditional is set
+    ("jmp_condition", InstructionKind.JMP, 19, 7),
+    ("jmp_target", InstructionKind.JMP, 0, 8),
+    ("dma_add_mode", InstructionKind.DMA, 15, 3),
+    ("dma_hold", InstructionKind.DMA, 14, 1),
+    ("dma_counter_mode", InstructionKind.DMA, 13, 1),
+    ("dma_mode", InstructionKind.DMA, 12, 1),
+    ("dma_ram", InstructionKind.DMA, 8, 3),
+    ("dma_size", InstructionKind.DMA, 0, 8),  # Meaningful when dma_counter_mode is IMMEDIATE
+    ("dma_counter_ram", InstructionKind.DMA, 0, 3),  # Meaningful when dma_counter_mode is REFERENCED
+    ("loop_single", InstructionKind.LOOP, 27, 1),  # 1 for LPS, 0 for BTM
+    ("end_interrupt", InstructionKind.END, 27, 1),  # 1 for ENDI, 0 for END
+]
+
+# Extra column for MVI immediates, which are 19 bits long when conditional and 25 bits long otherwise
+MVI_IMMEDIATE = "mvi_immediate"
+
+
+def _valid_table(size: int, decode) -> List[bool]:
+    return [entry is not None for entry in build_decode_table(size, decode)]
+
+
+def _valid_values(size: int, enum_type) -> List[bool]:
+    table = field_table(enum_type)
+    return [value in table for value in range(size)]
+
+
+class DecodedWords:
+    """
+    The result of a batch decode. Each column holds one value per word, see FIELDS.
+    Columns are NumPy arrays when NumPy was used, and arrays from the array module otherwise.
+    """
+
+    def __init__(self, words, columns: Dict[str, Sequence[int]]):
+        self.words = words
+        self.columns = columns
+
+    @property
+    def kind(self) -> Sequence[int]:
+        return self.columns["kind"]
+
+    @property
+    def valid(self) -> Sequence[int]:
+        return self.columns["valid"]
+
+    def __len__(self) -> int:
+        return len(self.words)
+
+    def __getitem__(self, name: str) -> Sequence[int]:
+        return self.columns[name]
+
+    def instruction(self, index: int) -> Instruction:
+        return Instruction.from_word(int(self.words[index]))
+
+    def program(self, start: int = 0, end: Optional[int] = None) -> Program:
+        return Program.from_words(int(word) for word in self.words[start:end])
+
+
+def decode_words(words, use_numpy: Optional[bool] = None) -> DecodedWords:
+    """
+    Classifies a sequence of 32 bits words and extracts all their fields.
+    :param words: A NumPy array of uint32 or any sequence of integers
+    :param use_numpy: Force or forbid the NumPy path. By default it is used when available.
+    """
+    if use_numpy is None:
+        use_numpy = HAVE_NUMPY
+    if use_numpy:
+        if not HAVE_NUMPY:
+            raise Exception("NumPy is not installed")
+        return _decode_numpy(words)
+    return _decode_python(words)
+
+
+def decode_bytes(buffer, use_numpy: Optional[bool] = None) -> DecodedWords:
+    """
+    Same as decode_words, reading big-endian words from a bytes-like object in place.
+    """
+    view = memoryview(buffer).cast("B")
+    assert view.nbytes % 4 == 0
+    if use_numpy is None:
+        use_numpy = HAVE_NUMPY
+    if use_numpy:
+        return decode_words(np.frombuffer(view, dtype=">u4"), True)
+    return decode_words(array("I", (word for word, in struct.iter_unpack(">I", view))), False)
+
+
+def classify_words(words, use_numpy: Optional[bool] = None) -> Tuple[Sequence[int], Sequence[int]]:
+    """
+    Cheaper than decode_words when only the kind and validity of each word are needed.
+    :return: The kind and valid columns
+    """
+    if use_numpy is None:
+        use_numpy = HAVE_NUMPY
+    if use_numpy:
+        return _classify_numpy(np.asarray(words).astype(np.uint32, copy=False))
+
+    kinds = array("B")
+    valid = array("B")
+    for word in words:
+        word = int(word)
+        kinds.append(KIND_BY_NIBBLE[word >> 28])
+        valid.append(is_valid_word(word))
+    return kinds, valid
+
+
+def is_valid_word(word: int) -> bool:
+    """
+    Tells whether Instruction.from_word would accept the word, without decoding it.
+    """
+    tables = _python_tables()
+    kind = KIND_BY_NIBBLE[word >> 28]
+    if kind == InstructionKind.NORMAL:
+        return (tables["alu"][word >> 26 & 0xF]
+                and tables["x"][word >> 20 & 0x3F]
+                and tables["y"][word >> 14 & 0x3F]
+                and tables["d1"][word >> 8 & 0x3F]
+                and (word >> 12 & 0b11 != 0b11 or tables["d1_source"][word & 0xF]))
+    if kind == InstructionKind.MVI:
+        return (tables["mvi_destination"][word >> 26 & 0xF]
+                and (not word >> 25 & 1 or tables["mvi_condition"][word >> 19 & 0x3F]))
+    if kind == InstructionKind.DMA:
+        return word >> 18 & 0x3FF == 0 and tables["dma_ram"][word >> 8 & 0b111]
+    return kind != InstructionKind.INVALID
+
+
+def _classify_numpy(w) -> Tuple[Sequence[int], Sequence[int]]:
+    kind = np.asarray(KIND_BY_NIBBLE, dtype=np.uint8)[w >> 28]
+    tables = _numpy_valid_tables()
+    d1_opcode = (w >> 12) & 0b11
+    mvi_conditional = (w >> 25) & 1
+    normal = (
+        tables["alu"][(w >> 26) & 0xF]
+        & tables["x"][(w >> 20) & 0x3F]
+        & tables["y"][(w >> 14) & 0x3F]
+        & tables["d1"][(w >> 8) & 0x3F]
+        & ((d1_opcode != 0b11) | tables["d1_source"][w & 0xF])
+    )
+    mvi = (
+        tables["mvi_destination"][(w >> 26) & 0xF]
+        & ((mvi_conditional == 0) | tables["mvi_condition"][(w >> 19) & 0x3F])
+    )
+    dma = (((w >> 18) & 0x3FF) == 0) & tables["dma_ram"][(w >> 8) & 0b111]
+
+    valid = np.select(
+        [kind == InstructionKind.NORMAL, kind == InstructionKind.MVI, kind == InstructionKind.DMA,
+         kind == InstructionKind.INVALID],
+        [normal, mvi, dma, False],
+        default=True,
+    )
+    return kind, valid.astype(np.bool_)
+
+
+def _decode_numpy(words) -> DecodedWords:
+    w = np.asarray(words).astype(np.uint32, copy=False)
+    kind, valid = _classify_numpy(w)
+    columns = {"kind": kind}
+
+    for name, field_kind, shift, width in FIELDS:
+        values = (w >> shift) & ((1 << width) - 1)
+        dtype = np.uint8 if width <= 8 else np.uint32
+        columns[name] = np.where(kind == field_kind, values, 0).astype(dtype)
+
+    is_mvi = kind == InstructionKind.MVI
+    columns[MVI_IMMEDIATE] = np.where(
+        is_mvi, np.where(columns["mvi_conditional"] == 1, w & 0x7FFFF, w & 0x1FFFFFF), 0).astype(np.uint32)
+
+    columns["valid"] = valid
+    return DecodedWords(w, columns)
+
+
+_tables = None
+_numpy_tables = None
+
+
+def _python_tables() -> Dict[str, List[bool]]:
+    global _tables
+    if _tables is None:
+        _tables = _valid_tables()
+    return _tables
+
+
+def _numpy_valid_tables() -> dict:
+    global _numpy_tables
+    if _numpy_tables is None:
+        _numpy_tables = {
+            name: np.asarray(table, dtype=np.bool_) for name, table in _python_tables().items()
+        }
+    return _numpy_tables
+
+
+def _valid_tables() -> Dict[str, List[bool]]:
+    return {
+        "alu": _valid_table(1 << 4, AluControlCommand.from_word),
+        "x": _valid_table(1 << 6, XBusControlCommand.from_word),
+        "y": _valid_table(1 << 6, YBusControlCommand.from_word),
+        # Upper 6 bits of the D1 field (opcode and destination), checked with a valid source
+        "d1": _valid_table(1 << 6, lambda value: D1BusControlCommand.from_word(value << 8)),
+        # Lower 4 bits of the D1 field, checked with a valid opcode and destination
+        "d1_source": _valid_table(1 << 4, lambda value: D1BusControlCommand.from_word(0b11 << 12 | value)),
+        "mvi_destination": _valid_values(1 << 4, MVIStorageDestination),
+        "mvi_condition": _valid_values(1 << 6, MVIConditionStatus),
+        "dma_ram": _valid_values(1 << 3, DMADataRam),
+    }
+
+
+def _decode_python(words) -> DecodedWords:
+    typecodes = {name: "B" if width <= 8 else "I" for name, _, _, width in FIELDS}
+    columns = {name: array(typecodes[name]) for name, _, _, _ in FIELDS}
+    kinds = array("B")
+    valid = array("B")
+    mvi_immediate = array("I")
+
+    for word in words:
+        word = int(word)
+        kind = KIND_BY_NIBBLE[word >> 28]
+        kinds.append(kind)
+        for name, field_kind, shift, width in FIELDS:
+            columns[name].append((word >> shift) & ((1 << width) - 1) if kind == field_kind else 0)
+
+        if kind == InstructionKind.MVI:
+            mvi_immediate.append(word & (0x7FFFF if word >> 25 & 1 else 0x1FFFFFF))
+        else:
+            mvi_immediate.append(0)
+
+        try:
+            Instruction.from_word(word)
+            valid.append(1)
+        except Exception:
+            valid.append(0)
+
+    columns["kind"] = kinds
+    columns[MVI_IMMEDIATE] = mvi_immediate
+    columns["valid"] = valid
+    return DecodedWords(words, columns)
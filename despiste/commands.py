@@ -1,8 +1,12 @@
+import copy
+import logging
 from enum import Enum
-from typing import List, Optional
+from typing import List, Optional, Dict, Callable, Tuple
 
 from despiste.instruction_context import InstructionContext
-from despiste.utils import cut
+from despiste.utils import bit_field, TRACE
+
+logger = logging.getLogger(__name__)
 
 
 def get_immediate_value_label_aware(value: str, context: Optional[InstructionContext]):
@@ -25,10 +29,9 @@ def get_immediate_value(value: str, context: Optional[InstructionContext], use_c
         return int(value)
     except ValueError:
         if context:
-            if use_constant and context.constants.get(value, None):
-                return context.constants.get(value)
-            elif not use_constant and context.labels.get(value, None):
-                return context.labels.get(value)
+            resolved = context.resolve(value, use_constant)
+            if resolved is not None:
+                return resolved
             else:
                 use = 'constant' if use_constant else 'label'
                 msg = f"Immediate value uses a {use} that does not exist: {value}"
@@ -37,6 +40,60 @@ def get_immediate_value(value: str, context: Optional[InstructionContext], use_c
             raise Exception(f"Immediate value is must be a number because no context was passed.")
 
 
+# Lookup tables between the integer encoding of an Enum and its members, filled on first use
+_field_to_member: Dict[type, Dict[int, Enum]] = {}
+_member_to_field: Dict[Enum, int] = {}
+
+
+def field_table(enum_type) -> Dict[int, Enum]:
+    """
+    Enum members in this module store their encoding as a string of bits.
+    Returns a dictionary from the integer value of those bits to the member.
+    """
+    table = _field_to_member.get(enum_type)
+    if table is None:
+        table = {int(member.value, 2): member for member in enum_type}
+        _field_to_member[enum_type] = table
+        for value, member in table.items():
+            _member_to_field[member] = value
+    return table
+
+
+def enum_from_field(enum_type, value: int, width: int):
+    """
+    Returns the member of enum_type whose encoding matches the integer value.
+    Raises ValueError, as the Enum constructor would, if there is no such member.
+    """
+    try:
+        return field_table(enum_type)[value]
+    except KeyError:
+        raise ValueError(f"{value:0{width}b} is not a valid {enum_type.__name__}") from None
+
+
+def enum_to_field(member: Enum) -> int:
+    try:
+        return _member_to_field[member]
+    except KeyError:
+        field_table(type(member))
+        return _member_to_field[member]
+
+
+def build_decode_table(size: int, decode: Callable[[int], object]) -> list:
+    """
+    Precomputes the decoded form of every possible value of a small bit field.
+    Values that do not decode to a valid command are stored as None.
+    :param size: Number of possible values of the field
+    :param decode: Function returning the decoded value, or raising ValueError
+    """
+    table = []
+    for value in range(size):
+        try:
+            table.append(decode(value))
+        except ValueError:
+            table.append(None)
+    return table
+
+
 class OpCodes(Enum):
     pass
 
@@ -47,6 +104,7 @@ class Command:
     The DSP can execute up to 6 commands in a single cycle (!).
     The Sega SCU official manual uses the Command word in the same meaning.
     """
+    __slots__ = ("opcode",)
 
     opcode: OpCodes
 
@@ -57,6 +115,54 @@ class Command:
         return '\t\t\t'.join(self.to_text())
 
 
+class BusCommand(Command):
+    """
+    Commands of normal instructions (ALU, X-Bus, Y-Bus and D1-Bus) are small immutable values.
+    They are interned: a single object exists for each distinct value, and the constructor returns it.
+    """
+    __slots__ = ()
+
+    # Names of the slots holding the value, in the order of the constructor arguments
+    _fields: Tuple[str, ...] = ("opcode",)
+    _interned: Dict[tuple, 'BusCommand']
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._interned = {}
+
+    @classmethod
+    def _intern(cls, *values) -> 'BusCommand':
+        cmd = cls._interned.get(values)
+        if cmd is None:
+            cmd = object.__new__(cls)
+            for name, value in zip(cls._fields, values):
+                object.__setattr__(cmd, name, value)
+            cmd = cls._interned.setdefault(values, cmd)
+        return cmd
+
+    def _values(self) -> tuple:
+        return tuple(getattr(self, name) for name in self._fields)
+
+    def __setattr__(self, key, value):
+        raise AttributeError(f"Can't set {key}: {type(self).__name__} is immutable, create a new one instead")
+
+    def __delattr__(self, key):
+        raise AttributeError(f"Can't delete {key}: {type(self).__name__} is immutable")
+
+    def __reduce__(self):
+        return type(self), self._values()
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __repr__(self) -> str:
+        values = ", ".join(f"{name}={value!r}" for name, value in zip(self._fields, self._values()))
+        return f"{type(self).__name__}({values})"
+
+
 class D1BusOpcodes(OpCodes):
     NOP = '00'  # No Operation
     MOV_IMM_DST = '01'  # Transfer SImm to [destination]
@@ -93,69 +199,81 @@ class D1BusDataDestination(Enum):
     CT3 = '1111'
 
 
-class D1BusControlCommand(Command):
-    source: D1BusDataSource = None
-    destination: D1BusDataDestination = None
-    immediate: int = None
+class D1BusControlCommand(BusCommand):
+    __slots__ = ("destination", "source", "immediate")
+    _fields = ("opcode", "destination", "source", "immediate")
+
+    source: Optional[D1BusDataSource]
+    destination: Optional[D1BusDataDestination]
+    immediate: Optional[int]
+
+    def __new__(cls, opcode: D1BusOpcodes, destination: Optional[D1BusDataDestination] = None,
+                source: Optional[D1BusDataSource] = None, immediate: Optional[int] = None):
+        return cls._intern(opcode, destination, source, immediate)
 
     @staticmethod
     def get_noop() -> 'D1BusControlCommand':
-        cmd = D1BusControlCommand()
-        cmd.opcode = D1BusOpcodes.NOP
-        return cmd
+        return D1BusControlCommand(D1BusOpcodes.NOP)
 
     @staticmethod
     def from_binary(source: str) -> Command:
-        cmd = D1BusControlCommand()
-        cmd.opcode = D1BusOpcodes(cut(source, 12, 14))
-        if cmd.opcode != D1BusOpcodes.NOP:
-            cmd.destination = D1BusDataDestination(cut(source, 8, 12))
+        return D1BusControlCommand.from_word(int(source, 2))
 
-        # if source is IMMEDIATE
-        if cmd.opcode == D1BusOpcodes.MOV_IMM_DST:
-            cmd.immediate = int(cut(source, 0, 8), 2)
-            cmd.source = None
-        elif cmd.opcode == D1BusOpcodes.MOV_SRC_DST:
-            cmd.immediate = None
-            cmd.source = D1BusDataSource(cut(source, 0, 4))
+    def to_binary(self) -> str:
+        return format(self.to_word(), "014b")
 
-        return cmd
+    @staticmethod
+    def from_word(source: int) -> Command:
+        """
+        Decodes the 14 bits of the D1-Bus field (bits 0 to 13 of an instruction).
+        """
+        # The upper 6 bits hold the opcode and the destination
+        entry = _D1_BUS_TABLE[source >> 8]
+        if entry is None:
+            raise ValueError(f"{source:014b} is not a valid D1-Bus command")
 
-    def to_binary(self) -> str:
-        result = self.opcode.value
+        opcode, destination = entry
 
+        # if source is IMMEDIATE
+        if opcode == D1BusOpcodes.MOV_IMM_DST:
+            return D1BusControlCommand(opcode, destination, immediate=source & 0xFF)
+        elif opcode == D1BusOpcodes.MOV_SRC_DST:
+            data_source = _D1_SOURCE_TABLE[source & 0xF]
+            if data_source is None:
+                raise ValueError(f"{source:014b} is not a valid D1-Bus command")
+            return D1BusControlCommand(opcode, destination, data_source)
+
+        return D1BusControlCommand(opcode, destination)
+
+    def to_word(self) -> int:
+        result = enum_to_field(self.opcode) << 12
         if self.opcode == D1BusOpcodes.NOP:
-            result += "000000000000"
+            return result
 
         if self.destination:
-            result += self.destination.value
+            result |= enum_to_field(self.destination) << 8
 
         if self.immediate is not None:
-            result += bin(self.immediate)[2:].zfill(8)
+            result |= self.immediate & 0xFF
         elif self.source:
-            result += "0000" + self.source.value
+            result |= enum_to_field(self.source)
 
         return result
 
     @staticmethod
     def from_text(source: List[str], context: Optional[InstructionContext] = None) -> Command:
-        cmd = D1BusControlCommand()
         if source[0] == "NOP":
             assert len(source) == 1
-            cmd.opcode = D1BusOpcodes.NOP
-            return cmd
+            return D1BusControlCommand(D1BusOpcodes.NOP)
 
-        cmd.destination = D1BusDataDestination[source[2]]
+        destination = D1BusDataDestination[source[2]]
         # Using SRC?
         try:
-            cmd.source = D1BusDataSource[source[1]]
-            cmd.opcode = D1BusOpcodes.MOV_SRC_DST
+            return D1BusControlCommand(D1BusOpcodes.MOV_SRC_DST, destination, D1BusDataSource[source[1]])
         except KeyError:
             if source[1].startswith('#'):
                 source[1] = source[1][1:]
-            cmd.immediate = int(source[1])
-            cmd.opcode = D1BusOpcodes.MOV_IMM_DST
-        return cmd
+            return D1BusControlCommand(D1BusOpcodes.MOV_IMM_DST, destination, immediate=int(source[1]))
 
     def to_text(self) -> List[str]:
         result = self.opcode.name[:3]
@@ -193,63 +311,67 @@ class XYBusDataSource(Enum):
     MC3 = '111'  # DATA RAM3, CT3++
 
 
-class YBusControlCommand(Command):
-    source: XYBusDataSource = None
+class YBusControlCommand(BusCommand):
+    __slots__ = ("source",)
+    _fields = ("opcode", "source")
+
+    source: Optional[XYBusDataSource]
+
+    _ops_with_source = [
+        YBusOpcodes.MOV_SRC_Y,
+        YBusOpcodes.MOV_SRC_Y_ALU_A,
+        YBusOpcodes.MOV_SRC_A
+    ]
+
+    def __new__(cls, opcode: YBusOpcodes, source: Optional[XYBusDataSource] = None):
+        return cls._intern(opcode, source)
 
     @staticmethod
     def get_noop() -> 'YBusControlCommand':
-        cmd = YBusControlCommand()
-        cmd.opcode = YBusOpcodes.NOP
-        return cmd
+        return YBusControlCommand(YBusOpcodes.NOP)
 
     @staticmethod
     def from_binary(source):
-        cmd = YBusControlCommand()
-        cmd.opcode = YBusOpcodes(cut(source, 3, 6))
-        ops_with_source = [
-            YBusOpcodes.MOV_SRC_Y,
-            YBusOpcodes.MOV_SRC_Y_ALU_A,
-            YBusOpcodes.MOV_SRC_A
-        ]
-        if cmd.opcode in ops_with_source:
-            cmd.source = XYBusDataSource(cut(source, 0, 3))
-        else:
-            cmd.source = None
-
-        return cmd
+        return YBusControlCommand.from_word(int(source, 2))
 
     def to_binary(self) -> str:
-        if self.source is None:
-            return f"{self.opcode.value}000"
-        else:
-            return f"{self.opcode.value}{self.source.value}"
+        return format(self.to_word(), "06b")
 
     @staticmethod
-    def from_text(source: List[str], context: Optional[InstructionContext] = None):
-        cmd = YBusControlCommand()
+    def from_word(source: int):
+        """
+        Decodes the 6 bits of the Y-Bus field (bits 14 to 19 of an instruction).
+        """
+        entry = _Y_BUS_TABLE[source]
+        if entry is None:
+            raise ValueError(f"{source:06b} is not a valid Y-Bus command")
+
+        return YBusControlCommand(*entry)
+
+    def to_word(self) -> int:
+        result = enum_to_field(self.opcode) << 3
+        if self.source is not None:
+            result |= enum_to_field(self.source)
+        return result
 
+    @staticmethod
+    def from_text(source: List[str], context: Optional[InstructionContext] = None):
         if source[0] == 'NOP':
             assert len(source) == 1
-            cmd.opcode = YBusOpcodes.NOP
-            return cmd
+            return YBusControlCommand(YBusOpcodes.NOP)
 
         if source[0] == 'CLR':
             assert len(source) == 2
             assert source[1] == "A"
-            cmd.opcode = YBusOpcodes.CLR_A
-            return cmd
+            return YBusControlCommand(YBusOpcodes.CLR_A)
 
         assert source[0] == "MOV"
         if source[2] == 'Y':
-            cmd.opcode = YBusOpcodes.MOV_SRC_Y
-            cmd.source = XYBusDataSource[source[1]]
-        else:
-            try:
-                cmd.source = XYBusDataSource[source[1]]
-                cmd.opcode = YBusOpcodes.MOV_SRC_A
-            except KeyError:
-                cmd.opcode = YBusOpcodes.MOV_ALU_A
-        return cmd
+            return YBusControlCommand(YBusOpcodes.MOV_SRC_Y, XYBusDataSource[source[1]])
+        try:
+            return YBusControlCommand(YBusOpcodes.MOV_SRC_A, XYBusDataSource[source[1]])
+        except KeyError:
+            return YBusControlCommand(YBusOpcodes.MOV_ALU_A)
 
     def to_text(self) -> List[str]:
         if self.opcode == YBusOpcodes.NOP:
@@ -279,8 +401,11 @@ class XBusOpcodes(OpCodes):
     MOV_SRC_X_MUL_P = '110'  # Undocumented combined operation
 
 
-class XBusControlCommand(Command):
-    source: XYBusDataSource = None
+class XBusControlCommand(BusCommand):
+    __slots__ = ("source",)
+    _fields = ("opcode", "source")
+
+    source: Optional[XYBusDataSource]
 
     _ops_with_source = [
         XBusOpcodes.MOV_SRC_X,
@@ -288,47 +413,48 @@ class XBusControlCommand(Command):
         XBusOpcodes.MOV_SRC_P
     ]
 
+    def __new__(cls, opcode: XBusOpcodes, source: Optional[XYBusDataSource] = None):
+        return cls._intern(opcode, source)
+
     @staticmethod
     def get_noop() -> 'XBusControlCommand':
-        cmd = XBusControlCommand()
-        cmd.opcode = XBusOpcodes.NOP
-        return cmd
-
+        return XBusControlCommand(XBusOpcodes.NOP)
 
     @staticmethod
     def from_binary(source: str):
-        cmd = XBusControlCommand()
-        cmd.opcode = XBusOpcodes(cut(source, 3, 6))
-        if cmd.opcode in cmd._ops_with_source:
-            cmd.source = XYBusDataSource(cut(source, 0, 3))
-        else:
-            cmd.source = None
-        return cmd
+        return XBusControlCommand.from_word(int(source, 2))
 
     def to_binary(self) -> str:
-        if self.source is None:
-            return f"{self.opcode.value}000"
-        else:
-            return f"{self.opcode.value}{self.source.value}"
+        return format(self.to_word(), "06b")
 
     @staticmethod
-    def from_text(source: List[str], context: Optional[InstructionContext] = None):
-        cmd = XBusControlCommand()
+    def from_word(source: int):
+        """
+        Decodes the 6 bits of the X-Bus field (bits 20 to 25 of an instruction).
+        """
+        entry = _X_BUS_TABLE[source]
+        if entry is None:
+            raise ValueError(f"{source:06b} is not a valid X-Bus command")
+
+        return XBusControlCommand(*entry)
+
+    def to_word(self) -> int:
+        result = enum_to_field(self.opcode) << 3
+        if self.source is not None:
+            result |= enum_to_field(self.source)
+        return result
 
+    @staticmethod
+    def from_text(source: List[str], context: Optional[InstructionContext] = None):
         if source[0] == 'NOP':
-            cmd.opcode = XBusOpcodes.NOP
-            return cmd
+            return XBusControlCommand(XBusOpcodes.NOP)
 
         if source[2] == 'X':
-            cmd.opcode = XBusOpcodes.MOV_SRC_X
-            cmd.source = XYBusDataSource[source[1]]
-        else:
-            try:
-                cmd.source = XYBusDataSource[source[1]]
-                cmd.opcode = XBusOpcodes.MOV_SRC_P
-            except KeyError:
-                cmd.opcode = XBusOpcodes.MOV_MUL_P
-        return cmd
+            return XBusControlCommand(XBusOpcodes.MOV_SRC_X, XYBusDataSource[source[1]])
+        try:
+            return XBusControlCommand(XBusOpcodes.MOV_SRC_P, XYBusDataSource[source[1]])
+        except KeyError:
+            return XBusControlCommand(XBusOpcodes.MOV_MUL_P)
 
     def to_text(self) -> List[str]:
         if self.opcode == XBusOpcodes.NOP:
@@ -360,39 +486,122 @@ class AluOpcodes(OpCodes):
     RL8     = '1111'  # Rotate left [ACL] 8 bits
 
 
-class AluControlCommand(Command):
+class AluControlCommand(BusCommand):
+    __slots__ = ()
+
+    def __new__(cls, opcode: AluOpcodes):
+        return cls._intern(opcode)
 
     @staticmethod
     def from_binary(source: str):
-        cmd = AluControlCommand()
-        cmd.opcode = AluOpcodes(source)
-        return cmd
+        return AluControlCommand.from_word(int(source, 2))
 
     def to_binary(self) -> str:
-        return self.opcode.value
+        return format(self.to_word(), "04b")
+
+    @staticmethod
+    def from_word(source: int):
+        """
+        Decodes the 4 bits of the ALU field (bits 26 to 29 of an instruction).
+        """
+        opcode = _ALU_TABLE[source]
+        if opcode is None:
+            raise ValueError(f"{source:04b} is not a valid AluOpcodes")
+
+        return AluControlCommand(opcode)
+
+    def to_word(self) -> int:
+        return enum_to_field(self.opcode)
 
     @staticmethod
     def from_text(source: List[str], context: Optional[InstructionContext] = None) -> Command:
         assert len(source) == 1
-        cmd = AluControlCommand()
-        cmd.opcode = AluOpcodes[source[0]]
-        return cmd
+        return AluControlCommand(AluOpcodes[source[0]])
 
     def to_text(self) -> List[str]:
         return [self.opcode.name]
 
     @staticmethod
     def get_noop() -> 'AluControlCommand':
-        cmd = AluControlCommand()
-        cmd.opcode = AluOpcodes.NOP
-        return cmd
+        return AluControlCommand(AluOpcodes.NOP)
+
+
+def _decode_d1_upper(value: int) -> tuple:
+    opcode = enum_from_field(D1BusOpcodes, value >> 4, 2)
+    if opcode == D1BusOpcodes.NOP:
+        return opcode, None
+    return opcode, enum_from_field(D1BusDataDestination, value & 0xF, 4)
+
+
+def _xy_decoder(opcodes, ops_with_source) -> Callable[[int], tuple]:
+    def decode(value: int) -> tuple:
+        opcode = enum_from_field(opcodes, value >> 3, 3)
+        if opcode in ops_with_source:
+            return opcode, enum_from_field(XYBusDataSource, value & 0b111, 3)
+        return opcode, None
+    return decode
+
+
+# Decoded form of every possible value of the normal instruction fields
+_ALU_TABLE = build_decode_table(1 << 4, lambda value: enum_from_field(AluOpcodes, value, 4))
+_X_BUS_TABLE = build_decode_table(1 << 6, _xy_decoder(XBusOpcodes, XBusControlCommand._ops_with_source))
+_Y_BUS_TABLE = build_decode_table(1 << 6, _xy_decoder(YBusOpcodes, YBusControlCommand._ops_with_source))
+_D1_BUS_TABLE = build_decode_table(1 << 6, _decode_d1_upper)
+_D1_SOURCE_TABLE = build_decode_table(1 << 4, lambda value: enum_from_field(D1BusDataSource, value, 4))
 
 
 class SpecialCommand(Command):
     """
     Represents commands that are lonely: DMA, END, JMP...
     """
-    pass
+    __slots__ = ()
+
+    def __init__(self):
+        self.opcode = None
+
+    def frozen(self) -> 'SpecialCommand':
+        """
+        Returns a copy that can't be modified, so that it can be shared. It is an instance of a subclass of the
+        command type, and copy.copy() of it returns a command that can be modified again.
+        """
+        if isinstance(self, _FrozenSpecialCommand):
+            return self
+        command_type = type(self)
+        frozen_type = _FROZEN_TYPES.get(command_type)
+        if frozen_type is None:
+            frozen_type = _FROZEN_TYPES[command_type] = type(f"Frozen{command_type.__name__}",
+                                                             (_FrozenSpecialCommand, command_type), {"__slots__": ()})
+        return _copy_slots(self, object.__new__(frozen_type))
+
+
+class _FrozenSpecialCommand:
+    __slots__ = ()
+
+    def __setattr__(self, key, value):
+        raise AttributeError(f"Can't set {key}: the command is shared, modify a copy instead")
+
+    def __delattr__(self, key):
+        raise AttributeError(f"Can't delete {key}: the command is shared, modify a copy instead")
+
+    def __copy__(self) -> SpecialCommand:
+        # The command type is the base after this class
+        return _copy_slots(self, object.__new__(type(self).__mro__[2]))
+
+    def __reduce__(self):
+        # Pickled as a copy of the command type, which can be found by name
+        return copy.copy, (self.__copy__(),)
+
+
+# Frozen subclass of each special command type, created when first needed
+_FROZEN_TYPES: Dict[type, type] = {}
+
+
+def _copy_slots(source: Command, target: Command) -> Command:
+    for klass in type(source).__mro__:
+        for name in getattr(klass, "__slots__", ()):
+            if hasattr(source, name):
+                object.__setattr__(target, name, getattr(source, name))
+    return target
 
 
 class EndOpcodes(OpCodes):
@@ -401,16 +610,26 @@ class EndOpcodes(OpCodes):
 
 
 class EndCommand(SpecialCommand):
+    __slots__ = ()
+
     opcode: EndOpcodes
 
     @staticmethod
     def from_binary(source: str) -> Command:
+        # Only the 5 opcode bits are expected here
+        return EndCommand.from_word(int(source, 2) << 27)
+
+    def to_binary(self) -> str:
+        return format(self.to_word(), "032b")
+
+    @staticmethod
+    def from_word(source: int) -> Command:
         cmd = EndCommand()
-        cmd.opcode = EndOpcodes(source)
+        cmd.opcode = enum_from_field(EndOpcodes, bit_field(source, 27, 32), 5)
         return cmd
 
-    def to_binary(self) -> str:
-        return self.opcode.value.ljust(32, "0")
+    def to_word(self) -> int:
+        return enum_to_field(self.opcode) << 27
 
     @staticmethod
     def from_text(source: List[str], context: Optional[InstructionContext] = None) -> Command:
@@ -429,16 +648,26 @@ class LoopOpcodes(OpCodes):
 
 
 class LoopCommand(SpecialCommand):
-    opcode = LoopOpcodes
+    __slots__ = ()
+
+    opcode: LoopOpcodes
 
     @staticmethod
     def from_binary(source: str) -> Command:
+        # Only the 5 opcode bits are expected here
+        return LoopCommand.from_word(int(source, 2) << 27)
+
+    def to_binary(self) -> str:
+        return format(self.to_word(), "032b")
+
+    @staticmethod
+    def from_word(source: int) -> Command:
         cmd = LoopCommand()
-        cmd.opcode = LoopOpcodes(source)
+        cmd.opcode = enum_from_field(LoopOpcodes, bit_field(source, 27, 32), 5)
         return cmd
 
-    def to_binary(self) -> str:
-        return self.opcode.value.ljust(32, "0")
+    def to_word(self) -> int:
+        return enum_to_field(self.opcode) << 27
 
     @staticmethod
     def from_text(source: List[str], context: Optional[InstructionContext] = None) -> Command:
@@ -514,66 +743,86 @@ class DMACounterRam(Enum):
 
 
 class DMACommand(SpecialCommand):
+    __slots__ = ("hold", "address_add_mode", "ram_address_pointer", "dma_mode", "data_size", "dma_counter_mode",
+                 "dma_counter_ram")
+
     opcode: DMAOpcodes
     hold: bool  # Determines if the DSP is to wait for the DMA transfer to finish?
-    address_add_mode: int = 1  # Default is 1
+    address_add_mode: int  # Default is 1
     ram_address_pointer: DMADataRam
     dma_mode: DMATransferMode
-    data_size: int = None
+    data_size: Optional[int]
     dma_counter_mode: DMACounterMode
-    dma_counter_ram: DMACounterRam
+    dma_counter_ram: Optional[DMACounterRam]
+
+    def __init__(self):
+        self.opcode = None
+        self.hold = False
+        self.address_add_mode = 1
+        self.ram_address_pointer = None
+        self.dma_mode = None
+        self.data_size = None
+        self.dma_counter_mode = None
+        self.dma_counter_ram = None
 
     @staticmethod
     def from_binary(source: str):
         assert len(source) == 32
+        return DMACommand.from_word(int(source, 2))
+
+    def to_binary(self) -> str:
+        return format(self.to_word(), "032b")
+
+    @staticmethod
+    def from_word(source: int):
         cmd = DMACommand()
 
         # DMA mode
-        cmd.dma_mode = DMATransferMode(cut(source, 12, 13))
-        cmd.hold = cut(source, 14, 15) == "1"
+        cmd.dma_mode = enum_from_field(DMATransferMode, bit_field(source, 12, 13), 1)
+        cmd.hold = bit_field(source, 14, 15) == 1
 
-        if cut(source, 13, 14) == "1":
+        if bit_field(source, 13, 14) == 1:
             cmd.dma_counter_mode = DMACounterMode.REFERENCED
         else:
             cmd.dma_counter_mode = DMACounterMode.IMMEDIATE
 
         # padding
-        assert cut(source, 18, 28) == "0000000000"
+        assert bit_field(source, 18, 28) == 0
         # Add mode
-        cmd.address_add_mode = DMA_ADD_REFERENCE[int(cut(source, 15, 18), 2)]
+        cmd.address_add_mode = DMA_ADD_REFERENCE[bit_field(source, 15, 18)]
 
         # Destination
-        cmd.ram_address_pointer = DMADataRam(cut(source, 8, 11))
+        cmd.ram_address_pointer = enum_from_field(DMADataRam, bit_field(source, 8, 11), 3)
         if cmd.dma_counter_mode == DMACounterMode.IMMEDIATE:
-            cmd.data_size = int(cut(source, 0, 8), 2)
+            cmd.data_size = bit_field(source, 0, 8)
         else:
-            cmd.dma_counter_ram = DMACounterRam(cut(source, 0, 3))
+            cmd.dma_counter_ram = enum_from_field(DMACounterRam, bit_field(source, 0, 3), 3)
 
         # Opcode
-        bits = f"{cut(source, 28, 32)}_{cmd.address_add_mode}"
+        bits = f"{bit_field(source, 28, 32):04b}_{cmd.address_add_mode}"
         if cmd.hold:
             bits += "H"
         cmd.opcode = DMAOpcodes(bits)
 
         return cmd
 
-    def to_binary(self) -> str:
-        result = self.opcode.value[0:4] + "0000000000"               # opcode + padding
+    def to_word(self) -> int:
+        result = int(self.opcode.value[0:4], 2) << 28  # opcode, followed by 10 bits of padding
         add_value = list(DMA_ADD_REFERENCE.keys())[list(DMA_ADD_REFERENCE.values()).index(self.address_add_mode)]
-        result += bin(add_value)[2:].rjust(3, "0")  # add mode
+        result |= add_value << 15  # add mode
 
         # DMA modes
-        result += "1" if self.hold else "0"
-        result += self.dma_counter_mode.value
-        result += self.dma_mode.value
-
-        result += "0"  # padding
+        if self.hold:
+            result |= 1 << 14
+        result |= enum_to_field(self.dma_counter_mode) << 13
+        result |= enum_to_field(self.dma_mode) << 12
 
-        result += self.ram_address_pointer.value
+        # Bit 11 is padding
+        result |= enum_to_field(self.ram_address_pointer) << 8
         if self.dma_counter_mode == DMACounterMode.IMMEDIATE:
-            result += bin(self.data_size)[2:].rjust(8, "0")
+            result |= self.data_size & 0xFF
         else:
-            result += self.dma_counter_ram.value.rjust(8, "0")
+            result |= enum_to_field(self.dma_counter_ram)
 
         return result
 
@@ -662,10 +911,18 @@ class MVIConditionStatus(Enum):
 
 
 class MVICommand(SpecialCommand):
+    __slots__ = ("immediate", "destination", "condition")
+
     opcode: MVIOpcodes
     immediate: int
     destination: MVIStorageDestination
-    condition: MVIConditionStatus
+    condition: Optional[MVIConditionStatus]
+
+    def __init__(self):
+        self.opcode = None
+        self.immediate = None
+        self.destination = None
+        self.condition = None
 
     @staticmethod
     def from_text(source: List[str], context: Optional[InstructionContext] = None) -> Command:
@@ -696,25 +953,32 @@ class MVICommand(SpecialCommand):
     @staticmethod
     def from_binary(source: str) -> Command:
         assert len(source) == 32
+        return MVICommand.from_word(int(source, 2))
+
+    def to_binary(self) -> str:
+        return format(self.to_word(), "032b")
+
+    @staticmethod
+    def from_word(source: int) -> Command:
         cmd = MVICommand()
-        cmd.opcode = MVIOpcodes(cut(source, 30, 32))
-        cmd.destination = MVIStorageDestination(cut(source, 26, 30))
-        if cut(source, 25, 26) == "1":
-            cmd.condition = MVIConditionStatus(cut(source, 19, 25))
-            cmd.immediate = int(cut(source, 0, 19), 2)
+        cmd.opcode = enum_from_field(MVIOpcodes, bit_field(source, 30, 32), 2)
+        cmd.destination = enum_from_field(MVIStorageDestination, bit_field(source, 26, 30), 4)
+        if bit_field(source, 25, 26) == 1:
+            cmd.condition = enum_from_field(MVIConditionStatus, bit_field(source, 19, 25), 6)
+            cmd.immediate = bit_field(source, 0, 19)
         else:
             cmd.condition = None
-            cmd.immediate = int(cut(source, 0, 25), 2)
+            cmd.immediate = bit_field(source, 0, 25)
 
         return cmd
 
-    def to_binary(self) -> str:
-        result = f"{self.opcode.value}{self.destination.value}"
+    def to_word(self) -> int:
+        result = enum_to_field(self.opcode) << 30 | enum_to_field(self.destination) << 26
         if self.condition:
-            result += f"1{self.condition.value}"
-            result += bin(self.immediate)[2:].zfill(19)
+            result |= 1 << 25 | enum_to_field(self.condition) << 19
+            result |= self.immediate & 0x7FFFF
         else:
-            result += "0" + bin(self.immediate)[2:].zfill(25)
+            result |= self.immediate & 0x1FFFFFF
 
         return result
 
@@ -737,10 +1001,17 @@ class JumpMode(Enum):
 
 
 class JumpCommand(SpecialCommand):
+    __slots__ = ("condition", "immediate")
+
     opcode: JumpOpcodes
-    condition: JumpMode
+    condition: Optional[JumpMode]
     immediate: int
 
+    def __init__(self):
+        self.opcode = None
+        self.condition = None
+        self.immediate = None
+
     @staticmethod
     def from_text(source: List[str], context: Optional[InstructionContext] = None) -> Command:
         cmd = JumpCommand()
@@ -770,34 +1041,41 @@ class JumpCommand(SpecialCommand):
     @staticmethod
     def from_binary(source: str) -> Command:
         assert len(source) == 32
+        return JumpCommand.from_word(int(source, 2))
+
+    def to_binary(self) -> str:
+        return format(self.to_word(), "032b")
+
+    @staticmethod
+    def from_word(source: int) -> Command:
         cmd = JumpCommand()
-        cmd.opcode = JumpOpcodes(cut(source, 28, 32))
+        cmd.opcode = enum_from_field(JumpOpcodes, bit_field(source, 28, 32), 4)
 
-        status = cut(source, 19, 26)
+        status = bit_field(source, 19, 26)
 
         try:
-            cmd.condition = JumpMode(status)
+            cmd.condition = enum_from_field(JumpMode, status, 7)
         except ValueError:
             # If a jump condition is not found, then it's an unconditional jump!
             cmd.condition = None
 
-        cmd.immediate = int(cut(source, 0, 7), 2)
+        # The target is a Program RAM address, which needs 8 bits to cover its 256 words
+        cmd.immediate = bit_field(source, 0, 8)
         return cmd
 
-    def to_binary(self) -> str:
-        result = self.opcode.value + "00"
+    def to_word(self) -> int:
+        result = enum_to_field(self.opcode) << 28
         if self.condition:
-            result += self.condition.value
-        else:
-            result += "0000000"  # Unconditional mode
+            result |= enum_to_field(self.condition) << 19
+        # Otherwise the 7 condition bits stay at zero (unconditional mode)
 
-        result += "".zfill(12)
-        result += bin(self.immediate)[2:].zfill(7)
+        result |= self.immediate & 0xFF
         return result
 
 
 def generate_command_from_text(data: List[str], context: Optional[InstructionContext] = None) -> Command:
-    print(f"generate_command data: {data}")
+    if logger.isEnabledFor(TRACE):
+        logger.log(TRACE, "generate_command data: %s", data)
     if data[0] == 'NOP':
         return None
     elif data[0] == 'MOV':
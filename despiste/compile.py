@@ -1,31 +1,86 @@
+import logging
+from array import array
+from typing import List, Optional, TYPE_CHECKING
+
+from despiste.assembler import assemble
 from despiste.program import Program
-from despiste.utils import read_file_content, write_file_content
+from despiste.stats import count_instructions, phase, profiling
+from despiste.utils import read_file_content, read_file_lines, write_file_content, words_to_bytes
+
+if TYPE_CHECKING:
+    from despiste.compile_cache import CompileCache
+
+logger = logging.getLogger(__name__)
 
 
-def print_as_hex_numbers(bin_str: str):
-    numbers = [int(bin_str[i:i + 32], 2) for i in range(0, len(bin_str), 32)]
-    for n in numbers:
+def print_as_hex_numbers(words: List[int]):
+    for n in words:
         print(f"{n:#0{10}x}")
 
 
-def write_to_file(output_file: str, bin_str: str):
-    numbers = [int(bin_str[i:i + 32], 2) for i in range(0, len(bin_str), 32)]
-    foo = bytearray()
-    for n in numbers:
-        b = n.to_bytes(4)
-        foo += bytearray(b)
-    write_file_content(output_file, foo)
+def compile_file(input_file: str, output_file: Optional[str] = None, pack: bool = False,
+                 passes: Optional[List[str]] = None, cache: Optional['CompileCache'] = None,
+                 count_cycles: Optional[bool] = None) -> array:
+    """
+    Assembles a source file, writing the binary to output_file if given.
+    Unlike do_compile, it returns the encoded words instead of exiting.
+    :param pack: Whether to merge instructions using different slots, see despiste.pack
+    :param passes: Names of the optimizer passes to run, see despiste.optimize
+    :param cache: Where to look for the binary first, and to store it, see despiste.compile_cache
+    :param count_cycles: Whether to count the cycles saved by each pass, see despiste.optimize.PassManager
+    """
+    passes = list(passes or []) + (["pack"] if pack else [])
+    if cache is None:
+        words = _assemble(read_file_lines(input_file), passes, count_cycles)
+        binary = words_to_bytes(words) if output_file else None
+    else:
+        from despiste.compile_cache import normalize_source
+        lines = normalize_source(read_file_content(input_file))
+        key = cache.key(lines, passes)
+        binary = cache.get(key)
+        if binary is None:
+            words = _assemble(lines, passes, count_cycles)
+            binary = words_to_bytes(words)
+            cache.put(key, binary)
+        else:
+            logger.debug(f"{input_file} was found in the cache")
+            words = Program.from_bytes(binary).to_array()
+    count_instructions(len(words))
+    if output_file:
+        write_file_content(output_file, binary)
+    return words
+
 
+def _assemble(lines, passes: List[str], count_cycles: Optional[bool] = None) -> array:
+    if not passes and not profiling():
+        return assemble(lines)
+    if profiling():
+        # The single-pass assembler interleaves its phases, Program.from_text times them separately
+        with phase("read"):
+            lines = list(lines)
+    program = Program.from_text(lines)
+    if passes:
+        # The passes bring the simulator and the cycle analysis, only imported when asked for
+        from despiste.optimize import PassManager
+        program = PassManager(passes, count_cycles).run(program)
+    return program.to_array()
 
-def do_compile(input_file: str, output_file: str):
-    input_bytes = read_file_content(input_file)
-    input_lines = input_bytes.decode("utf-8").splitlines()
 
-    p = Program.from_text(input_lines)
+def do_compile(input_file: str, output_file: str, pack: bool = False, passes: Optional[List[str]] = None,
+               cache: Optional['CompileCache'] = None, count_cycles: Optional[bool] = None):
+    logger.info(f"Compiling {input_file}...")
+    words = compile_file(input_file, output_file, pack, passes, cache, count_cycles)
+    if cache is not None:
+        logger.info("Found in the cache." if cache.hits else "Added to the cache.")
+        cache.save_stats()
 
-    bin_str = p.to_binary()
-    print_as_hex_numbers(bin_str)
     if output_file:
-        write_to_file(output_file, bin_str)
+        if logger.isEnabledFor(logging.DEBUG):
+            for n in words:
+                logger.debug(f"{n:#0{10}x}")
+    else:
+        # Without an output file, the words are the result
+        print_as_hex_numbers(words)
 
+    logger.info(f"Compiled {len(words)} instructions.")
     raise SystemExit(0)
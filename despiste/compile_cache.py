@@ -0,0 +1,249 @@
+"""
+On-disk cache of assembled programs, so that unchanged sources cost a hash and a copy instead of an assembly.
+
+An entry is the binary of a source, keyed by a hash of the normalized source text, the assembler and the options
+changing the output (the optimizer passes). Like the compiler check of ccache, the assembler is identified by the
+size and modification time of the source files of the despiste package, so that changing it invalidates the cache.
+Entries are spread over 256 directories named after the first two hex digits of their key, and each directory holds
+at most 1/256 of the cache size: when a new entry doesn't fit, the least recently used entries of its directory are
+removed.
+"""
+import json
+import logging
+import os
+from typing import List, Optional, Tuple
+
+import despiste
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_SIZE = 64 * 1024 * 1024
+# Changed when the entries or the keys change
+CACHE_FORMAT = 1
+STATS_FILE = "stats.json"
+
+
+# Identifies the assembler, computed once
+_implementation: Optional[str] = None
+
+
+def implementation() -> str:
+    """
+    Returns a description of the despiste package: its version, and the size and time of each of its modules.
+    """
+    global _implementation
+    if _implementation is None:
+        directory = os.path.dirname(os.path.abspath(despiste.__file__))
+        modules = []
+        for name in sorted(os.listdir(directory)):
+            if name.endswith(".py"):
+                stat = os.stat(os.path.join(directory, name))
+                modules.append(f"{name}:{stat.st_size}:{stat.st_mtime_ns}")
+        _implementation = f"despiste {despiste.__version__} {' '.join(modules)}"
+    return _implementation
+
+
+def normalize_source(source: bytes) -> List[str]:
+    """
+    Splits a UTF-8 source into lines like reading it as a text file, without line endings.
+    """
+    text = source.decode("utf-8").replace("\r\n", "\n").replace("\r", "\n")
+    lines = text.split("\n")
+    if lines[-1] == "":
+        lines.pop()
+    return lines
+
+
+class CompileCache:
+    """
+    :param directory: Created if needed
+    :param max_size: In bytes, for the entries only
+    """
+
+    def __init__(self, directory: str, max_size: int = DEFAULT_MAX_SIZE):
+        assert max_size > 0
+        self.directory = directory
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def key(lines: List[str], passes: Optional[List[str]] = None) -> str:
+        """
+        Hashes the normalized lines of a source with what else changes the binary.
+        Trailing spaces don't change it, so they don't change the key.
+        """
+        import hashlib
+        digest = hashlib.sha256(f"{implementation()} {CACHE_FORMAT} {','.join(passes or [])}\n".encode("utf-8"))
+        for line in lines:
+            digest.update(line.rstrip().encode("utf-8"))
+            digest.update(b"\n")
+        return digest.hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], key[2:])
+
+    def get(self, key: str) -> Optional[bytes]:
+        """
+        Returns the binary of a key and marks it as used, None if it isn't cached.
+        """
+        path = self._path(key)
+        try:
+            with open(path, "rb") as entry:
+                content = entry.read()
+            os.utime(path)
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return content
+
+    def put(self, key: str, content: bytes):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Written aside, then moved, so that other processes never read half an entry
+        temporary = f"{path}.{os.getpid()}.tmp"
+        with open(temporary, "wb") as entry:
+            entry.write(content)
+        os.replace(temporary, path)
+        self._evict(os.path.dirname(path))
+
+    def _evict(self, directory: str):
+        limit = self.max_size // 256
+        entries = []
+        total = 0
+        with os.scandir(directory) as scan:
+            for entry in scan:
+                if entry.is_file() and not entry.name.endswith(".tmp"):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+                    total += stat.st_size
+        if total <= limit:
+            return
+        # The new entry is the most recent one: it is only removed when it's too large on its own
+        for _, size, path in sorted(entries):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                continue
+            self.evictions += 1
+            total -= size
+            if total <= limit:
+                break
+
+    def entries(self) -> Tuple[int, int]:
+        """
+        :return: The number of entries, and their size in bytes
+        """
+        count = size = 0
+        if not os.path.isdir(self.directory):
+            return count, size
+        for name in os.listdir(self.directory):
+            directory = os.path.join(self.directory, name)
+            if len(name) == 2 and os.path.isdir(directory):
+                with os.scandir(directory) as scan:
+                    for entry in scan:
+                        if entry.is_file() and not entry.name.endswith(".tmp"):
+                            count += 1
+                            size += entry.stat().st_size
+        return count, size
+
+    def load_stats(self) -> dict:
+        """
+        Returns the hits, misses and evictions of every run saved in the cache directory.
+        """
+        try:
+            with open(os.path.join(self.directory, STATS_FILE), encoding="utf-8") as stats:
+                return json.load(stats)
+        except (FileNotFoundError, ValueError):
+            return {"hits": 0, "misses": 0, "evictions": 0}
+
+    def save_stats(self):
+        """
+        Adds the counts of this run to the saved ones, then resets them.
+        Concurrent builds may lose some counts, the statistics are indicative only.
+        """
+        stats = self.load_stats()
+        stats["hits"] += self.hits
+        stats["misses"] += self.misses
+        stats["evictions"] += self.evictions
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, STATS_FILE)
+        temporary = f"{path}.{os.getpid()}.tmp"
+        with open(temporary, "w", encoding="utf-8") as output:
+            json.dump(stats, output)
+        os.replace(temporary, path)
+        self.hits = self.misses = self.evictions = 0
+
+    def clear(self):
+        """
+        Removes every entry and the statistics.
+        """
+        if not os.path.isdir(self.directory):
+            return
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if len(name) == 2 and os.path.isdir(path):
+                for entry in os.listdir(path):
+                    os.remove(os.path.join(path, entry))
+                os.rmdir(path)
+            elif name == STATS_FILE:
+                os.remove(path)
+
+    def to_text(self) -> str:
+        count, size = self.entries()
+        stats = self.load_stats()
+        lookups = stats["hits"] + stats["misses"]
+        rate = stats["hits"] / lookups if lookups else 0.0
+        return "\n".join([
+            f"Cache directory: {self.directory}",
+            f"Entries: {count}, {size / 1024:,.1f} KiB of {self.max_size / 1024:,.0f} KiB",
+            f"Hits: {stats['hits']}, misses: {stats['misses']} ({rate:.1%} hits), evictions: {stats['evictions']}",
+        ])
+
+
+def split_cache_flags(args: List[str]) -> Tuple[Optional[str], int, List[str]]:
+    """
+    Removes the --cache-dir DIR and --cache-size MB flags from the command line arguments, also accepted as
+    --cache-dir=DIR and --cache-size=MB.
+    :return: The cache directory (None without cache), its size in bytes and the remaining arguments
+    """
+    values = {"--cache-dir": None, "--cache-size": None}
+    remaining = []
+    arguments = iter(args)
+    for arg in arguments:
+        name, equals, value = arg.partition("=")
+        if name not in values:
+            remaining.append(arg)
+            continue
+        if not equals:
+            value = next(arguments, None)
+            if value is None:
+                raise Exception(f"{name} expects a value")
+        values[name] = value
+    max_size = DEFAULT_MAX_SIZE
+    if values["--cache-size"] is not None:
+        if not values["--cache-size"].isdigit() or int(values["--cache-size"]) == 0:
+            raise Exception(f"--cache-size expects a number of MB, got {values['--cache-size']}")
+        max_size = int(values["--cache-size"]) * 1024 * 1024
+    return values["--cache-dir"], max_size, remaining
+
+
+def do_cache(args: List[str]):
+    """
+    Entry point for the cache command.
+    """
+    import argparse
+    parser = argparse.ArgumentParser(prog="despiste cache", description="Show or clear the assembly cache.")
+    parser.add_argument("--cache-dir", required=True, help="Cache directory, as given to compile")
+    parser.add_argument("--cache-size", type=int, default=DEFAULT_MAX_SIZE // (1024 * 1024), help="In MB")
+    parser.add_argument("--clear", action="store_true", help="Remove every entry and the statistics")
+    options = parser.parse_args(args)
+
+    cache = CompileCache(options.cache_dir, options.cache_size * 1024 * 1024)
+    if options.clear:
+        cache.clear()
+        logger.info(f"Cleared {options.cache_dir}")
+    print(cache.to_text())
+    raise SystemExit(0)
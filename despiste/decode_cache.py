@@ -0,0 +1,58 @@
+from collections import OrderedDict
+
+from despiste.instruction import Instruction, FrozenInstruction
+
+
+class DecodeCache:
+    """
+    Bounded LRU cache of decoded instructions, keyed by their 32 bits word.
+    DSP programs repeat the same words a lot (NOP padding, END, common MOV bundles...),
+    so decoding a corpus through a cache skips most of the work.
+    Cached instructions are FrozenInstruction objects shared between every hit: use copy() to modify them.
+    """
+
+    def __init__(self, maxsize: int = 4096):
+        assert maxsize > 0
+        self._maxsize = maxsize
+        self._entries: OrderedDict[int, FrozenInstruction] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def maxsize(self) -> int:
+        return self._maxsize
+
+    @maxsize.setter
+    def maxsize(self, value: int):
+        assert value > 0
+        self._maxsize = value
+        while len(self._entries) > value:
+            self._entries.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, word: int) -> bool:
+        return word in self._entries
+
+    def decode(self, word: int) -> FrozenInstruction:
+        inst = self._entries.get(word)
+        if inst is not None:
+            self.hits += 1
+            self._entries.move_to_end(word)
+            return inst
+
+        self.misses += 1
+        inst = FrozenInstruction(Instruction.from_word(word))
+        self._entries[word] = inst
+        if len(self._entries) > self._maxsize:
+            self._entries.popitem(last=False)
+        return inst
+
+    def clear(self):
+        self._entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def __str__(self) -> str:
+        return f"DecodeCache(hits={self.hits}, misses={self.misses}, size={len(self)}/{self.maxsize})"
@@ -1,8 +1,21 @@
+import logging
+from typing import Optional
+
 from despiste.program import Program
+from despiste.stats import count_instructions, phase
 from despiste.utils import read_file_content, write_file_content
 
+logger = logging.getLogger(__name__)
+
 
 def program_to_text(p: Program) -> str:
+    # Decoded first, so that the decode phase isn't counted in the render phase
+    p.instructions.decode()
+    with phase("render"):
+        return _program_to_text(p)
+
+
+def _program_to_text(p: Program) -> str:
     result = ""
     if len(p.context.constants):
         result += "; CONSTANTS\n"
@@ -12,8 +25,7 @@ def program_to_text(p: Program) -> str:
     result += "\n"
 
     header = [";ALU", "X-bus", "Y-bus", "D1-bus"]
-    header = [x.ljust(12) for x in header]
-    print("".join(header))
+    result += "".join([x.ljust(12) for x in header]).rstrip() + "\n"
 
     for idx, inst in enumerate(p.instructions):
         for label, pc in p.context.labels:
@@ -27,35 +39,45 @@ def program_to_text(p: Program) -> str:
     return result
 
 
+def decompile_file(input_file: str, output_file: Optional[str] = None) -> Program:
+    """
+    Decompiles a binary file, writing the text to output_file if given.
+    Unlike do_decompile, it returns the decompiled program instead of exiting.
+    """
+    input_bytes = read_file_content(input_file)
+
+    if len(input_bytes) % 4 != 0:
+        raise Exception(f"Input binary file must have a size multiple of 4 (32 bits per instruction), "
+                        f"but it is {len(input_bytes)} instead.")
+
+    p = Program.from_bytes(input_bytes)
+    count_instructions(len(p.instructions))
+
+    if output_file:
+        write_file_content(output_file, program_to_text(p).encode("utf-8"))
+
+    return p
+
+
 def do_decompile(input_file: str, output_file: str):
     input_bytes = read_file_content(input_file)
 
     check_input_length = len(input_bytes) % 4
     if check_input_length != 0:
-        print(f"Input binary file must have a size multiple of 4 (32 bits per instruction), but it is {len(input_bytes)} instead.")
+        logger.error(f"Input binary file must have a size multiple of 4 (32 bits per instruction), but it is {len(input_bytes)} instead.")
         raise SystemExit(3)
 
-    bit_string = ""
-    foo = ""
-    for idx, b in enumerate(input_bytes):
-        if idx % 4 == 0:
-            bit_string = foo + bit_string
-            foo = ""
-        foo += bin(b)[2:].rjust(8, '0')
+    logger.info(f"Decompiling {len(input_bytes) // 4} instructions...")
+    p = Program.from_bytes(input_bytes)
+    count_instructions(len(p.instructions))
 
-    if foo != "":
-        bit_string = foo + bit_string
-
-    print(f"Decompiling {len(input_bytes) // 4} instructions...")
-    p = Program.from_binary(bit_string)
-
-    print("Decompiled!\n")
+    logger.info("Decompiled!\n")
 
     output = program_to_text(p)
 
-    print(output)
-
     if output_file:
         write_file_content(output_file, output.encode("utf-8"))
+    else:
+        print(output)
 
     raise SystemExit(0)
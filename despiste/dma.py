@@ -0,0 +1,116 @@
+"""
+DMA overlap: turns DMAH transfers, which stall the DSP, into DMA transfers running along the next instructions.
+
+A transfer uses its DATA RAM bank and CTn, and RA0 when reading D0 or WA0 when writing it. The instructions after
+a DMAH which use none of them run during the transfer, and a wait is inserted before the first one which does:
+
+    JMP T0,WAIT         ; WAIT is the address of this jump
+    NOP
+
+The wait also goes before anything the scan can't follow: a label or jump target, a jump, a loop, another DMA or the
+end of the program. Transfers to the program RAM, and DMAH in a delay slot, are left unchanged.
+A transfer is only converted when it saves cycles, counting one word per cycle, and the largest size for sizes
+read from a DATA RAM.
+"""
+import logging
+from typing import Dict, List, Optional, Set
+
+from despiste.analyze import MAX_DMA_COUNT
+from despiste.commands import DMACommand, DMACounterMode, DMADataRam, DMAOpcodes, DMATransferMode, JumpCommand, \
+    MVICommand, MVIConditionStatus, MVIStorageDestination
+from despiste.instruction import Instruction
+from despiste.pack import boundaries, effects, relocate, with_target
+from despiste.program import Program
+
+logger = logging.getLogger(__name__)
+
+
+def overlap_dma(program: Program) -> Program:
+    """
+    Returns a program with its DMAH transfers overlapped with the instructions that follow them.
+    """
+    instructions = list(program.instructions)
+    leaders, isolated = boundaries(program)
+    waits: Set[int] = set()  # Addresses to wait at
+    for address, inst in enumerate(instructions):
+        cmd = inst.specialCommand
+        if not isinstance(cmd, DMACommand) or not cmd.hold or cmd.ram_address_pointer == DMADataRam.PRG \
+                or address in isolated:
+            continue
+        use = first_use(instructions, leaders, address, cmd)
+        if use is None:
+            continue
+        count = cmd.data_size if cmd.dma_counter_mode == DMACounterMode.IMMEDIATE else MAX_DMA_COUNT
+        if _saved_cycles(count, use - address - 1) <= 0:
+            continue
+        logger.debug(f"The DMAH at {address:#04x} runs along {use - address - 1} instructions")
+        instructions[address] = _without_hold(inst)
+        waits.add(use)
+
+    if not waits:
+        return program
+
+    converted: List[Instruction] = []
+    addresses: Dict[int, int] = {}
+    wait_addresses = []
+    for address, inst in enumerate(instructions):
+        if address in waits:
+            wait_addresses.append(len(converted))
+            converted += [Instruction(special=_wait_command()), Instruction.get_noop()]
+        addresses[address] = len(converted)
+        converted.append(inst)
+    addresses[len(instructions)] = len(converted)
+
+    result = relocate(program, converted, addresses)
+    # The waits are new, their targets aren't relocated
+    for address in wait_addresses:
+        result.instructions[address] = with_target(result.instructions[address], address)
+    logger.info(f"Overlapped {len(waits)} DMA transfers")
+    return result
+
+
+def first_use(instructions: List[Instruction], leaders: Set[int], address: int, cmd: DMACommand) -> Optional[int]:
+    """
+    Finds where to wait for a transfer: the first instruction using what it uses, or that the scan can't follow.
+    None when the program ends first.
+    """
+    bank = cmd.ram_address_pointer.name[-1]
+    pointer = "RA0" if cmd.dma_mode == DMATransferMode.D0_TO_RAM else "WA0"
+    used = {f"RAM{bank}", f"CT{bank}", pointer}
+    for index in range(address + 1, len(instructions)):
+        inst = instructions[index]
+        special = inst.specialCommand
+        if index in leaders:
+            return index
+        if special is None:
+            current = effects(inst)
+            if (current.reads | current.writes) & used:
+                return index
+        elif not isinstance(special, MVICommand) or special.destination == MVIStorageDestination.PC \
+                or special.condition in (MVIConditionStatus.T0, MVIConditionStatus.NT0) \
+                or special.destination.name in (f"MC{bank}", pointer):
+            return index
+    return None
+
+
+def _saved_cycles(count: int, independent: int) -> int:
+    """
+    Cycles saved by running independent instructions during a transfer of count words, then waiting.
+    """
+    # T0 is set for count + 1 cycles from the DMA, and the wait tests it every other cycle
+    test = independent + 1
+    while test < count + 1:
+        test += 2
+    return (1 + count + independent) - (test + 2)
+
+
+def _without_hold(inst: Instruction) -> Instruction:
+    inst = inst.copy()
+    cmd = inst.specialCommand
+    cmd.hold = False
+    cmd.opcode = DMAOpcodes[cmd.opcode.name.replace("DMAH", "DMA")]
+    return inst
+
+
+def _wait_command() -> JumpCommand:
+    return JumpCommand.from_text(["JMP", "T0", "0"])
@@ -0,0 +1,230 @@
+"""
+Incremental assembler, for editors and watch workflows where the same source is assembled again after small edits.
+
+Every source line is parsed and encoded on its own, with its references to labels and constants left at zero.
+Those references are patched afterwards, so an edit only needs to encode the lines that changed, and to patch
+the instructions referencing labels or constants whose value changed.
+"""
+import difflib
+from array import array
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from despiste.assembler import LineKind, parse_lines, _immediate_mask
+from despiste.instruction import Instruction
+from despiste.instruction_context import InstructionContext
+from despiste.utils import words_to_bytes
+
+
+class AssemblyError(NamedTuple):
+    line_number: int  # Starting from 1, as in parse_lines
+    message: str
+
+    def __str__(self) -> str:
+        return f"An error ({self.message}) occurred in line {self.line_number}!"
+
+
+class _DeferredContext(InstructionContext):
+    """
+    Resolves every label and constant to 0, remembering them so that they can be patched later.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.references: List[Tuple[str, bool]] = []
+
+    def resolve(self, name: str, use_constant: bool = True) -> Optional[int]:
+        self.references.append((name, use_constant))
+        return 0
+
+
+class SourceLine:
+    """
+    The parsed and encoded form of a single source line, which only depends on its text.
+    """
+    __slots__ = ("text", "label", "constant", "elements", "base_word", "references", "error",
+                 "index", "word", "link_error")
+
+    def __init__(self, text: str):
+        self.text = text
+        self.label: Optional[str] = None
+        self.constant: Optional[str] = None
+        self.elements: Optional[List[str]] = None
+        self.base_word = 0
+        # Tuples of (name, use_constant, mask) for each label or constant used by the instruction
+        self.references: List[Tuple[str, bool, int]] = []
+        self.error: Optional[str] = None
+
+        # Filled when linking, as they depend on the other lines
+        self.index: Optional[int] = None  # Instruction index
+        self.word: Optional[int] = None  # Encoded instruction, with its references patched
+        self.link_error: Optional[str] = None
+
+        for _, kind, payload in parse_lines([text]):
+            if kind == LineKind.LABEL:
+                self.label = payload
+            elif kind == LineKind.CONSTANT:
+                self.constant = payload
+            else:
+                self.elements = payload
+
+        if self.elements is not None:
+            self._encode()
+
+    def _encode(self):
+        context = _DeferredContext()
+        try:
+            # from_text may modify the elements in place
+            inst = Instruction.from_text(list(self.elements), context)
+            self.base_word = inst.to_word()
+            if context.references:
+                mask = _immediate_mask(inst)
+                self.references = [(name, use_constant, mask) for name, use_constant in context.references]
+        except Exception as e:
+            self.error = str(e) or type(e).__name__
+
+    @property
+    def is_instruction(self) -> bool:
+        return self.elements is not None
+
+
+class IncrementalAssembler:
+    """
+    Keeps the parsed lines, the labels and constants and the encoded words between runs.
+    update() takes the whole new text and finds the changed lines with difflib, while edit() takes a
+    range of replaced lines directly, as editors report them.
+    Errors don't raise: they are collected in errors, and the instructions that fail are encoded as 0.
+    """
+
+    def __init__(self, lines: Iterable[str] = ()):
+        self.lines: List[SourceLine] = []
+        self.context = InstructionContext()
+        self.label_lines: Dict[str, int] = {}  # Label name to its line number
+        self.words = array("I")
+        self.errors: List[AssemblyError] = []
+
+        # Work done by the last update, to check that it stays incremental
+        self.encoded = 0
+        self.patched = 0
+
+        self.update(lines)
+
+    @property
+    def text_lines(self) -> List[str]:
+        return [line.text for line in self.lines]
+
+    def update(self, lines: Iterable[str]) -> array:
+        """
+        Reassembles after the source changed to the given lines.
+        :return: The encoded words
+        """
+        new_texts = list(lines)
+        old_texts = self.text_lines
+
+        # Edits are usually local, so only the part between the common prefix and suffix is diffed
+        prefix = 0
+        limit = min(len(old_texts), len(new_texts))
+        while prefix < limit and old_texts[prefix] == new_texts[prefix]:
+            prefix += 1
+        suffix = 0
+        while suffix < limit - prefix and old_texts[-1 - suffix] == new_texts[-1 - suffix]:
+            suffix += 1
+
+        matcher = difflib.SequenceMatcher(None, old_texts[prefix:len(old_texts) - suffix],
+                                          new_texts[prefix:len(new_texts) - suffix], autojunk=False)
+        entries = self.lines[:prefix]
+        self.encoded = 0
+        for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+            if tag == "equal":
+                entries.extend(self.lines[prefix + i1:prefix + i2])
+            else:
+                entries.extend(self._parse(text) for text in new_texts[prefix + j1:prefix + j2])
+        entries.extend(self.lines[len(self.lines) - suffix:])
+        self.lines = entries
+        return self._link()
+
+    def edit(self, start: int, end: int, new_lines: Iterable[str]) -> array:
+        """
+        Replaces the lines between start and end (0 based, end excluded) by new_lines, and reassembles.
+        :return: The encoded words
+        """
+        assert 0 <= start <= end <= len(self.lines)
+        self.encoded = 0
+        self.lines[start:end] = [self._parse(text) for text in new_lines]
+        return self._link()
+
+    def to_bytes(self) -> bytes:
+        if self.errors:
+            raise Exception(str(self.errors[0]))
+        return words_to_bytes(self.words)
+
+    def line_at(self, line_number: int) -> SourceLine:
+        return self.lines[line_number - 1]
+
+    def _parse(self, text: str) -> SourceLine:
+        line = SourceLine(text)
+        if line.is_instruction:
+            self.encoded += 1
+        return line
+
+    def _link(self) -> array:
+        previous = self.context
+        context = InstructionContext()
+        label_lines = {}
+        errors = []
+        instructions = []
+
+        # Assign instruction indexes and register labels and constants
+        for line_number, line in enumerate(self.lines, 1):
+            if line.label is not None:
+                try:
+                    context.register_label(line.label, len(instructions))
+                    label_lines[line.label[:-1]] = line_number
+                except AssertionError:
+                    errors.append(AssemblyError(line_number, f"Invalid or repeated label: {line.label}"))
+            if line.constant is not None:
+                try:
+                    context.register_constant(line.constant)
+                except (AssertionError, ValueError):
+                    errors.append(AssemblyError(line_number, f"Invalid constant: {line.constant}"))
+            if line.is_instruction:
+                line.index = len(instructions)
+                instructions.append((line_number, line))
+
+        changed = _changed_names(previous.labels, context.labels) | _changed_names(previous.constants,
+                                                                                  context.constants)
+
+        # Patch the references of new lines and of lines depending on a changed label or constant
+        self.patched = 0
+        for line_number, line in instructions:
+            if line.word is None or (changed and line.references
+                                     and any(name in changed for name, _, _ in line.references)):
+                self._patch(line, context)
+                self.patched += 1
+            if line.error is not None:
+                errors.append(AssemblyError(line_number, line.error))
+            elif line.link_error is not None:
+                errors.append(AssemblyError(line_number, line.link_error))
+
+        errors.sort(key=lambda error: error.line_number)
+        self.context = context
+        self.label_lines = label_lines
+        self.errors = errors
+        self.words = array("I", [line.word for _, line in instructions])
+        return self.words
+
+    @staticmethod
+    def _patch(line: SourceLine, context: InstructionContext):
+        word = line.base_word
+        line.link_error = None
+        for name, use_constant, mask in line.references:
+            value = context.resolve(name, use_constant)
+            if value is None:
+                use = 'constant' if use_constant else 'label'
+                line.link_error = f"Immediate value uses a {use} that does not exist: {name}"
+            else:
+                word |= value & mask
+        line.word = word
+
+
+def _changed_names(old: Dict[str, int], new: Dict[str, int]) -> set:
+    return {name for name in old.keys() | new.keys() if old.get(name) != new.get(name)}
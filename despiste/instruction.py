@@ -1,9 +1,9 @@
-from typing import List, Optional
+import copy
+from typing import List, Optional, Callable
 from despiste.commands import AluControlCommand, XBusControlCommand, YBusControlCommand, D1BusControlCommand, Command, \
-    SpecialCommand, XBusOpcodes, YBusOpcodes, EndCommand, LoopCommand, DMACommand, MVICommand, JumpCommand, \
-    generate_command_from_text, JumpMode
+    SpecialCommand, XBusOpcodes, YBusOpcodes, XYBusDataSource, EndCommand, LoopCommand, DMACommand, MVICommand, JumpCommand, \
+    generate_command_from_text, JumpMode, build_decode_table
 from despiste.instruction_context import InstructionContext
-from despiste.utils import cut
 
 
 command_args = {
@@ -41,13 +41,24 @@ class Instruction:
     An instruction packs commands to be executed in the same DSP cycle.
     The Sega SCU official manual calls them 'Operation Commands'.
     """
+    __slots__ = ("aluControlCommand", "xBusControlCommand", "yBusControlCommand", "d1BusControlCommand",
+                 "specialCommand")
 
-    aluControlCommand: AluControlCommand = None
-    xBusControlCommand: XBusControlCommand = None
-    yBusControlCommand: YBusControlCommand = None
-    d1BusControlCommand: D1BusControlCommand = None
+    aluControlCommand: Optional[AluControlCommand]
+    xBusControlCommand: Optional[XBusControlCommand]
+    yBusControlCommand: Optional[YBusControlCommand]
+    d1BusControlCommand: Optional[D1BusControlCommand]
 
-    specialCommand: SpecialCommand = None
+    specialCommand: Optional[SpecialCommand]
+
+    def __init__(self, alu: Optional[AluControlCommand] = None, x_bus: Optional[XBusControlCommand] = None,
+                 y_bus: Optional[YBusControlCommand] = None, d1_bus: Optional[D1BusControlCommand] = None,
+                 special: Optional[SpecialCommand] = None):
+        self.aluControlCommand = alu
+        self.xBusControlCommand = x_bus
+        self.yBusControlCommand = y_bus
+        self.d1BusControlCommand = d1_bus
+        self.specialCommand = special
 
     @staticmethod
     def from_text(elements: List[str], context: Optional[InstructionContext]) -> 'Instruction':
@@ -101,21 +112,20 @@ class Instruction:
                 case XBusControlCommand():
                     if inst.xBusControlCommand is None:
                         inst.xBusControlCommand = cmd
+                    # Combined operations are separate commands, since commands are immutable
                     elif inst.xBusControlCommand.opcode == XBusOpcodes.MOV_SRC_X and cmd.opcode == XBusOpcodes.MOV_MUL_P:
-                        inst.xBusControlCommand.opcode = XBusOpcodes.MOV_SRC_X_MUL_P
+                        inst.xBusControlCommand = _combined_x(inst.xBusControlCommand.source)
                     elif inst.xBusControlCommand.opcode == XBusOpcodes.MOV_MUL_P and cmd.opcode == XBusOpcodes.MOV_SRC_X:
-                        inst.xBusControlCommand.source = cmd.source
-                        inst.xBusControlCommand.opcode = XBusOpcodes.MOV_SRC_X_MUL_P
+                        inst.xBusControlCommand = _combined_x(cmd.source)
                     else:
                         raise Exception(f"Incompatible commands for XBus: {inst.xBusControlCommand.to_text()} and {cmd.to_text()}")
                 case YBusControlCommand():
                     if inst.yBusControlCommand is None:
                         inst.yBusControlCommand = cmd
                     elif inst.yBusControlCommand.opcode == YBusOpcodes.MOV_SRC_Y and cmd.opcode == YBusOpcodes.MOV_ALU_A:
-                        inst.yBusControlCommand.opcode = YBusOpcodes.MOV_SRC_Y_ALU_A
+                        inst.yBusControlCommand = _combined_y(inst.yBusControlCommand.source)
                     elif inst.yBusControlCommand.opcode == YBusOpcodes.MOV_ALU_A and cmd.opcode == YBusOpcodes.MOV_SRC_Y:
-                        inst.yBusControlCommand.source = cmd.source
-                        inst.yBusControlCommand.opcode = YBusOpcodes.MOV_SRC_Y_ALU_A
+                        inst.yBusControlCommand = _combined_y(cmd.source)
                     else:
                         msg = f"Incompatible commands for YBus: {inst.yBusControlCommand.to_text()} and {cmd.to_text()}"
                         raise Exception(msg)
@@ -154,45 +164,28 @@ class Instruction:
     def from_binary(source: str):
         # Make sure an instruction is 32 bytes long.
         assert len(source) == 32
+        return Instruction.from_word(int(source, 2))
 
-        inst = Instruction()
-
-        # Bytes 30 and 31 are meant to be zero for normal instructions
-        if cut(source, 30, 32) == '00':
-            # First 14 bytes are D1-Bus Control
-            inst.d1BusControlCommand = D1BusControlCommand.from_binary(cut(source, 0, 14))
-
-            # Bytes 14 to 19 are Y-Bus Control
-            inst.yBusControlCommand = YBusControlCommand.from_binary(cut(source, 14, 20))
-
-            # Bytes 20 to 25 are X-Bus Control
-            inst.xBusControlCommand = XBusControlCommand.from_binary(cut(source, 20, 26))
-
-            # Bytes 26 to 29 are ALU Control
-            inst.aluControlCommand = AluControlCommand.from_binary(cut(source, 26, 30))
-
-        # END cmds
-        elif cut(source, 28, 32) == '1111':
-            inst.specialCommand = EndCommand.from_binary(cut(source, 27, 32))
-        # Loop cmds
-        elif cut(source, 28, 32) == '1110':
-            inst.specialCommand = LoopCommand.from_binary(cut(source, 27, 32))
-        elif cut(source, 28, 32) == '1100':
-            inst.specialCommand = DMACommand.from_binary(source)
-        elif cut(source, 30, 32) == '10':
-            inst.specialCommand = MVICommand.from_binary(source)
-        elif cut(source, 28, 32) == '1101':
-            inst.specialCommand = JumpCommand.from_binary(source)
-        else:
-            raise Exception("Unknown command!")
+    def to_binary(self) -> str:
+        return format(self.to_word(), "032b")
 
-        return inst
+    @staticmethod
+    def from_word(source: int) -> 'Instruction':
+        """
+        Decodes an instruction from its 32 bits encoding stored as an integer.
+        The top 4 bits are enough to tell which kind of instruction it is.
+        The commands of normal instructions are immutable and shared between every instruction.
+        """
+        return _DECODERS[source >> 28](source)
 
-    def to_binary(self) -> str:
+    def to_word(self) -> int:
         if self.specialCommand is None:
-            return f"00{self.aluControlCommand.to_binary()}{self.xBusControlCommand.to_binary()}{self.yBusControlCommand.to_binary()}{self.d1BusControlCommand.to_binary()}"
+            return (self.aluControlCommand.to_word() << 26
+                    | self.xBusControlCommand.to_word() << 20
+                    | self.yBusControlCommand.to_word() << 14
+                    | self.d1BusControlCommand.to_word())
         else:
-            return self.specialCommand.to_binary()
+            return self.specialCommand.to_word()
 
     def __str__(self):
         return "\t\t\t".join([
@@ -201,3 +194,109 @@ class Instruction:
             str(self.yBusControlCommand),
             str(self.d1BusControlCommand),
         ])
+
+    def copy(self) -> 'Instruction':
+        """
+        Returns a modifiable copy. Bus commands are shared, as they are immutable.
+        """
+        inst = Instruction()
+        inst.aluControlCommand = self.aluControlCommand
+        inst.xBusControlCommand = self.xBusControlCommand
+        inst.yBusControlCommand = self.yBusControlCommand
+        inst.d1BusControlCommand = self.d1BusControlCommand
+        inst.specialCommand = copy.copy(self.specialCommand)
+        return inst
+
+
+class FrozenInstruction(Instruction):
+    """
+    An instruction that can't be modified, so that a single object can be shared by many users.
+    Its commands are shared as well, its special command is frozen: call copy() to get an instruction that can be
+    modified.
+    """
+    __slots__ = ()
+
+    def __init__(self, inst: Instruction):
+        for name in _COMMAND_ATTRIBUTES:
+            object.__setattr__(self, name, getattr(inst, name))
+        if inst.specialCommand is not None:
+            object.__setattr__(self, "specialCommand", inst.specialCommand.frozen())
+
+    def __setattr__(self, key, value):
+        raise AttributeError(f"Can't set {key}: the instruction is shared, modify a copy() instead")
+
+    def __delattr__(self, key):
+        raise AttributeError(f"Can't delete {key}: the instruction is shared, modify a copy() instead")
+
+
+_COMMAND_ATTRIBUTES = Instruction.__slots__
+
+
+def _combined_x(source: XYBusDataSource) -> XBusControlCommand:
+    return XBusControlCommand(XBusOpcodes.MOV_SRC_X_MUL_P, source)
+
+
+def _combined_y(source: XYBusDataSource) -> YBusControlCommand:
+    return YBusControlCommand(YBusOpcodes.MOV_SRC_Y_ALU_A, source)
+
+
+# Commands of normal instructions are decoded once, the tables skip the decoding work.
+# They are built by the first decoding, so that programs which are only assembled don't pay for them.
+_ALU_COMMANDS: List[Optional[AluControlCommand]] = []
+_X_BUS_COMMANDS: List[Optional[XBusControlCommand]] = []
+_Y_BUS_COMMANDS: List[Optional[YBusControlCommand]] = []
+# D1 has 16K possible values, so its commands are only decoded the first time they are seen
+_D1_BUS_COMMANDS: List[Optional[D1BusControlCommand]] = [None] * (1 << 14)
+
+
+def _decode_normal(source: int) -> Instruction:
+    # Bits 30 and 31 are zero for normal instructions
+    # Bits 0 to 13 are D1-Bus Control
+    d1 = _D1_BUS_COMMANDS[source & 0x3FFF]
+    if d1 is None:
+        d1 = _D1_BUS_COMMANDS[source & 0x3FFF] = D1BusControlCommand.from_word(source & 0x3FFF)
+    # Bits 14 to 19 are Y-Bus Control
+    y_bus = _Y_BUS_COMMANDS[source >> 14 & 0x3F]
+    # Bits 20 to 25 are X-Bus Control
+    x_bus = _X_BUS_COMMANDS[source >> 20 & 0x3F]
+    # Bits 26 to 29 are ALU Control
+    alu = _ALU_COMMANDS[source >> 26 & 0xF]
+
+    if y_bus is None or x_bus is None or alu is None:
+        raise ValueError(f"{source:032b} is not a valid instruction")
+    return Instruction(alu, x_bus, y_bus, d1)
+
+
+def _decode_normal_first(source: int) -> Instruction:
+    """
+    Builds the command tables, then decodes with _decode_normal from now on.
+    """
+    _ALU_COMMANDS[:] = build_decode_table(1 << 4, AluControlCommand.from_word)
+    _X_BUS_COMMANDS[:] = build_decode_table(1 << 6, XBusControlCommand.from_word)
+    _Y_BUS_COMMANDS[:] = build_decode_table(1 << 6, YBusControlCommand.from_word)
+    _DECODERS[:4] = [_decode_normal] * 4
+    return _decode_normal(source)
+
+
+def _special_decoder(command_type) -> Callable[[int], Instruction]:
+    def decode(source: int) -> Instruction:
+        return Instruction(special=command_type.from_word(source))
+    return decode
+
+
+def _decode_unknown(source: int) -> Instruction:
+    raise Exception("Unknown command!")
+
+
+# Instruction decoders, indexed by the top 4 bits of the instruction
+_DECODERS = (
+    [_decode_normal_first] * 4      # 00xx
+    + [_decode_unknown] * 4         # 01xx
+    + [_special_decoder(MVICommand)] * 4  # 10xx
+    + [
+        _special_decoder(DMACommand),   # 1100
+        _special_decoder(JumpCommand),  # 1101
+        _special_decoder(LoopCommand),  # 1110
+        _special_decoder(EndCommand),   # 1111
+    ]
+)
@@ -1,9 +1,13 @@
-from typing import Dict
+from typing import Dict, Optional
 
 
 class InstructionContext:
-    labels: Dict[str, int] = {}  # Key is the label name and value is the instruction index it points to
-    constants: Dict[str, int] = {}  # Key is the constant name
+    labels: Dict[str, int]  # Key is the label name and value is the instruction index it points to
+    constants: Dict[str, int]  # Key is the constant name
+
+    def __init__(self):
+        self.labels = {}
+        self.constants = {}
 
     def register_label(self, label: str, instruction_offset: int):
 
@@ -20,3 +24,11 @@ class InstructionContext:
         array = line.split("=")
         assert len(array) == 2
         self.constants[array[0].strip()] = int(array[1].strip())
+
+    def resolve(self, name: str, use_constant: bool = True) -> Optional[int]:
+        """
+        Returns the value of a constant (or a label if use_constant is False), or None if it is not registered.
+        """
+        if use_constant:
+            return self.constants.get(name)
+        return self.labels.get(name)
@@ -0,0 +1,140 @@
+import sys
+from array import array
+from collections.abc import MutableSequence
+from typing import Callable, Iterable, List, Optional, Set
+
+from despiste.instruction import Instruction
+from despiste.stats import phase
+
+
+class InstructionList(MutableSequence):
+    """
+    The instructions of a program, stored as an array of 32 bits words. An instruction is only decoded when it is
+    accessed, and cached for its index, so copying, hashing or comparing the words costs no decoding.
+    The accessed instructions can be changed in place, commands included: they are encoded back into the words
+    whenever the words are read.
+    """
+    __slots__ = ("_words", "_cache", "_pending")
+
+    def __init__(self, words: Iterable[int] = (), decode: Optional[Callable[[int], Instruction]] = None):
+        """
+        :param decode: Decodes the words right away, for example into the frozen instructions of a DecodeCache
+        """
+        self._words = array("I", words)
+        self._pending: Set[int] = set()  # Set from outside, their words aren't known yet
+        if decode is None:
+            self._cache: List[Optional[Instruction]] = [None] * len(self._words)
+        else:
+            self._cache = [decode(word) for word in self._words]
+
+    @staticmethod
+    def from_instructions(instructions: Iterable[Instruction]) -> 'InstructionList':
+        result = InstructionList()
+        result._cache = list(instructions)
+        result._words = array("I", bytes(4 * len(result._cache)))
+        result._pending = set(range(len(result._cache)))
+        return result
+
+    def words(self) -> array:
+        """
+        Returns the array of words, shared with the list: copy it before changing it.
+        """
+        words = self._words
+        cache = self._cache
+        if cache.count(None) == len(cache):
+            return words
+        for index, inst in enumerate(cache):
+            if inst is None:
+                continue
+            word = inst.to_word()
+            # Some words don't survive decoding, they are only replaced when the instruction was changed
+            if word != words[index] and (index in self._pending
+                                         or Instruction.from_word(words[index]).to_word() != word):
+                words[index] = word
+        self._pending.clear()
+        return words
+
+    def to_bytes(self) -> bytes:
+        """
+        Returns the words as big-endian bytes, which is how the DSP expects its program.
+        """
+        words = array("I", self.words())
+        if sys.byteorder == "little":
+            words.byteswap()
+        return words.tobytes()
+
+    def decode(self):
+        """
+        Decodes every instruction not decoded yet, raising an exception for the invalid ones.
+        This is the decode phase of the statistics: accessing the instructions one by one isn't timed.
+        """
+        cache = self._cache
+        missing = cache.count(None)
+        if not missing:
+            return
+        with phase("decode"):
+            if missing == len(cache):
+                cache[:] = map(Instruction.from_word, self._words)
+            else:
+                decode = Instruction.from_word
+                cache[:] = [decode(word) if inst is None else inst for word, inst in zip(self._words, cache)]
+
+    def __len__(self) -> int:
+        return len(self._words)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            self.decode()
+            return self._cache[index]
+        inst = self._cache[index]
+        if inst is None:
+            inst = self._cache[index] = Instruction.from_word(self._words[index])
+        return inst
+
+    def __iter__(self):
+        self.decode()
+        return iter(self._cache)
+
+    def __setitem__(self, index, inst):
+        if isinstance(index, slice):
+            instructions = list(inst)
+            indices = range(*index.indices(len(self._words)))
+            if index.step not in (None, 1):
+                if len(instructions) != len(indices):
+                    raise ValueError(f"attempt to assign a sequence of size {len(instructions)} "
+                                     f"to an extended slice of size {len(indices)}")
+                for i, item in zip(indices, instructions):
+                    self[i] = item
+                return
+            del self[index]
+            for offset, item in enumerate(instructions):
+                self.insert(indices.start + offset, item)
+            return
+
+        self._cache[index] = inst
+        self._pending.add(range(len(self._cache))[index])
+
+    def __delitem__(self, index):
+        if isinstance(index, slice):
+            for i in sorted(range(*index.indices(len(self._words))), reverse=True):
+                del self[i]
+            return
+        index = range(len(self._cache))[index]
+        del self._words[index]
+        del self._cache[index]
+        self._pending = {i - 1 if i > index else i for i in self._pending if i != index}
+
+    def insert(self, index: int, inst: Instruction):
+        index = min(max(index + len(self._words) if index < 0 else index, 0), len(self._words))
+        self._words.insert(index, 0)
+        self._cache.insert(index, inst)
+        self._pending = {i + 1 if i >= index else i for i in self._pending}
+        self._pending.add(index)
+
+    def append(self, inst: Instruction):
+        self._words.append(0)
+        self._cache.append(inst)
+        self._pending.add(len(self._cache) - 1)
+
+    def __repr__(self) -> str:
+        return f"InstructionList({len(self)} instructions)"
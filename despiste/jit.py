@@ -0,0 +1,364 @@
+"""
+Compiles whole DSP programs into Python functions, for programs simulated many times.
+
+The program is split into basic blocks, and a single generated function runs them: the registers live in
+local variables, blocks are selected by the PC, and loops whose jump comes back to the start of their block
+run as Python loops. Blocks reuse the code generated for the step functions of the simulator.
+
+Whatever can't be compiled is run by the step functions instead: jumps or loops whose next instruction is
+itself a special command, DMA to the program RAM, and jumps to addresses that don't start a block.
+Compiled functions are cached by the content of the program RAM, so a program loaded again (or reloaded
+through DMA) is only compiled once.
+"""
+import re
+from functools import lru_cache
+from typing import Callable, FrozenSet, Iterable, List, Optional, Set, Tuple
+
+from despiste.commands import D1BusDataDestination, D1BusOpcodes, DMADataRam, DMATransferMode, DMACommand, \
+    EndCommand, EndOpcodes, JumpCommand, LoopCommand, LoopOpcodes, MVICommand, MVIStorageDestination
+from despiste.instruction import Instruction
+from despiste.sim import DSPState, Simulator, PROGRAM_RAM_SIZE, _CONDITIONS, _HELPERS, _generate_dma, \
+    generate_step
+
+# Registers kept in local variables by the compiled function
+_REGISTERS = ("rx", "ry", "p", "a", "alu", "z", "s", "c", "e", "lop", "top", "ra0", "wa0", "cycles", "dma_until")
+_BANKS = range(4)
+# Largest number of instructions in a block, blocks are split beyond
+MAX_BLOCK_SIZE = 64
+
+
+class CompiledProgram:
+    """
+    The compiled function of a program, and the addresses it can start from.
+    The function runs until END/ENDI, until the cycles reach the limit (checked between blocks),
+    or until the PC gets to an address that isn't compiled.
+    """
+
+    def __init__(self, words: Tuple[int, ...], entries: FrozenSet[int], function: Callable[[DSPState, int], None],
+                 source: str):
+        self.words = words
+        self.entries = entries
+        self.function = function
+        self.source = source
+
+
+class CompiledSimulator(Simulator):
+    """
+    A Simulator running compiled programs, and the step functions for what couldn't be compiled.
+    """
+
+    def run(self, max_cycles: int = 1_000_000) -> int:
+        st = self.state
+        start = st.cycles
+        limit = start + max_cycles
+        compiled = None
+        while st.running and st.cycles < limit:
+            if st.branch is None:
+                if compiled is None or compiled.words != tuple(st.program):
+                    compiled = compile_program(st.program)
+                if st.pc in compiled.entries:
+                    compiled.function(st, limit)
+                    continue
+            self.step()
+        return st.cycles - start
+
+
+def compile_program(words: Iterable[int]) -> CompiledProgram:
+    """
+    Returns the compiled form of the program RAM content, compiling it the first time.
+    """
+    words = tuple(words)
+    return _compile_cached(words + (0,) * (PROGRAM_RAM_SIZE - len(words)))
+
+
+@lru_cache(maxsize=64)
+def _compile_cached(words: Tuple[int, ...]) -> CompiledProgram:
+    return _Compiler(words).compile()
+
+
+def _localize(lines: List[str]) -> List[str]:
+    """
+    Rewrites code generated for step functions to use the local variables of the compiled function.
+    """
+    result = []
+    for line in lines:
+        if line.strip() in ("ram = st.ram", "ct = st.ct"):
+            continue
+        line = line.replace("st.ram[", "ram[").replace("st.ct[", "ct[")
+        line = _BANK_ACCESS.sub(r"\1\2", line)
+        line = _STATE_ACCESS.sub(r"\1", line)
+        # Registers and locals now have the same name
+        line = _DOUBLE_ASSIGNMENT.sub(r"\1\2 = ", line)
+        if not _SELF_ASSIGNMENT.match(line):
+            result.append(line)
+    return result
+
+
+_BANK_ACCESS = re.compile(r"\b(ram|ct)\[(\d)]")
+_STATE_ACCESS = re.compile(r"\bst\.(\w+)")
+_DOUBLE_ASSIGNMENT = re.compile(r"^(\s*)(\w+) = \2 = ")
+_SELF_ASSIGNMENT = re.compile(r"^\s*(\w+) = \1$")
+_RESULT_ASSIGNMENT = re.compile(r"^(z|s|c|alu) = ")
+_RESULT_USE = re.compile(r"\b(z|s|c|alu)\b")
+
+
+def _drop_dead_stores(lines: List[str]) -> List[str]:
+    """
+    Removes the updates of flags and of the ALU result overwritten by a later instruction of the block
+    before being read. Only unconditional (not indented) updates overwrite a value.
+    """
+    result = []
+    overwritten = set()
+    for line in reversed(lines):
+        match = _RESULT_ASSIGNMENT.match(line)
+        if match is not None:
+            flag = match.group(1)
+            if flag in overwritten:
+                continue
+            overwritten.add(flag)
+        else:
+            overwritten.difference_update(_RESULT_USE.findall(line))
+        result.append(line)
+    result.reverse()
+    return result
+
+
+def _condition(condition) -> str:
+    return _localize([_CONDITIONS[condition.name]])[0]
+
+
+def _uses_t0(condition) -> bool:
+    return condition is not None and condition.name in ("T0", "NT0")
+
+
+class _Compiler:
+
+    def __init__(self, words: Tuple[int, ...]):
+        self.words = words
+        self.instructions: List[Optional[Instruction]] = []
+        for word in words:
+            try:
+                self.instructions.append(Instruction.from_word(word))
+            except Exception:
+                self.instructions.append(None)
+        self.leaders = self._find_leaders()
+
+    def _find_leaders(self) -> Set[int]:
+        """
+        Addresses where blocks start: the beginning, jump targets, and where execution resumes after
+        a jump, a loop or a subroutine call.
+        """
+        leaders = {0}
+        for address, inst in enumerate(self.instructions):
+            if inst is None:
+                continue
+            cmd = inst.specialCommand
+            after = (address + 2) & 0xFF
+            if isinstance(cmd, JumpCommand):
+                leaders.update((cmd.immediate & 0xFF, after))
+            elif isinstance(cmd, MVICommand) and cmd.destination == MVIStorageDestination.PC:
+                # The delay slot is the return address of a subroutine
+                leaders.update((cmd.immediate & 0xFF, (address + 1) & 0xFF, after))
+            elif isinstance(cmd, LoopCommand):
+                leaders.add(after)
+            elif cmd is None:
+                d1 = inst.d1BusControlCommand
+                if d1.opcode == D1BusOpcodes.MOV_IMM_DST and d1.destination == D1BusDataDestination.TOP:
+                    leaders.add(d1.immediate & 0xFF)
+        return leaders
+
+    def _is_simple(self, address: int) -> bool:
+        """
+        Whether an instruction can run in a delay slot or under LPS: a normal instruction, or a MVI not
+        changing the PC.
+        """
+        inst = self.instructions[address & 0xFF]
+        if inst is None:
+            return False
+        cmd = inst.specialCommand
+        return cmd is None or (isinstance(cmd, MVICommand) and cmd.destination != MVIStorageDestination.PC)
+
+    def compile(self) -> CompiledProgram:
+        blocks = []
+        for leader in sorted(self.leaders):
+            block = _Block(self, leader).build()
+            if block is not None:
+                blocks.append((leader, block))
+
+        lines = ["def run(st, limit):"]
+        lines += ["    " + line for line in self._load()]
+        lines += [
+            "    pc = st.pc",
+            "    while cycles < limit:",
+        ]
+        lines += ["        " + line for line in _dispatch(blocks)]
+        lines += ["    " + line for line in self._store()]
+        lines.append("    st.pc = pc")
+
+        source = "\n".join(lines)
+        namespace = dict(_HELPERS)
+        exec(compile(source, "<dsp program>", "exec"), namespace)
+        return CompiledProgram(self.words, frozenset(leader for leader, _ in blocks), namespace["run"], source)
+
+    @staticmethod
+    def _load() -> List[str]:
+        lines = [f"{name} = st.{name}" for name in _REGISTERS]
+        lines += [f"ram{bank} = st.ram[{bank}]" for bank in _BANKS]
+        lines += [f"ct{bank} = st.ct[{bank}]" for bank in _BANKS]
+        return lines
+
+    @staticmethod
+    def _store() -> List[str]:
+        lines = [f"st.{name} = {name}" for name in _REGISTERS]
+        lines += [f"st.ct[{bank}] = ct{bank}" for bank in _BANKS]
+        return lines
+
+
+class _Block:
+    """
+    Generates the code of the block starting at an address. The code leaves the next address in pc.
+    Cycles are added to the local counter lazily, when the count is needed.
+    """
+
+    def __init__(self, compiler: _Compiler, start: int):
+        self.compiler = compiler
+        self.start = start
+        self.lines: List[str] = []
+        self.pending = 0  # Cycles not added yet
+        self.loops = False  # Whether the block may jump back to its start
+
+    def sync(self, extra: int = 0):
+        self.pending += extra
+        if self.pending:
+            self.lines.append(f"cycles += {self.pending}")
+            self.pending = 0
+
+    def emit_simple(self, address: int, lines: List[str]):
+        inst = self.compiler.instructions[address]
+        cmd = inst.specialCommand
+        if isinstance(cmd, MVICommand) and _uses_t0(cmd.condition):
+            self.sync()
+        lines += _localize(generate_step(inst))
+
+    def build(self) -> Optional[List[str]]:
+        compiler = self.compiler
+        address = self.start
+        for _ in range(MAX_BLOCK_SIZE):
+            inst = compiler.instructions[address]
+            if inst is None:
+                break
+            cmd = inst.specialCommand
+            following = (address + 1) & 0xFF
+
+            if compiler._is_simple(address):
+                self.emit_simple(address, self.lines)
+                self.pending += 1
+                address = following
+                if address in compiler.leaders:
+                    break
+            elif isinstance(cmd, (JumpCommand, MVICommand)) or (isinstance(cmd, LoopCommand)
+                                                                and cmd.opcode == LoopOpcodes.BTM):
+                if not compiler._is_simple(following):
+                    break
+                self._jump(address, cmd)
+                return self._finish()
+            elif isinstance(cmd, LoopCommand):
+                if not compiler._is_simple(following):
+                    break
+                self._repeat(address)
+                address = (address + 2) & 0xFF
+                break
+            elif isinstance(cmd, DMACommand):
+                if cmd.dma_mode == DMATransferMode.D0_TO_RAM and cmd.ram_address_pointer == DMADataRam.PRG:
+                    # The program changes, so the step functions take over
+                    break
+                self._dma(cmd)
+                address = following
+                if address in compiler.leaders:
+                    break
+            elif isinstance(cmd, EndCommand):
+                self.sync(1)
+                if cmd.opcode == EndOpcodes.ENDI:
+                    self.lines.append("e = 1")
+                self.lines += [f"pc = {following}", "st.running = False", "break"]
+                return _drop_dead_stores(self.lines)
+            else:
+                break
+
+        if address == self.start:
+            # Nothing could be compiled
+            return None
+        self.sync()
+        self.lines.append(f"pc = {address}")
+        return _drop_dead_stores(self.lines)
+
+    def _jump(self, address: int, cmd):
+        condition = getattr(cmd, "condition", None)
+        if _uses_t0(condition):
+            self.sync()
+        after = (address + 2) & 0xFF
+
+        if isinstance(cmd, LoopCommand):
+            # BTM, to a target only known at runtime
+            self.lines += [f"nxt = top if lop else {after}", "lop = (lop - 1) & 0xFFF if lop else 0"]
+            self.loops = True
+        else:
+            target = cmd.immediate & 0xFF
+            taken = [f"nxt = {target}"]
+            if isinstance(cmd, MVICommand):
+                taken.insert(0, f"top = {(address + 1) & 0xFF}")
+            if condition is None:
+                self.lines += taken
+            else:
+                self.lines += [f"if {_condition(condition)}:"] + ["    " + line for line in taken]
+                self.lines += ["else:", f"    nxt = {after}"]
+            self.loops = target == self.start
+        self.pending += 1
+
+        # The delay slot
+        self.emit_simple((address + 1) & 0xFF, self.lines)
+        self.sync(1)
+
+    def _repeat(self, address: int):
+        """
+        LPS, repeating the next instruction LOP + 1 times.
+        """
+        self.sync()
+        body = ["cycles += 1"]
+        self.emit_simple((address + 1) & 0xFF, body)
+        self.lines.append("for _ in range(lop + 1):")
+        self.lines += ["    " + line for line in body]
+        # The cycle of LPS itself
+        self.lines += ["lop = 0", "cycles += 1"]
+
+    def _dma(self, cmd: DMACommand):
+        self.sync()
+        # The DMA helper works on the state
+        self.lines += [f"st.{name} = {name}" for name in ("ra0", "wa0", "cycles", "dma_until")]
+        self.lines += [f"st.ct[{bank}] = ct{bank}" for bank in _BANKS]
+        self.lines += _generate_dma(cmd)
+        self.lines += [f"{name} = st.{name}" for name in ("ra0", "wa0", "cycles", "dma_until")]
+        self.lines += [f"ct{bank} = st.ct[{bank}]" for bank in _BANKS]
+        self.pending += 1
+
+    def _finish(self) -> List[str]:
+        self.lines = _drop_dead_stores(self.lines)
+        if not self.loops:
+            return self.lines + ["pc = nxt"]
+        # Run as a Python loop while the jump comes back to the block
+        return (["while True:"] + ["    " + line for line in self.lines]
+                + [f"    if nxt != {self.start} or cycles >= limit:", "        break", "pc = nxt"])
+
+
+def _dispatch(blocks: List[Tuple[int, List[str]]]) -> List[str]:
+    """
+    Selects the block for the PC with a binary search, ending the run for addresses that aren't compiled.
+    """
+    if not blocks:
+        return ["break"]
+    if len(blocks) == 1:
+        leader, block = blocks[0]
+        return [f"if pc == {leader}:"] + ["    " + line for line in block] + ["else:", "    break"]
+    middle = len(blocks) // 2
+    return ([f"if pc < {blocks[middle][0]}:"] + ["    " + line for line in _dispatch(blocks[:middle])]
+            + ["else:"] + ["    " + line for line in _dispatch(blocks[middle:])])
@@ -0,0 +1,321 @@
+"""
+Conversion of counted loops into hardware loops, repeated by LPS or BTM without any loop overhead.
+
+A counted loop jumps back with JMP NZ, after a tail updating a counter kept in a DATA RAM cell:
+
+    MOV k,CT0           ; the counter is at RAM0 k
+    MOV n,MC0           ; its initial value
+LOOP:
+    ...                 ; the body
+    MOV k,CT0           ; the tail
+    MOV M0,A    MOV 1,PL
+    SUB
+    MOV ALL,MC0
+    JMP NZ,LOOP
+    NOP                 ; the delay slot
+
+The tail is a run of instructions ending the body which sets its own CTn, only accesses the counter cell, and
+doesn't read anything else before writing it, so its result only depends on the counter. It is simulated to find
+the number of iterations, and the counter value of the last one. The loop then becomes:
+
+    MOV k,CT0
+    MOV c,MC0           ; the counter value of the last iteration
+    MVI n-1,LOP
+    MOV LOOP,TOP
+LOOP:
+    ...
+    BTM
+    NOP
+    ...                 ; the tail, run once: it leaves everything as the last iteration did
+
+With a single instruction body and a NOP delay slot, LPS repeats the body instead of BTM.
+The body and the delay slot mustn't use the counter bank, write LOP or TOP, or read what the tail writes before
+writing it themselves. After the loop, LOP and TOP must be written again before being read, or the program must end:
+a loop in a subroutine returning with BTM isn't converted.
+"""
+import logging
+from typing import List, NamedTuple, Optional, Set, Tuple
+
+from despiste.commands import AluOpcodes, D1BusControlCommand, D1BusDataDestination, D1BusOpcodes, EndCommand, \
+    JumpCommand, JumpMode, LoopCommand, LoopOpcodes, MVICommand, MVIStorageDestination
+from despiste.instruction import Instruction
+from despiste.pack import ALU, boundaries, counters_after, effects, jump_target, relocate
+from despiste.program import Program
+from despiste.sim import Simulator
+
+logger = logging.getLogger(__name__)
+
+# LOP is 12 bits, and loops run LOP + 1 times
+MAX_ITERATIONS = 0x1000
+
+
+class CountedLoop(NamedTuple):
+    start: int  # Address of the body
+    tail: int  # Address of the tail
+    jump: int  # Address of JMP NZ
+    init: Instruction  # Instruction storing the initial counter value, changed to store the last one
+    init_address: int
+    iterations: int
+
+
+def convert_counted_loops(program: Program) -> Program:
+    """
+    Returns a program with its counted loops converted into hardware loops.
+    """
+    while True:
+        loop = None
+        for address in range(len(program.instructions)):
+            loop = find_counted_loop(program, address)
+            if loop is not None:
+                break
+        if loop is None:
+            return program
+        program = _convert(program, loop)
+
+
+def find_counted_loop(program: Program, jump: int) -> Optional[CountedLoop]:
+    """
+    Recognizes a counted loop ending with a jump at an address.
+    """
+    instructions = program.instructions
+    cmd = instructions[jump].specialCommand
+    if not isinstance(cmd, JumpCommand) or cmd.condition != JumpMode.NZ:
+        return None
+    start = cmd.immediate & 0xFF
+    if start >= jump or jump + 1 >= len(instructions):
+        return None
+
+    # The loop is entered from above only, and runs straight to the jump
+    leaders, isolated = boundaries(program)
+    if start in isolated or jump in isolated or any(address in leaders for address in range(start + 1, jump + 2)):
+        return None
+    if any(jump_target(inst) == start for address, inst in enumerate(instructions) if address != jump):
+        return None
+    if any(inst.specialCommand is not None for inst in instructions[start:jump] + [instructions[jump + 1]]):
+        return None
+    if not _dead_after(instructions, jump + 2, {"LOP", "TOP"}):
+        return None
+
+    for tail in range(jump - 1, start, -1):
+        counter = _counter_of(instructions[tail:jump])
+        if counter is None:
+            continue
+        bank, address, written = counter
+        if not _independent(instructions[start:tail], instructions[jump + 1], bank, written):
+            continue
+        initial = _initial_counter(instructions, leaders, start, bank, address)
+        if initial is None:
+            return None
+        init_address, value = initial
+        run = _last_iteration(instructions[tail:jump], bank, address, value)
+        if run is None:
+            return None
+        iterations, last = run
+        init = _storing(instructions[init_address], bank, address, last)
+        if init is None:
+            return None
+        return CountedLoop(start, tail, jump, init, init_address, iterations)
+    return None
+
+
+def _counter_of(tail: List[Instruction]) -> Optional[Tuple[int, int, Set[str]]]:
+    """
+    Checks that a tail only depends on a DATA RAM cell.
+    :return: Its bank and address, and what the tail writes
+    """
+    counters: List[Optional[int]] = [None] * 4
+    written: Set[str] = set()
+    bank = None
+    address = None
+    for inst in tail:
+        current = effects(inst)
+        used = current.reads | current.writes
+        banks = {int(name[-1]) for name in used if name.startswith(("RAM", "CT"))}
+        if bank is not None:
+            banks.add(bank)
+        if len(banks) > 1:
+            return None
+        if banks:
+            bank = banks.pop()
+            if f"RAM{bank}" in used:
+                if counters[bank] is None or address not in (None, counters[bank]):
+                    return None
+                address = counters[bank]
+
+        external = set(current.reads) - written - {f"RAM{bank}", f"CT{bank}"}
+        if inst.aluControlCommand.opcode != AluOpcodes.NOP:
+            # The result of the same cycle
+            external.discard(ALU)
+        if external:
+            return None
+        written |= current.writes
+        counters = counters_after(inst, counters)
+
+    # The tail sets the flags of the jump, and leaves LOP and TOP to the hardware loop
+    if address is None or ALU not in written or written & {"LOP", "TOP"}:
+        return None
+    return bank, address, written
+
+
+def _independent(body: List[Instruction], delay_slot: Instruction, bank: int, written: Set[str]) -> bool:
+    """
+    Whether the body and the delay slot don't see the counter, or what the tail writes.
+    """
+    counter = {f"RAM{bank}", f"CT{bank}"}
+    pending = set(written)  # Written by the tail of the previous iteration
+    for inst in body:
+        current = effects(inst)
+        reads = set(current.reads)
+        if inst.aluControlCommand.opcode != AluOpcodes.NOP:
+            reads.discard(ALU)
+        if (current.reads | current.writes) & counter or current.writes & {"LOP", "TOP"} or reads & pending:
+            return False
+        pending -= current.writes
+    current = effects(delay_slot)
+    return not (current.reads | current.writes) & (written | counter | {"LOP", "TOP"})
+
+
+def _dead_after(instructions: List[Instruction], address: int, names: Set[str]) -> bool:
+    """
+    Whether registers among LOP and TOP are written before being read, from an address on.
+    """
+    names = set(names)
+    for inst in instructions[address:]:
+        if not names:
+            return True
+        cmd = inst.specialCommand
+        if cmd is None:
+            d1 = inst.d1BusControlCommand
+            if d1.opcode != D1BusOpcodes.NOP:
+                names.discard(d1.destination.name)
+        elif isinstance(cmd, EndCommand):
+            return True
+        elif isinstance(cmd, MVICommand) and cmd.destination != MVIStorageDestination.PC:
+            if cmd.destination == MVIStorageDestination.LOP and cmd.condition is None:
+                names.discard("LOP")
+        elif isinstance(cmd, (JumpCommand, LoopCommand, MVICommand)):
+            # They may read them, or go where they are read
+            return False
+    return not names
+
+
+def _initial_counter(instructions: List[Instruction], leaders: Set[int], start: int, bank: int,
+                     address: int) -> Optional[Tuple[int, int]]:
+    """
+    Finds the instruction storing the counter before the loop, right after setting CTn to its address.
+    :return: The address of the instruction, and the value it stores
+    """
+    counter = {f"RAM{bank}", f"CT{bank}"}
+    init = None
+    for index in range(start - 1, -1, -1):
+        if index + 1 < start and index + 1 in leaders:
+            # The counter may come from elsewhere
+            return None
+        inst = instructions[index]
+        cmd = inst.specialCommand
+        if cmd is not None:
+            if not isinstance(cmd, MVICommand) or cmd.destination == MVIStorageDestination.PC:
+                return None
+            if cmd.destination.name != f"MC{bank}":
+                continue
+            if init is not None or cmd.condition is not None:
+                return None
+            init = index
+            continue
+
+        current = effects(inst)
+        if not (current.reads | current.writes) & counter:
+            continue
+        d1 = inst.d1BusControlCommand
+        if init is None:
+            if d1.opcode != D1BusOpcodes.MOV_IMM_DST or d1.destination.name != f"MC{bank}" \
+                    or f"RAM{bank}" in current.reads:
+                return None
+            init = index
+            continue
+        if d1.opcode != D1BusOpcodes.MOV_IMM_DST or d1.destination.name != f"CT{bank}" \
+                or (current.reads | current.writes) & counter != {f"CT{bank}"} or d1.immediate & 0x3F != address:
+            return None
+        return init, _stored(instructions[init], bank, address)
+    return None
+
+
+def _stored(inst: Instruction, bank: int, address: int) -> int:
+    """
+    Runs an instruction storing a value to DATA RAM with CTn at an address, and returns the value.
+    """
+    sim = Simulator([inst.to_word()])
+    sim.state.ct[bank] = address
+    sim.step()
+    return sim.state.ram[bank][address]
+
+
+def _storing(inst: Instruction, bank: int, address: int, value: int) -> Optional[Instruction]:
+    """
+    Returns a copy of the instruction storing the counter, storing another value, None if it can't be encoded.
+    """
+    inst = inst.copy()
+    if inst.specialCommand is not None:
+        inst.specialCommand.immediate = value & 0x1FFFFFF
+    else:
+        d1 = inst.d1BusControlCommand
+        inst.d1BusControlCommand = D1BusControlCommand(d1.opcode, d1.destination, immediate=value & 0xFF)
+    return inst if _stored(inst, bank, address) == value else None
+
+
+def _last_iteration(tail: List[Instruction], bank: int, address: int, value: int) -> Optional[Tuple[int, int]]:
+    """
+    Runs the tail until the Z flag is set, like the loop.
+    :return: The number of iterations, and the counter value at the start of the last one
+    """
+    sim = Simulator([inst.to_word() for inst in tail])
+    st = sim.state
+    st.ram[bank][address] = value
+    for iterations in range(1, MAX_ITERATIONS + 1):
+        last = st.ram[bank][address]
+        st.pc = 0
+        for _ in tail:
+            sim.step()
+        if st.z:
+            return iterations, last
+    return None
+
+
+def _convert(program: Program, loop: CountedLoop) -> Program:
+    instructions = program.instructions
+    start, tail, jump = loop.start, loop.tail, loop.jump
+    body = instructions[start:tail]
+    delay_slot = instructions[jump + 1]
+    repeat = len(body) == 1 and not effects(delay_slot).slots
+
+    converted = list(instructions[:start])
+    converted[loop.init_address] = loop.init
+    addresses = {address: address for address in range(start)}
+    converted.append(Instruction(special=MVICommand.from_text(["MVI", str(loop.iterations - 1), "LOP"])))
+    if repeat:
+        converted.append(Instruction(special=LoopCommand.from_text(["LPS"])))
+    else:
+        # Relocated with the other jump targets
+        converted.append(Instruction.from_commands([
+            D1BusControlCommand(D1BusOpcodes.MOV_IMM_DST, D1BusDataDestination.TOP, immediate=start)]))
+    for address, inst in enumerate(body, start):
+        addresses[address] = len(converted)
+        converted.append(inst)
+    if not repeat:
+        converted += [Instruction(special=LoopCommand.from_text(["BTM"])), delay_slot]
+    for address in range(tail, jump + 2):
+        addresses[address] = len(converted)
+    converted += instructions[tail:jump]
+    for address, inst in enumerate(instructions[jump + 2:], jump + 2):
+        addresses[address] = len(converted)
+        converted.append(inst)
+    addresses[len(instructions)] = len(converted)
+
+    before = loop.iterations * (len(body) + jump - tail + 2)
+    if repeat:
+        kind, after = LoopOpcodes.LPS, 2 + loop.iterations + jump - tail
+    else:
+        kind, after = LoopOpcodes.BTM, 2 + loop.iterations * (len(body) + 2) + jump - tail
+    logger.info(f"Converted the loop at {start:#04x} into {kind.name}, running {loop.iterations} times "
+                f"in {after} cycles instead of {before}")
+    return relocate(program, converted, addresses)
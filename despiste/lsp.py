@@ -0,0 +1,255 @@
+"""
+Language server: a long-lived process speaking JSON-RPC over stdio, compatible with the Language Server Protocol.
+
+Every open document keeps an IncrementalAssembler, so each edit only re-encodes the edited lines.
+Supported features are diagnostics, hover (encoded word and bus slot usage) and go to label definition.
+"""
+import json
+import logging
+import re
+import sys
+from typing import BinaryIO, Dict, List, Optional
+
+from despiste.incremental import IncrementalAssembler, SourceLine
+from despiste.instruction import Instruction
+
+logger = logging.getLogger(__name__)
+
+# LSP constants
+TEXT_DOCUMENT_SYNC_INCREMENTAL = 2
+SEVERITY_ERROR = 1
+METHOD_NOT_FOUND = -32601
+INVALID_PARAMS = -32602
+
+_WORD = re.compile(r"[A-Za-z0-9_]+")
+
+
+class LanguageServer:
+    """
+    Handles decoded JSON-RPC messages. handle() returns the messages to send back, so that it can be used
+    without any stream, while serve() reads and writes them with the LSP base protocol framing.
+    """
+
+    def __init__(self):
+        self.documents: Dict[str, IncrementalAssembler] = {}
+        self.running = True
+        self.shutdown_requested = False
+
+    def handle(self, message: dict) -> List[dict]:
+        method = message.get("method")
+        params = message.get("params") or {}
+        request_id = message.get("id")
+        outgoing = []
+
+        handler = getattr(self, "_on_" + method.replace("/", "_").replace("$", "_"), None) if method else None
+        if handler is None:
+            if request_id is not None:
+                outgoing.append(_error(request_id, METHOD_NOT_FOUND, f"Method not supported: {method}"))
+            return outgoing
+
+        try:
+            result = handler(params, outgoing)
+        except (KeyError, IndexError, TypeError, ValueError) as e:
+            logger.debug(f"Invalid parameters for {method}: {e}")
+            if request_id is not None:
+                outgoing.append(_error(request_id, INVALID_PARAMS, str(e)))
+            return outgoing
+
+        if request_id is not None:
+            outgoing.insert(0, {"jsonrpc": "2.0", "id": request_id, "result": result})
+        return outgoing
+
+    # Lifecycle
+
+    def _on_initialize(self, params: dict, outgoing: List[dict]) -> dict:
+        return {
+            "capabilities": {
+                "textDocumentSync": {"openClose": True, "change": TEXT_DOCUMENT_SYNC_INCREMENTAL},
+                "hoverProvider": True,
+                "definitionProvider": True,
+            },
+            "serverInfo": {"name": "despiste"},
+        }
+
+    def _on_initialized(self, params: dict, outgoing: List[dict]):
+        return None
+
+    def _on_shutdown(self, params: dict, outgoing: List[dict]):
+        self.shutdown_requested = True
+        return None
+
+    def _on_exit(self, params: dict, outgoing: List[dict]):
+        self.running = False
+        return None
+
+    # Documents
+
+    def _on_textDocument_didOpen(self, params: dict, outgoing: List[dict]):
+        document = params["textDocument"]
+        self.documents[document["uri"]] = IncrementalAssembler(_split_lines(document["text"]))
+        outgoing.append(self._diagnostics(document["uri"]))
+
+    def _on_textDocument_didChange(self, params: dict, outgoing: List[dict]):
+        uri = params["textDocument"]["uri"]
+        assembler = self.documents[uri]
+        for change in params["contentChanges"]:
+            if "range" in change:
+                _apply_range_change(assembler, change["range"], change["text"])
+            else:
+                assembler.update(_split_lines(change["text"]))
+        outgoing.append(self._diagnostics(uri))
+
+    def _on_textDocument_didClose(self, params: dict, outgoing: List[dict]):
+        uri = params["textDocument"]["uri"]
+        self.documents.pop(uri, None)
+        outgoing.append(_notification("textDocument/publishDiagnostics", {"uri": uri, "diagnostics": []}))
+
+    def _diagnostics(self, uri: str) -> dict:
+        assembler = self.documents[uri]
+        diagnostics = []
+        for error in assembler.errors:
+            line = error.line_number - 1
+            diagnostics.append({
+                "range": _line_range(line, len(assembler.lines[line].text)),
+                "severity": SEVERITY_ERROR,
+                "source": "despiste",
+                "message": error.message,
+            })
+        return _notification("textDocument/publishDiagnostics", {"uri": uri, "diagnostics": diagnostics})
+
+    # Language features
+
+    def _on_textDocument_hover(self, params: dict, outgoing: List[dict]) -> Optional[dict]:
+        assembler = self.documents[params["textDocument"]["uri"]]
+        line_index = params["position"]["line"]
+        if line_index >= len(assembler.lines):
+            return None
+        line = assembler.lines[line_index]
+        if not line.is_instruction or line.error is not None:
+            return None
+
+        return {
+            "contents": {"kind": "markdown", "value": hover_text(line)},
+            "range": _line_range(line_index, len(line.text)),
+        }
+
+    def _on_textDocument_definition(self, params: dict, outgoing: List[dict]) -> Optional[dict]:
+        uri = params["textDocument"]["uri"]
+        assembler = self.documents[uri]
+        position = params["position"]
+        if position["line"] >= len(assembler.lines):
+            return None
+
+        name = _word_at(assembler.lines[position["line"]].text, position["character"])
+        if name is None:
+            return None
+        line_number = assembler.label_lines.get(name.upper())
+        if line_number is None:
+            return None
+        return {"uri": uri, "range": _line_range(line_number - 1, len(assembler.lines[line_number - 1].text))}
+
+    # Base protocol
+
+    def serve(self, stdin: BinaryIO, stdout: BinaryIO):
+        """
+        Reads messages until the exit notification or the end of the input.
+        """
+        while self.running:
+            message = read_message(stdin)
+            if message is None:
+                break
+            for reply in self.handle(message):
+                write_message(stdout, reply)
+
+
+def hover_text(line: SourceLine) -> str:
+    """
+    Describes an encoded instruction: its word, and what each bus slot is used for.
+    """
+    inst = Instruction.from_word(line.word)
+    result = [f"`{line.word:#010x}` (instruction {line.index})", ""]
+    if inst.specialCommand is not None:
+        result.append(f"Special command: `{' '.join(inst.specialCommand.to_text())}`, no bus slot is available")
+        return "\n".join(result)
+
+    slots = [
+        ("ALU", inst.aluControlCommand),
+        ("X-bus", inst.xBusControlCommand),
+        ("Y-bus", inst.yBusControlCommand),
+        ("D1-bus", inst.d1BusControlCommand),
+    ]
+    for name, cmd in slots:
+        text = " / ".join(cmd.to_text())
+        result.append(f"- {name}: {'free' if text == 'NOP' else f'`{text}`'}")
+    return "\n".join(result)
+
+
+def read_message(stream: BinaryIO) -> Optional[dict]:
+    """
+    Reads a message framed with a Content-Length header. Returns None at the end of the stream.
+    """
+    length = None
+    while True:
+        header = stream.readline()
+        if not header:
+            return None
+        header = header.strip()
+        if not header:
+            break
+        name, _, value = header.decode("ascii").partition(":")
+        if name.strip().lower() == "content-length":
+            length = int(value.strip())
+
+    if length is None:
+        raise Exception("Message without a Content-Length header")
+    return json.loads(stream.read(length).decode("utf-8"))
+
+
+def write_message(stream: BinaryIO, message: dict):
+    body = json.dumps(message, separators=(",", ":")).encode("utf-8")
+    stream.write(f"Content-Length: {len(body)}\r\n\r\n".encode("ascii") + body)
+    stream.flush()
+
+
+def _split_lines(text: str) -> List[str]:
+    return [line.rstrip("\r") for line in text.split("\n")]
+
+
+def _apply_range_change(assembler: IncrementalAssembler, change_range: dict, text: str):
+    start, end = change_range["start"], change_range["end"]
+    lines = assembler.lines
+
+    # Positions may point right after the last line
+    first = lines[start["line"]].text if start["line"] < len(lines) else ""
+    last = lines[end["line"]].text if end["line"] < len(lines) else ""
+    new_text = first[:start["character"]] + text + last[end["character"]:]
+    assembler.edit(min(start["line"], len(lines)), min(end["line"] + 1, len(lines)), _split_lines(new_text))
+
+
+def _word_at(text: str, character: int) -> Optional[str]:
+    for match in _WORD.finditer(text):
+        if match.start() <= character <= match.end():
+            return match.group()
+    return None
+
+
+def _line_range(line: int, length: int) -> dict:
+    return {"start": {"line": line, "character": 0}, "end": {"line": line, "character": length}}
+
+
+def _notification(method: str, params: dict) -> dict:
+    return {"jsonrpc": "2.0", "method": method, "params": params}
+
+
+def _error(request_id, code: int, message: str) -> dict:
+    return {"jsonrpc": "2.0", "id": request_id, "error": {"code": code, "message": message}}
+
+
+def do_lsp(args: List[str]):
+    """
+    Entry point for the lsp command.
+    """
+    server = LanguageServer()
+    logger.info("Language server listening on the standard input.")
+    server.serve(sys.stdin.buffer, sys.stdout.buffer)
+    raise SystemExit(0 if server.shutdown_requested else 1)
@@ -0,0 +1,359 @@
+"""
+Peephole optimizer: passes rewriting a program before it is encoded, each reporting what it saved.
+
+Passes only move code within straight runs of normal instructions: runs end at labels, jump targets,
+special commands, delay slots and instructions repeated by LPS, like the packing scheduler (see despiste.pack).
+Removing instructions moves the labels and the jump targets to their new address, so addresses computed
+from data (MOV M0,TOP) must not point past a removed instruction.
+
+NOPs are assumed to have no timing role besides delay slots, and the padding after a DMA: the instructions
+between a DMA without hold and the first one using its DATA RAM bank, CTn or RA0/WA0 (see despiste.dma) may be
+waiting for the transfer, so they are never removed.
+"""
+import logging
+from typing import Callable, Dict, List, NamedTuple, Optional, Set, Tuple
+
+from despiste.analyze import CycleAnalyzer
+from despiste.commands import AluOpcodes, D1BusControlCommand, D1BusDataSource, D1BusOpcodes, DMACommand, \
+    JumpCommand, MVICommand, MVIStorageDestination, XBusControlCommand, XBusOpcodes, XYBusDataSource, \
+    YBusControlCommand, YBusOpcodes
+from despiste.dma import first_use, overlap_dma
+from despiste.instruction import Instruction
+from despiste.loops import convert_counted_loops
+from despiste.pack import boundaries, counters_after, effects, jump_target, pack_program, relocate, with_target
+from despiste.program import Program
+
+logger = logging.getLogger(__name__)
+
+
+class Pass(NamedTuple):
+    name: str
+    description: str
+    run: Callable[[Program], Program]
+
+
+class PassResult(NamedTuple):
+    name: str
+    words: int  # Instructions saved
+    best_cycles: Optional[int]  # Cycles saved in the best case from the start of the program, None when unknown
+    worst_cycles: Optional[int]  # Cycles saved in the worst case, None when unknown
+
+    def to_text(self) -> str:
+        words = f"{self.words} word" if self.words == 1 else f"{self.words} words"
+        if self.best_cycles is None and self.worst_cycles is None:
+            return f"{self.name}: saved {words}"
+        best = "unknown" if self.best_cycles is None else self.best_cycles
+        worst = "unknown" if self.worst_cycles is None else self.worst_cycles
+        return f"{self.name}: saved {words}, {best} cycles in the best case, {worst} in the worst case"
+
+
+def is_nop(inst: Instruction) -> bool:
+    return (inst.specialCommand is None
+            and inst.aluControlCommand.opcode == AluOpcodes.NOP
+            and inst.xBusControlCommand.opcode == XBusOpcodes.NOP
+            and inst.yBusControlCommand.opcode == YBusOpcodes.NOP
+            and inst.d1BusControlCommand.opcode == D1BusOpcodes.NOP)
+
+
+def remove_instructions(program: Program, removed: Set[int]) -> Program:
+    """
+    Returns a program without some of its instructions, which mustn't be leaders or isolated instructions.
+    """
+    kept: List[Instruction] = []
+    addresses: Dict[int, int] = {}
+    for index, inst in enumerate(program.instructions):
+        addresses[index] = len(kept)
+        if index not in removed:
+            kept.append(inst)
+    addresses[len(program.instructions)] = len(kept)
+    return relocate(program, kept, addresses)
+
+
+def _runs(program: Program) -> Tuple[List[List[int]], Set[int]]:
+    """
+    Splits a program into straight runs of normal instructions.
+    :return: The runs as lists of addresses, and the addresses of the instructions that can be removed
+    """
+    leaders, isolated = boundaries(program)
+    runs: List[List[int]] = []
+    current: List[int] = []
+    for index, inst in enumerate(program.instructions):
+        if index in leaders or index in isolated or inst.specialCommand is not None:
+            if current:
+                runs.append(current)
+            current = []
+        if inst.specialCommand is None and index not in isolated:
+            current.append(index)
+    if current:
+        runs.append(current)
+    padding = _dma_padding(program, leaders)
+    removable = {index for run in runs for index in run if index not in leaders and index not in padding}
+    return runs, removable
+
+
+def _dma_padding(program: Program, leaders: Set[int]) -> Set[int]:
+    """
+    Finds the instructions between each DMA without hold and the first instruction using what it uses.
+    """
+    instructions = program.instructions
+    padding = set()
+    for address, inst in enumerate(instructions):
+        cmd = inst.specialCommand
+        if isinstance(cmd, DMACommand) and not cmd.hold:
+            use = first_use(instructions, leaders, address, cmd)
+            padding.update(range(address + 1, len(instructions) if use is None else use))
+    return padding
+
+
+def _remove_emptied(program: Program, instructions: List[Instruction], removable: Set[int]) -> Program:
+    """
+    Replaces the instructions of a program, removing those which became NOPs.
+    """
+    changed = Program()
+    changed.context = program.context
+    changed.instructions = instructions
+    return remove_instructions(changed, {index for index in removable if is_nop(instructions[index])})
+
+
+def remove_nops(program: Program) -> Program:
+    """
+    Removes the NOP instructions that aren't jump targets, delay slots or repeated by LPS.
+    """
+    _, removable = _runs(program)
+    return _remove_emptied(program, list(program.instructions), removable)
+
+
+def fold_ct_increment(program: Program) -> Program:
+    """
+    Turns a read of Mn followed by MOV c+1,CTn into a read of MCn, when CTn is known to be c.
+    CTn is known after a MOV immediate to it, in the same run.
+    """
+    instructions = list(program.instructions)
+    runs, removable = _runs(program)
+    for run in runs:
+        counters: List[Optional[int]] = [None] * 4
+        for position, index in enumerate(run):
+            inst = instructions[index]
+            for bank in range(4):
+                if counters[bank] is not None:
+                    follower = _ct_increment_of(instructions, run[position + 1:], bank, counters[bank])
+                    if follower is not None and _reads_without_increment(inst, bank):
+                        instructions[index] = inst = _with_increment(inst, bank)
+                        instructions[follower] = follower_inst = instructions[follower].copy()
+                        follower_inst.d1BusControlCommand = D1BusControlCommand.get_noop()
+            counters = counters_after(inst, counters)
+    return _remove_emptied(program, instructions, removable)
+
+
+def _bank_names(bank: int) -> Set[str]:
+    return {f"RAM{bank}", f"CT{bank}"}
+
+
+def _reads_without_increment(inst: Instruction, bank: int) -> bool:
+    """
+    Whether an instruction reads DATA RAMn without incrementing CTn, and doesn't write it.
+    """
+    current = effects(inst)
+    return f"RAM{bank}" in current.reads and not current.writes & _bank_names(bank)
+
+
+def _ct_increment_of(instructions: List[Instruction], following: List[int], bank: int, value: int) -> Optional[int]:
+    """
+    Finds the instruction setting CTn to value + 1 in a run, if nothing uses DATA RAMn before it.
+    """
+    for index in following:
+        inst = instructions[index]
+        d1 = inst.d1BusControlCommand
+        if (d1.opcode == D1BusOpcodes.MOV_IMM_DST and d1.destination.name == f"CT{bank}"
+                and d1.immediate & 0x3F == (value + 1) & 0x3F and f"RAM{bank}" not in effects(inst).reads):
+            return index
+        current = effects(inst)
+        if (current.reads | current.writes) & _bank_names(bank):
+            return None
+    return None
+
+
+def _with_increment(inst: Instruction, bank: int) -> Instruction:
+    """
+    Returns a copy of an instruction reading MCn instead of Mn.
+    """
+    inst = inst.copy()
+    plain = f"M{bank}"
+    incremented = f"MC{bank}"
+    x_bus = inst.xBusControlCommand
+    if x_bus.source is not None and x_bus.source.name == plain:
+        inst.xBusControlCommand = XBusControlCommand(x_bus.opcode, XYBusDataSource[incremented])
+    y_bus = inst.yBusControlCommand
+    if y_bus.source is not None and y_bus.source.name == plain:
+        inst.yBusControlCommand = YBusControlCommand(y_bus.opcode, XYBusDataSource[incremented])
+    d1 = inst.d1BusControlCommand
+    if d1.opcode == D1BusOpcodes.MOV_SRC_DST and d1.source.name == plain:
+        inst.d1BusControlCommand = D1BusControlCommand(d1.opcode, d1.destination, D1BusDataSource[incremented])
+    return inst
+
+
+def drop_clr_a(program: Program) -> Program:
+    """
+    Removes CLR A when A is already cleared, or when A is written again before being read, in the same run.
+    """
+    instructions = list(program.instructions)
+    runs, removable = _runs(program)
+    for run in runs:
+        cleared = False
+        for position, index in enumerate(run):
+            inst = instructions[index]
+            current = effects(inst)
+            if inst.yBusControlCommand.opcode == YBusOpcodes.CLR_A:
+                if cleared or _overwritten(instructions, run[position + 1:]):
+                    instructions[index] = inst = inst.copy()
+                    inst.yBusControlCommand = YBusControlCommand.get_noop()
+                else:
+                    cleared = True
+            elif "A" in current.writes:
+                cleared = False
+    return _remove_emptied(program, instructions, removable)
+
+
+def _overwritten(instructions: List[Instruction], following: List[int]) -> bool:
+    """
+    Whether A is written in a run before being read.
+    """
+    for index in following:
+        current = effects(instructions[index])
+        if "A" in current.reads:
+            return False
+        if "A" in current.writes:
+            return True
+    return False
+
+
+def thread_jumps(program: Program) -> Program:
+    """
+    Makes JMP and MVI to PC go directly to the end of a chain of unconditional jumps with a NOP delay slot.
+    """
+    instructions = list(program.instructions)
+    for index, inst in enumerate(instructions):
+        cmd = inst.specialCommand
+        if not isinstance(cmd, JumpCommand) and not (isinstance(cmd, MVICommand)
+                                                     and cmd.destination == MVIStorageDestination.PC):
+            continue
+        target = jump_target(inst)
+        seen = {target}
+        while (following := _forwarded(instructions, target)) is not None and following not in seen:
+            seen.add(following)
+            target = following
+        if target != jump_target(inst):
+            instructions[index] = with_target(inst, target)
+
+    result = Program()
+    result.context = program.context
+    result.instructions = instructions
+    return result
+
+
+def _forwarded(instructions: List[Instruction], address: int) -> Optional[int]:
+    """
+    Returns where an unconditional jump with a NOP delay slot at an address goes.
+    """
+    if address + 1 >= len(instructions):
+        return None
+    cmd = instructions[address].specialCommand
+    if isinstance(cmd, JumpCommand) and cmd.condition is None and is_nop(instructions[address + 1]):
+        return cmd.immediate & 0xFF
+    return None
+
+
+PASSES: Dict[str, Pass] = {entry.name: entry for entry in [
+    Pass("hardware-loops", "Counted loops ending with JMP NZ are repeated by LPS or BTM", convert_counted_loops),
+    Pass("overlap-dma", "DMAH transfers run along the next instructions, waiting before what they use", overlap_dma),
+    Pass("thread-jumps", "Jumps to unconditional jumps go to their target directly", thread_jumps),
+    Pass("fold-ct-increment", "A read of Mn followed by setting CTn to the next address reads MCn",
+         fold_ct_increment),
+    Pass("drop-clr-a", "Removes CLR A when A is already cleared or overwritten before being read", drop_clr_a),
+    Pass("remove-nops", "Removes NOP instructions, except delay slots, jump targets and LPS bodies", remove_nops),
+    Pass("pack", "Merges consecutive instructions using different buses", pack_program),
+]}
+
+# Passes run by default, in order. Packing makes the program harder to read, so it is only run on demand.
+DEFAULT_PASSES = ["hardware-loops", "overlap-dma", "thread-jumps", "fold-ct-increment", "drop-clr-a", "remove-nops"]
+
+
+def _cycles(program: Program) -> Tuple[Optional[int], Optional[int]]:
+    """
+    Best and worst case cycles from the start of a program, None when unknown.
+    """
+    try:
+        report = CycleAnalyzer(program).analyze(0)
+    except Exception as e:
+        logger.debug(f"Could not count the cycles: {e}")
+        return None, None
+    return report.best, report.worst
+
+
+def _saved(before: Optional[int], after: Optional[int]) -> Optional[int]:
+    return None if before is None or after is None else before - after
+
+
+class PassManager:
+    """
+    Runs a list of passes in order over a program.
+    """
+
+    def __init__(self, names: Optional[List[str]] = None, count_cycles: Optional[bool] = None):
+        """
+        :param names: Names of the passes to run, DEFAULT_PASSES if None
+        :param count_cycles: Whether to analyze the cycles saved by each pass, which costs more than the passes.
+        If None, they are only counted when the debug messages are shown.
+        """
+        names = DEFAULT_PASSES if names is None else names
+        for name in names:
+            if name not in PASSES:
+                raise Exception(f"Unknown pass {name}, expected one of {', '.join(PASSES)}")
+        self.passes = [PASSES[name] for name in names]
+        self.count_cycles = count_cycles
+        self.results: List[PassResult] = []
+
+    def run(self, program: Program) -> Program:
+        """
+        Returns the optimized program. The savings of each pass are in results afterwards.
+        """
+        self.results = []
+        count_cycles = self.count_cycles
+        if count_cycles is None:
+            count_cycles = logger.isEnabledFor(logging.DEBUG)
+        best, worst = _cycles(program) if count_cycles else (None, None)
+        for entry in self.passes:
+            words = len(program.instructions)
+            program = entry.run(program)
+            new_best, new_worst = _cycles(program) if count_cycles else (None, None)
+            result = PassResult(entry.name, words - len(program.instructions), _saved(best, new_best),
+                                _saved(worst, new_worst))
+            logger.info(result.to_text())
+            self.results.append(result)
+            best, worst = new_best, new_worst
+        return program
+
+
+def split_optimize_flags(args: List[str]) -> Tuple[Optional[List[str]], bool, List[str]]:
+    """
+    Removes the optimizer flags from the command line arguments: --optimize runs the default passes,
+    --optimize=a,b runs the passes a then b, and --optimize-report counts the cycles saved by each pass, running
+    the default passes without --optimize.
+    :return: The names of the passes to run (None without the flags), whether to count the cycles saved and the
+    remaining arguments
+    """
+    passes = None
+    report = False
+    remaining = []
+    for arg in args:
+        if arg == "--optimize":
+            passes = list(DEFAULT_PASSES)
+        elif arg.startswith("--optimize="):
+            passes = [name for name in arg.removeprefix("--optimize=").split(",") if name]
+        elif arg == "--optimize-report":
+            report = True
+        else:
+            remaining.append(arg)
+    if report and passes is None:
+        passes = list(DEFAULT_PASSES)
+    return passes, report, remaining
@@ -0,0 +1,308 @@
+"""
+Packing scheduler: merges consecutive normal instructions using different bus slots into shared instructions.
+
+Each instruction reads registers at the start of its cycle and writes them at the end, so two instructions
+can share a cycle when the later one doesn't read what the earlier one writes, and they don't write the same
+register. The ALU result is the exception: MOV ALU,A and ALL/ALH see the result computed in the same cycle,
+so they may join the ALU command they follow, but never precede one in the same cycle.
+Accessing MCn increments CTn, so it counts as a write of CTn, and any access to DATA RAMn reads CTn.
+
+Instructions are scheduled in program order, each in the earliest cycle allowed by its dependencies where its
+slots are free. Scheduling never crosses a label, a jump target, a special command, a delay slot or the
+instruction repeated by LPS. Jumps, MVI to PC and MOV to TOP are then remapped to the packed addresses.
+Labels used as data (MVI to any other destination) are left unchanged.
+"""
+import logging
+from typing import Dict, FrozenSet, List, NamedTuple, Optional, Set, Tuple
+
+from despiste.commands import D1BusControlCommand, D1BusDataDestination, D1BusOpcodes, AluOpcodes, \
+    JumpCommand, LoopCommand, MVICommand, MVIStorageDestination, XBusControlCommand, XBusOpcodes, \
+    YBusControlCommand, YBusOpcodes
+from despiste.instruction import Instruction
+from despiste.program import Program
+
+logger = logging.getLogger(__name__)
+
+ALU = "ALU"
+
+# Parts of the buses used by each opcode. Only MOV [s],X with MOV MUL,P and MOV [s],Y with MOV ALU,A
+# can share a bus, as the combined operations.
+_X_SLOTS = {
+    XBusOpcodes.NOP: frozenset(),
+    XBusOpcodes.MOV_SRC_X: frozenset({"X"}),
+    XBusOpcodes.MOV_MUL_P: frozenset({"P"}),
+    XBusOpcodes.MOV_SRC_P: frozenset({"X", "P"}),
+    XBusOpcodes.MOV_SRC_X_MUL_P: frozenset({"X", "P"}),
+}
+_Y_SLOTS = {
+    YBusOpcodes.NOP: frozenset(),
+    YBusOpcodes.MOV_SRC_Y: frozenset({"Y"}),
+    YBusOpcodes.MOV_ALU_A: frozenset({"A"}),
+    YBusOpcodes.CLR_A: frozenset({"Y", "A"}),
+    YBusOpcodes.MOV_SRC_A: frozenset({"Y", "A"}),
+    YBusOpcodes.MOV_SRC_Y_ALU_A: frozenset({"Y", "A"}),
+}
+
+
+class Effects(NamedTuple):
+    slots: FrozenSet[str]
+    reads: FrozenSet[str]
+    writes: FrozenSet[str]
+
+
+def effects(inst: Instruction) -> Effects:
+    """
+    Returns the slots used by a normal instruction, and the registers and memories it reads and writes.
+    """
+    slots = set()
+    reads = set()
+    writes = set()
+
+    def read_source(name: str):
+        if name in ("ALL", "ALH"):
+            reads.add(ALU)
+            return
+        bank = name[-1]
+        reads.update((f"RAM{bank}", f"CT{bank}"))
+        if name.startswith("MC"):
+            writes.add(f"CT{bank}")
+
+    if inst.aluControlCommand.opcode != AluOpcodes.NOP:
+        slots.add("ALU")
+        reads.update(("A", "P"))
+        # The flags are written with the result
+        writes.add(ALU)
+
+    x_bus = inst.xBusControlCommand
+    slots |= _X_SLOTS[x_bus.opcode]
+    if x_bus.opcode in (XBusOpcodes.MOV_SRC_X, XBusOpcodes.MOV_SRC_X_MUL_P):
+        read_source(x_bus.source.name)
+        writes.add("RX")
+    if x_bus.opcode in (XBusOpcodes.MOV_MUL_P, XBusOpcodes.MOV_SRC_X_MUL_P):
+        reads.update(("RX", "RY"))
+        writes.add("P")
+    elif x_bus.opcode == XBusOpcodes.MOV_SRC_P:
+        read_source(x_bus.source.name)
+        writes.add("P")
+
+    y_bus = inst.yBusControlCommand
+    slots |= _Y_SLOTS[y_bus.opcode]
+    if y_bus.opcode in (YBusOpcodes.MOV_SRC_Y, YBusOpcodes.MOV_SRC_Y_ALU_A):
+        read_source(y_bus.source.name)
+        writes.add("RY")
+    if y_bus.opcode in (YBusOpcodes.MOV_ALU_A, YBusOpcodes.MOV_SRC_Y_ALU_A):
+        reads.add(ALU)
+        writes.add("A")
+    elif y_bus.opcode == YBusOpcodes.CLR_A:
+        writes.add("A")
+    elif y_bus.opcode == YBusOpcodes.MOV_SRC_A:
+        read_source(y_bus.source.name)
+        writes.add("A")
+
+    d1 = inst.d1BusControlCommand
+    if d1.opcode != D1BusOpcodes.NOP:
+        slots.add("D1")
+        if d1.opcode == D1BusOpcodes.MOV_SRC_DST:
+            read_source(d1.source.name)
+        destination = d1.destination.name
+        if destination.startswith("MC"):
+            bank = destination[-1]
+            reads.add(f"CT{bank}")
+            writes.update((f"RAM{bank}", f"CT{bank}"))
+        elif destination == "PL":
+            writes.add("P")
+        else:
+            writes.add(destination)
+
+    return Effects(frozenset(slots), frozenset(reads), frozenset(writes))
+
+
+def counters_after(inst: Instruction, counters: List[Optional[int]]) -> List[Optional[int]]:
+    """
+    Follows the known values of CT0-CT3 through a normal instruction, None when unknown.
+    """
+    writes = effects(inst).writes
+    d1 = inst.d1BusControlCommand
+    counters = list(counters)
+    for bank in range(4):
+        if f"CT{bank}" not in writes:
+            continue
+        if d1.opcode != D1BusOpcodes.NOP and d1.destination.name == f"CT{bank}":
+            # Writing CTn wins over the increments
+            counters[bank] = d1.immediate & 0x3F if d1.opcode == D1BusOpcodes.MOV_IMM_DST else None
+        elif counters[bank] is not None:
+            counters[bank] = (counters[bank] + 1) & 0x3F
+    return counters
+
+
+def merge(first: Instruction, second: Instruction) -> Instruction:
+    """
+    Merges two normal instructions using different slots into one.
+    """
+    alu = second.aluControlCommand if first.aluControlCommand.opcode == AluOpcodes.NOP else first.aluControlCommand
+    d1 = second.d1BusControlCommand if first.d1BusControlCommand.opcode == D1BusOpcodes.NOP \
+        else first.d1BusControlCommand
+    return Instruction(alu, _merge_x(first.xBusControlCommand, second.xBusControlCommand),
+                       _merge_y(first.yBusControlCommand, second.yBusControlCommand), d1)
+
+
+def _merge_x(first: XBusControlCommand, second: XBusControlCommand) -> XBusControlCommand:
+    if first.opcode == XBusOpcodes.NOP:
+        return second
+    if second.opcode == XBusOpcodes.NOP:
+        return first
+    load = first if first.opcode == XBusOpcodes.MOV_SRC_X else second
+    return XBusControlCommand(XBusOpcodes.MOV_SRC_X_MUL_P, load.source)
+
+
+def _merge_y(first: YBusControlCommand, second: YBusControlCommand) -> YBusControlCommand:
+    if first.opcode == YBusOpcodes.NOP:
+        return second
+    if second.opcode == YBusOpcodes.NOP:
+        return first
+    load = first if first.opcode == YBusOpcodes.MOV_SRC_Y else second
+    return YBusControlCommand(YBusOpcodes.MOV_SRC_Y_ALU_A, load.source)
+
+
+def schedule(instructions: List[Instruction]) -> List[Instruction]:
+    """
+    Packs a sequence of normal instructions, run in order without jumps in or out of it.
+    """
+    cycles: List[Instruction] = []
+    used: List[Set[str]] = []  # Slots used in each cycle
+    placed: List[tuple] = []  # Tuples of (cycle, effects) of the instructions scheduled so far
+
+    for inst in instructions:
+        current = effects(inst)
+        earliest = 0
+        for cycle, previous in placed:
+            if previous.writes & current.writes or previous.writes & (current.reads - {ALU}):
+                # Read after write, or write after write: in a later cycle
+                earliest = max(earliest, cycle + 1)
+            elif previous.writes & current.reads or previous.reads & current.writes - {ALU}:
+                # Reading the ALU result, or write after read: the same cycle at the earliest
+                earliest = max(earliest, cycle)
+            if ALU in previous.reads and ALU in current.writes:
+                # The read would see the new result
+                earliest = max(earliest, cycle + 1)
+
+        target = next((index for index in range(earliest, len(cycles)) if not used[index] & current.slots),
+                      len(cycles))
+        if target == len(cycles):
+            cycles.append(inst)
+            used.append(set(current.slots))
+        else:
+            cycles[target] = merge(cycles[target], inst)
+            used[target] |= current.slots
+        placed.append((target, current))
+    return cycles
+
+
+def jump_target(inst: Instruction) -> Optional[int]:
+    """
+    Returns the instruction address used by an instruction, if any.
+    """
+    cmd = inst.specialCommand
+    if isinstance(cmd, JumpCommand):
+        return cmd.immediate & 0xFF
+    if isinstance(cmd, MVICommand) and cmd.destination == MVIStorageDestination.PC:
+        return cmd.immediate & 0xFF
+    d1 = inst.d1BusControlCommand
+    if cmd is None and d1.opcode == D1BusOpcodes.MOV_IMM_DST and d1.destination == D1BusDataDestination.TOP:
+        return d1.immediate & 0xFF
+    return None
+
+
+def with_target(inst: Instruction, target: int) -> Instruction:
+    """
+    Returns a copy of an instruction using another instruction address, see jump_target.
+    """
+    inst = inst.copy()
+    if inst.specialCommand is not None:
+        inst.specialCommand.immediate = target
+    else:
+        inst.d1BusControlCommand = D1BusControlCommand(D1BusOpcodes.MOV_IMM_DST, D1BusDataDestination.TOP,
+                                                       immediate=target)
+    return inst
+
+
+def boundaries(program: Program) -> Tuple[Set[int], Set[int]]:
+    """
+    Finds the instructions code can't be moved across.
+    :return: The leaders (labels and jump targets), and the isolated instructions (delay slots and
+    instructions repeated by LPS)
+    """
+    leaders = set(program.context.labels.values())
+    isolated = set()
+    for index, inst in enumerate(program.instructions):
+        target = jump_target(inst)
+        if target is not None:
+            leaders.add(target)
+        if _branches(inst):
+            isolated.add(index + 1)
+
+    # With a jump in its delay slot, the target of a jump runs alone, as the delay slot of the second jump
+    for index, inst in enumerate(program.instructions[1:], 1):
+        target = jump_target(program.instructions[index - 1])
+        if _branches(inst) and _branches(program.instructions[index - 1]) and target is not None:
+            isolated.add(target)
+    return leaders, isolated
+
+
+def _branches(inst: Instruction) -> bool:
+    """
+    Whether an instruction has a delay slot, or repeats the next one (LPS).
+    """
+    cmd = inst.specialCommand
+    return (isinstance(cmd, (JumpCommand, LoopCommand))
+            or isinstance(cmd, MVICommand) and cmd.destination == MVIStorageDestination.PC)
+
+
+def relocate(program: Program, instructions: List[Instruction], addresses: Dict[int, int]) -> Program:
+    """
+    Returns a program made of new instructions, with the labels and jump targets moved to their new address.
+    :param addresses: New address of every leader of the original program, and of its end
+    """
+    result = Program()
+    result.context.constants = dict(program.context.constants)
+    result.context.labels = {name: addresses[index] for name, index in program.context.labels.items()}
+    result.instructions = list(instructions)
+    for index, inst in enumerate(result.instructions):
+        target = jump_target(inst)
+        if target is None:
+            continue
+        if target in addresses:
+            result.instructions[index] = with_target(inst, addresses[target])
+        else:
+            logger.warning(f"Address {target:#04x} is outside of the program, it is left unchanged")
+    return result
+
+
+def pack_program(program: Program) -> Program:
+    """
+    Returns a new program with its instructions packed.
+    """
+    instructions = program.instructions
+    leaders, isolated = boundaries(program)
+
+    packed: List[Instruction] = []
+    addresses: Dict[int, int] = {}  # Packed address of each leader
+    region: List[Instruction] = []
+
+    def flush():
+        packed.extend(schedule(region))
+        region.clear()
+
+    for index, inst in enumerate(instructions):
+        if index in leaders or index in isolated or inst.specialCommand is not None:
+            flush()
+            addresses[index] = len(packed)
+        if inst.specialCommand is not None or index in isolated:
+            packed.append(inst)
+        else:
+            region.append(inst)
+    flush()
+    addresses[len(instructions)] = len(packed)
+
+    logger.info(f"Packed {len(instructions)} instructions into {len(packed)}.")
+    return relocate(program, packed, addresses)
@@ -0,0 +1,197 @@
+"""
+Compilation or decompilation of many files at once, spread over a pool of worker processes.
+"""
+import argparse
+import glob
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from typing import List, NamedTuple, Optional, Tuple
+
+from despiste.compile import compile_file
+from despiste.compile_cache import CompileCache, DEFAULT_MAX_SIZE
+from despiste.decompile import decompile_file
+
+logger = logging.getLogger(__name__)
+
+OUTPUT_SUFFIXES = {
+    'compile': '.bin',
+    'decompile': '.dsp',
+}
+
+
+class FileResult(NamedTuple):
+    input_file: str
+    output_file: str
+    ok: bool
+    message: str
+    # Of the compilation cache, added up and saved once by run_many
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+
+
+def expand_inputs(patterns: List[str], manifest: Optional[str] = None) -> List[str]:
+    """
+    Expands glob patterns (** is supported) and reads a manifest file with one path or pattern per line.
+    Empty lines and lines starting with '#' in the manifest are ignored. Duplicates are removed.
+    """
+    patterns = list(patterns)
+    if manifest:
+        base = Path(manifest).parent
+        for line in Path(manifest).read_text(encoding="utf-8").splitlines():
+            line = line.strip()
+            if line and not line.startswith('#'):
+                patterns.append(line if os.path.isabs(line) else str(base / line))
+
+    inputs = []
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern, recursive=True)) if glob.has_magic(pattern) else [pattern]
+        for match in matches:
+            if match not in inputs:
+                inputs.append(match)
+    return inputs
+
+
+def output_path(input_file: str, command: str, output_dir: Optional[str] = None) -> str:
+    output = Path(input_file).with_suffix(OUTPUT_SUFFIXES[command])
+    if output_dir:
+        output = Path(output_dir) / output.name
+    return str(output)
+
+
+def process_file(command: str, input_file: str, output_file: str, cache_dir: Optional[str] = None,
+                 cache_size: int = DEFAULT_MAX_SIZE) -> FileResult:
+    """
+    Compiles or decompiles a single file, turning any failure into an unsuccessful result.
+    :param cache_dir: Compilation cache directory, see despiste.compile_cache
+    """
+    cache = CompileCache(cache_dir, cache_size) if command == 'compile' and cache_dir else None
+    try:
+        if command == 'compile':
+            count = len(compile_file(input_file, output_file, cache=cache))
+        else:
+            count = len(decompile_file(input_file, output_file).instructions)
+    except (Exception, SystemExit) as e:
+        message = str(e) if isinstance(e, Exception) else f"exit code {e.code}"
+        return FileResult(input_file, output_file, False, message, *_cache_counts(cache))
+    cached = ", cached" if cache is not None and cache.hits else ""
+    return FileResult(input_file, output_file, True, f"{count} instructions{cached}", *_cache_counts(cache))
+
+
+def _cache_counts(cache: Optional[CompileCache]) -> Tuple[int, int, int]:
+    return (cache.hits, cache.misses, cache.evictions) if cache is not None else (0, 0, 0)
+
+
+def check_outputs(inputs: List[str], outputs: List[str]):
+    """
+    Raises an exception when two inputs would be written to the same output, or an output is an input.
+    """
+    def key(path: str) -> str:
+        return os.path.normcase(os.path.abspath(path))
+
+    written = {}
+    sources = {key(input_file) for input_file in inputs}
+    for input_file, output_file in zip(inputs, outputs):
+        if key(output_file) in sources:
+            raise Exception(f"{input_file} would be written to the input {output_file}")
+        if key(output_file) in written:
+            raise Exception(f"{written[key(output_file)]} and {input_file} would both be written to {output_file}")
+        written[key(output_file)] = input_file
+
+
+def run_many(command: str, inputs: List[str], workers: Optional[int] = None,
+             output_dir: Optional[str] = None, report=logger.info, cache_dir: Optional[str] = None,
+             cache_size: int = DEFAULT_MAX_SIZE, force: bool = False) -> List[FileResult]:
+    """
+    Processes every input file and reports each result as soon as it is available.
+    :param command: Either 'compile' or 'decompile'
+    :param workers: Number of worker processes. With 1 everything runs in the current process.
+    :param cache_dir: Compilation cache directory, see despiste.compile_cache
+    :param report: Called with a status line for each file
+    :param force: Whether decompile overwrites the existing sources, which may have been edited, otherwise their
+        inputs fail. The binaries of compile are always overwritten.
+    :return: The results, in the same order as the inputs
+    """
+    assert command in OUTPUT_SUFFIXES
+    outputs = [output_path(input_file, command, output_dir) for input_file in inputs]
+    check_outputs(inputs, outputs)
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+
+    results = {}
+    jobs = []
+    for input_file, output_file in zip(inputs, outputs):
+        if command == 'decompile' and not force and os.path.exists(output_file):
+            results[input_file] = FileResult(input_file, output_file, False,
+                                             f"{output_file} already exists, use --force to overwrite it")
+            report(format_result(results[input_file]))
+        else:
+            jobs.append((command, input_file, output_file, cache_dir, cache_size))
+
+    if workers == 1 or len(jobs) <= 1:
+        for job in jobs:
+            results[job[1]] = process_file(*job)
+            report(format_result(results[job[1]]))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(process_file, *job) for job in jobs]
+            for future in as_completed(futures):
+                result = future.result()
+                results[result.input_file] = result
+                report(format_result(result))
+
+    if cache_dir:
+        # Saved from a single process, so that the workers don't lose each other's counts
+        cache = CompileCache(cache_dir, cache_size)
+        for result in results.values():
+            cache.hits += result.hits
+            cache.misses += result.misses
+            cache.evictions += result.evictions
+        cache.save_stats()
+    return [results[input_file] for input_file in inputs]
+
+
+def format_result(result: FileResult) -> str:
+    if result.ok:
+        return f"OK    {result.input_file} -> {result.output_file} ({result.message})"
+    return f"FAIL  {result.input_file}: {result.message}"
+
+
+def do_many(command: str, args: List[str]):
+    """
+    Entry point for the compile-many and decompile-many commands.
+    """
+    parser = argparse.ArgumentParser(prog=f"despiste {command}-many",
+                                     description=f"{command.capitalize()} many files in parallel.")
+    parser.add_argument("inputs", nargs="*", help="Input files or glob patterns")
+    parser.add_argument("-m", "--manifest", help="File listing one input path or pattern per line")
+    parser.add_argument("-j", "--workers", type=int, default=None,
+                        help="Number of worker processes (defaults to the number of CPUs)")
+    parser.add_argument("-o", "--output-dir", help="Directory for the outputs (defaults to next to each input)")
+    if command == 'decompile':
+        parser.add_argument("-f", "--force", action="store_true", help="Overwrite the sources that already exist")
+    else:
+        parser.add_argument("--cache-dir", help="Reuse the binaries of unchanged sources from this directory")
+        parser.add_argument("--cache-size", type=int, default=DEFAULT_MAX_SIZE // (1024 * 1024),
+                            help="Size of the cache in MB, the least recently used binaries are removed first")
+    options = parser.parse_args(args)
+
+    inputs = expand_inputs(options.inputs, options.manifest)
+    if not inputs:
+        logger.error("Error: No input files were given.")
+        raise SystemExit(1)
+
+    cache_dir = getattr(options, "cache_dir", None)
+    cache_size = getattr(options, "cache_size", DEFAULT_MAX_SIZE // (1024 * 1024)) * 1024 * 1024
+    try:
+        results = run_many(command, inputs, options.workers, options.output_dir, cache_dir=cache_dir,
+                           cache_size=cache_size, force=getattr(options, "force", False))
+    except Exception as e:
+        logger.error(f"Error: {e}")
+        raise SystemExit(1)
+
+    failed = sum(1 for result in results if not result.ok)
+    logger.info(f"\n{len(results) - failed} succeeded, {failed} failed.")
+    raise SystemExit(1 if failed else 0)
@@ -1,41 +1,116 @@
-from typing import List, Dict
+import logging
+import struct
+import sys
+from array import array
+from typing import List, Dict, Iterable, Optional, TYPE_CHECKING
 
+from despiste.assembler import parse_lines, LineKind
 from despiste.instruction import Instruction
 from despiste.instruction_context import InstructionContext
-from despiste.utils import cut
+from despiste.instruction_list import InstructionList
+from despiste.stats import phase
+
+if TYPE_CHECKING:
+    from despiste.decode_cache import DecodeCache
+
+logger = logging.getLogger(__name__)
 
 
 class Program:
     """
     A Program represents a set of instructions that can be loaded to the DSP.
     The maximum amount of instructions that can be loaded is 256 (1KB of Program RAM).
+    The instructions are stored as their words, and only decoded when accessed, see InstructionList.
     """
-    instructions: List[Instruction] = []
-    context: InstructionContext = InstructionContext()
+    context: InstructionContext
+
+    def __init__(self):
+        self._instructions = InstructionList()
+        self.context = InstructionContext()
+
+    @property
+    def instructions(self) -> InstructionList:
+        return self._instructions
+
+    @instructions.setter
+    def instructions(self, instructions: Iterable[Instruction]):
+        if not isinstance(instructions, InstructionList):
+            instructions = InstructionList.from_instructions(instructions)
+        self._instructions = instructions
 
     @staticmethod
     def from_binary(source: str) -> 'Program':
         # Make sure the source is a multiple of 32, since each instruction is 32 bytes.
         assert len(source) % 32 == 0
 
-        p = Program()
+        num_instructions = len(source) // 32
+        if num_instructions == 0:
+            return Program.from_words([])
 
-        p.instructions = []
+        # The first instruction is stored at the end of the string, so the words come out reversed
+        buffer = int(source, 2).to_bytes(num_instructions * 4, "big")
+        words = struct.unpack(f">{num_instructions}I", buffer)
+        return Program.from_words(reversed(words))
 
-        num_instructions = len(source) // 32
-        for n in range(0, num_instructions):
-            instruction_bytes = cut(source, 32 * n, 32 * n + 32)
+    def to_binary(self) -> str:
+        return "".join(format(word, "032b") for word in self.to_words())
 
-            instruction = Instruction.from_binary(instruction_bytes)
-            p.instructions.append(instruction)
+    @staticmethod
+    def from_words(words: Iterable[int], cache: Optional['DecodeCache'] = None) -> 'Program':
+        """
+        Builds a program from its instructions encoded as 32 bits integers, in execution order.
+        The instructions are decoded when they are accessed, unless a DecodeCache is given: they are then decoded
+        right away, and repeated words share the same (frozen) instruction.
+        Without a cache, words that aren't valid instructions are only rejected when they are accessed.
+        """
+        p = Program()
+        if cache is None:
+            p.instructions = InstructionList(words)
+        else:
+            with phase("decode"):
+                p.instructions = InstructionList(words, cache.decode)
         return p
 
-    def to_binary(self) -> str:
-        result = ""
-        for inst in self.instructions:
-            result += inst.to_binary()
+    def to_words(self) -> List[int]:
+        with phase("encode"):
+            return self.instructions.words().tolist()
+
+    def to_array(self) -> array:
+        """
+        Returns a copy of the words, which doesn't decode the instructions that weren't accessed.
+        """
+        with phase("encode"):
+            return array("I", self.instructions.words())
+
+    def copy(self) -> 'Program':
+        """
+        Returns a program with a copy of the words and the context, without decoding anything.
+        """
+        p = Program()
+        p.instructions = InstructionList(self.instructions.words())
+        p.context.labels = dict(self.context.labels)
+        p.context.constants = dict(self.context.constants)
+        return p
 
-        return result
+    @staticmethod
+    def from_bytes(buffer, cache: Optional['DecodeCache'] = None) -> 'Program':
+        """
+        Builds a program from its binary image: big-endian 32 bits words, in execution order.
+        Accepts any bytes-like object, which is read in place without building intermediate strings.
+        Like from_words, invalid instructions are only rejected when they are accessed.
+        """
+        view = memoryview(buffer).cast("B")
+        # Make sure the buffer is a multiple of 4, since each instruction is 32 bits.
+        assert view.nbytes % 4 == 0
+        words = array("I")
+        words.frombytes(view)
+        if sys.byteorder == "little":
+            words.byteswap()
+        return Program.from_words(words, cache)
+
+    def to_bytes(self) -> bytes:
+        with phase("encode"):
+            return self.instructions.to_bytes()
 
     @staticmethod
     def from_text(lines) -> 'Program':
@@ -44,42 +119,31 @@ class Program:
         instruction_lines = []
         instruction_line_number = []
 
+        with phase("lex"):
+            parsed = list(parse_lines(lines))
+
         # Labels and constants must be registered first so that they can be used before their declaration
-        instruction_counter = 0
-        for line_number, line in enumerate(lines):
-            line = line.replace(',', ' ').replace('\t', ' ').upper().strip()
-            # Is it a full line comment? Or perhaps empty?
-            if line.startswith(';') or line == '':
-                continue
-            # Remove any trailing comment
-            line = line.split(';', 1)[0]
-            elements = line.split()
-            # Is it a label line?
-            # The check for spaces is needed to avoid stuff like 'JMP LABEL:'
-            if elements[0].endswith(':'):
-                # The label should point to the next instruction to be registered
-                p.context.register_label(elements[0], instruction_counter)
-                if len(elements) > 1:
-                    instruction_counter += 1
-                    instruction_lines.append(elements[1:])
-                    instruction_line_number.append(line_number+1)
-            # Is it a constant?
-            elif '=' in line:
-                p.context.register_constant(line)
-            else:
-                instruction_counter += 1
-                instruction_lines.append(elements)
-                instruction_line_number.append(line_number+1)
+        with phase("labels"):
+            for line_number, kind, payload in parsed:
+                if kind == LineKind.LABEL:
+                    # The label should point to the next instruction to be registered
+                    p.context.register_label(payload, len(instruction_lines))
+                elif kind == LineKind.CONSTANT:
+                    p.context.register_constant(payload)
+                else:
+                    instruction_lines.append(payload)
+                    instruction_line_number.append(line_number)
 
         # Second pass is for instructions only
-        for idx, line in enumerate(instruction_lines):
-            try:
-                inst = Instruction.from_text(line, p.context)
-                p.instructions.append(inst)
-            except Exception as e:
-                print(f"An error ({str(e)}) occurred in line {instruction_line_number[idx]}!\n")
-                print(f"  {line}")
-                raise e
+        with phase("instructions"):
+            for idx, line in enumerate(instruction_lines):
+                try:
+                    inst = Instruction.from_text(line, p.context)
+                    p.instructions.append(inst)
+                except Exception as e:
+                    logger.error(f"An error ({str(e)}) occurred in line {instruction_line_number[idx]}!\n")
+                    logger.error(f"  {' '.join(line)}")
+                    raise e
 
         return p
 
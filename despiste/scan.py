@@ -0,0 +1,239 @@
+"""
+Search for DSP programs embedded in large binary images, such as disc images or RAM dumps.
+
+The image is memory mapped and every word-aligned position is classified with the fast decoders of
+despiste.batch. A candidate program is a run of valid words holding an END/ENDI instruction and no
+longer than the 256 words of Program RAM. Candidates are then scored on how much they look like real code.
+"""
+import argparse
+import logging
+import mmap
+import os
+import struct
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, NamedTuple, Optional, Tuple
+
+from despiste.batch import HAVE_NUMPY, InstructionKind, classify_words
+from despiste.commands import JumpCommand, MVICommand, MVIStorageDestination
+from despiste.decompile import program_to_text
+from despiste.program import Program
+
+PROGRAM_RAM_SIZE = 256  # In words
+
+# Words scanned before and after a chunk, so that candidates crossing chunk boundaries are complete
+CHUNK_OVERLAP = 2 * PROGRAM_RAM_SIZE
+
+if HAVE_NUMPY:
+    import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class Candidate(NamedTuple):
+    offset: int  # In bytes, from the start of the image
+    words: Tuple[int, ...]
+    score: float
+
+    @property
+    def program(self) -> Program:
+        return Program.from_words(self.words)
+
+
+def score_program(words: Tuple[int, ...]) -> float:
+    """
+    Scores a sequence of valid words, between 0 and 1.
+    It is the fraction of words that are not all-NOP, multiplied by the fraction of jumps
+    (JMP and MVI to PC) whose target is inside the program.
+    """
+    p = Program.from_words(words)
+    code = sum(1 for word in words if word != 0)
+
+    jumps = 0
+    plausible = 0
+    for inst in p.instructions:
+        cmd = inst.specialCommand
+        if isinstance(cmd, JumpCommand) or (isinstance(cmd, MVICommand) and cmd.destination == MVIStorageDestination.PC):
+            jumps += 1
+            if cmd.immediate < len(words):
+                plausible += 1
+
+    score = code / len(words)
+    if jumps:
+        score *= plausible / jumps
+    return score
+
+
+def find_candidates(words, first: int = 0, last: Optional[int] = None, min_length: int = 8,
+                    min_score: float = 0.5, use_numpy: Optional[bool] = None) -> List[Tuple[int, int, float]]:
+    """
+    Finds candidate programs whose first word is in [first, last).
+    A candidate is a run of valid words holding at least an END/ENDI instruction, without its leading and trailing
+    padding. Code often follows the END instruction (subroutines, loop bodies), so the run is not cut there.
+    Runs longer than the Program RAM are split in windows, each of them holding an END/ENDI.
+    :param words: Sequence of all the words of the image (e.g. a NumPy array on top of a memory map)
+    :return: Tuples of (first word index, last word index, score)
+    """
+    if last is None:
+        last = len(words)
+    # Look behind to find where runs start, and ahead so that programs starting before last are complete
+    hi = min(len(words), last + CHUNK_OVERLAP)
+    behind = CHUNK_OVERLAP
+    while True:
+        lo = max(0, first - behind)
+        kind, valid = classify_words(words[lo:hi], use_numpy)
+        ends, run_starts, run_ends = _find_ends(kind, valid, use_numpy)
+        # Windows depend on those of the previous ENDs in the run. Once an invalid word or 2 * PROGRAM_RAM_SIZE - 1
+        # words without END are behind the first END, they don't anymore, so chunks find the same windows.
+        if lo == 0 or not ends or run_starts[0] > 0 or ends[0] >= 2 * PROGRAM_RAM_SIZE - 1:
+            break
+        behind *= 2
+
+    candidates = []
+    previous_end = -1
+    for end, run_start, run_end in zip(ends, run_starts, run_ends):
+        end += lo
+        if end <= previous_end:
+            continue
+        start = max(run_start + lo, end - PROGRAM_RAM_SIZE + 1, previous_end + 1)
+        previous_end = min(run_end + lo, start + PROGRAM_RAM_SIZE) - 1
+        candidates.append((start, previous_end))
+
+    results = []
+    for start, end in candidates:
+        # Skip the padding around the program
+        while start < end and int(words[start]) == 0:
+            start += 1
+        while end > start and int(words[end]) == 0:
+            end -= 1
+        if not first <= start < last or end - start + 1 < min_length:
+            continue
+        program_words = tuple(int(word) for word in words[start:end + 1])
+        score = score_program(program_words)
+        if score >= min_score:
+            results.append((start, end, score))
+    return results
+
+
+def _find_ends(kind, valid, use_numpy: Optional[bool]):
+    """
+    :return: The indexes of the END/ENDI instructions, and where the run of valid words holding each of them
+             starts and ends (exclusive)
+    """
+    if use_numpy is None:
+        use_numpy = HAVE_NUMPY
+    if use_numpy:
+        invalid = np.append(np.flatnonzero(~valid), len(valid))
+        ends = np.flatnonzero(kind == InstructionKind.END)
+        # Position of the first invalid word after each end
+        following = np.searchsorted(invalid, ends)
+        run_starts = np.where(following > 0, invalid[np.maximum(following - 1, 0)] + 1, 0)
+        return ends.tolist(), run_starts.tolist(), invalid[following].tolist()
+
+    ends = []
+    run_starts = []
+    run_ends = []
+    run_start = 0
+    for idx, (word_kind, word_valid) in enumerate(zip(kind, valid)):
+        if not word_valid:
+            run_ends += [idx] * (len(ends) - len(run_ends))
+            run_start = idx + 1
+        elif word_kind == InstructionKind.END:
+            ends.append(idx)
+            run_starts.append(run_start)
+    run_ends += [len(valid)] * (len(ends) - len(run_ends))
+    return ends, run_starts, run_ends
+
+
+def _map_words(image_file: str):
+    """
+    Memory maps an image, returning the map and a sequence of its big-endian words.
+    """
+    with open(image_file, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size < 4:
+            return None, []
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    count = size // 4
+    if HAVE_NUMPY:
+        return mapped, np.frombuffer(mapped, dtype=">u4", count=count)
+    return mapped, _MappedWords(mapped, count)
+
+
+class _MappedWords:
+    """
+    Read-only sequence of the big-endian words of a buffer, decoded on access.
+    """
+
+    def __init__(self, buffer, count: int):
+        self.buffer = buffer
+        self.count = count
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            start, stop, step = item.indices(self.count)
+            assert step == 1
+            return [word for word, in struct.iter_unpack(">I", self.buffer[start * 4:stop * 4])]
+        return struct.unpack_from(">I", self.buffer, item * 4)[0]
+
+
+def scan_chunk(image_file: str, first: int, last: int, min_length: int, min_score: float) -> List[Candidate]:
+    mapped, words = _map_words(image_file)
+    try:
+        return [
+            Candidate(start * 4, tuple(int(word) for word in words[start:end + 1]), score)
+            for start, end, score in find_candidates(words, first, last, min_length, min_score)
+        ]
+    finally:
+        del words
+        if mapped is not None:
+            mapped.close()
+
+
+def scan_image(image_file: str, workers: int = 1, min_length: int = 8, min_score: float = 0.5) -> List[Candidate]:
+    """
+    Scans a whole image, optionally splitting it in chunks handled by several worker processes.
+    :return: The candidates, sorted by offset
+    """
+    count = os.path.getsize(image_file) // 4
+    if workers <= 1 or count < workers * CHUNK_OVERLAP:
+        return scan_chunk(image_file, 0, count, min_length, min_score)
+
+    chunk = -(-count // workers)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [
+            executor.submit(scan_chunk, image_file, first, min(first + chunk, count), min_length, min_score)
+            for first in range(0, count, chunk)
+        ]
+        results = [candidate for future in futures for candidate in future.result()]
+    return sorted(results, key=lambda candidate: candidate.offset)
+
+
+def do_scan(args: List[str]):
+    """
+    Entry point for the scan command.
+    """
+    parser = argparse.ArgumentParser(prog="despiste scan", description="Find DSP programs inside a binary image.")
+    parser.add_argument("image", help="Image file to scan")
+    parser.add_argument("-j", "--workers", type=int, default=1, help="Number of worker processes")
+    parser.add_argument("--min-length", type=int, default=8, help="Minimum program length in words")
+    parser.add_argument("--min-score", type=float, default=0.5, help="Minimum score, between 0 and 1")
+    parser.add_argument("--offsets-only", action="store_true", help="Do not print the decoded programs")
+    options = parser.parse_args(args)
+
+    if not os.path.exists(options.image):
+        logger.error(f"Error: Could not find the input file {options.image}")
+        raise SystemExit(2)
+
+    candidates = scan_image(options.image, options.workers, options.min_length, options.min_score)
+    for candidate in candidates:
+        print(f"; Offset {candidate.offset:#010x}: {len(candidate.words)} instructions, "
+              f"score {candidate.score:.2f}")
+        if not options.offsets_only:
+            print(program_to_text(candidate.program))
+
+    logger.info(f"{len(candidates)} candidate programs found.")
+    raise SystemExit(0)
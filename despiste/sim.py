@@ -0,0 +1,534 @@
+"""
+Instruction-set simulator for the SCU DSP.
+
+Every instruction word is translated once into a specialised Python function (generated source, compiled with
+exec), which performs exactly the work of that instruction on a DSPState. The same word always gives the same
+function, so step functions are cached and shared between programs.
+
+Model:
+ - Commands of an instruction read the registers as they were at the start of the cycle, and their writes
+   land at the end of it. The ALU result computed in a cycle is the one MOV ALU,A and ALL/ALH see.
+ - JMP, BTM and MVI to PC have one delay slot: the next instruction runs before the jump takes effect.
+   MVI to PC also stores the address of its delay slot in TOP, so that a subroutine can return with BTM.
+ - LPS runs the next instruction LOP + 1 times, then LOP is 0. An LPS repeated by LPS is a one-cycle no-op.
+ - DMA moves the words right away. A DMA without hold keeps T0 set for one cycle per word,
+   while DMAH stalls the DSP for those cycles.
+ - RA0 and WA0 hold word addresses, as on the hardware (the byte address divided by 4). The external memory
+   is a dictionary from word address to word. The address moves by the add mode, in words, after each word.
+"""
+from typing import Callable, Dict, Iterable, List, Optional, Union
+
+from despiste.commands import AluOpcodes, XBusOpcodes, YBusOpcodes, D1BusOpcodes, DMACounterMode, DMADataRam, \
+    DMATransferMode, EndOpcodes, LoopOpcodes, MVICommand, JumpCommand, LoopCommand, EndCommand, DMACommand, \
+    enum_to_field
+from despiste.instruction import Instruction
+from despiste.program import Program
+
+M32 = 0xFFFFFFFF
+M48 = 0xFFFFFFFFFFFF
+DATA_RAM_SIZE = 64
+PROGRAM_RAM_SIZE = 256
+
+StepFunction = Callable[['DSPState'], None]
+
+
+class DSPState:
+    """
+    Registers and memories of the DSP. Registers hold unsigned values of their width:
+    A (ACH:ACL), P (PH:PL) and the ALU result are 48 bits, RX and RY 32 bits.
+    """
+    __slots__ = ("ram", "ct", "rx", "ry", "p", "a", "alu", "z", "s", "c", "e", "lop", "top", "pc", "ra0", "wa0",
+                 "cycles", "dma_until", "branch", "running", "program", "steps", "external")
+
+    def __init__(self, program: Optional[List[int]] = None, steps: Optional[List[StepFunction]] = None):
+        """
+        :param program: The program RAM content, copied
+        :param steps: The step function of each word of program, copied
+        """
+        self.ram: List[List[int]] = [[0] * DATA_RAM_SIZE for _ in range(4)]
+        self.ct: List[int] = [0] * 4
+        self.rx = 0
+        self.ry = 0
+        self.p = 0
+        self.a = 0
+        self.alu = 0
+        # Flags
+        self.z = 0
+        self.s = 0
+        self.c = 0
+        self.e = 0  # Set by ENDI
+        self.lop = 0
+        self.top = 0
+        self.pc = 0
+        self.ra0 = 0
+        self.wa0 = 0
+
+        self.cycles = 0
+        self.dma_until = 0  # T0 is set until this cycle
+        self.branch: Optional[int] = None  # Jump target, taken after the delay slot
+        self.running = True
+
+        if program is None:
+            self.program: List[int] = [0] * PROGRAM_RAM_SIZE
+            self.steps: List[StepFunction] = [step_function(0)] * PROGRAM_RAM_SIZE
+        else:
+            self.program = list(program)
+            self.steps = list(steps)
+        self.external: Dict[int, int] = {}
+
+    @property
+    def t0(self) -> int:
+        return int(self.cycles < self.dma_until)
+
+    def load_program(self, words: Iterable[int], start: int = 0):
+        for offset, word in enumerate(words):
+            self.program[start + offset] = word
+            self.steps[start + offset] = step_function(word)
+
+
+class Simulator:
+    """
+    Runs a program on a DSPState.
+    """
+
+    def __init__(self, program: Union[Program, Iterable[int]], external: Optional[Dict[int, int]] = None):
+        words = program.to_words() if isinstance(program, Program) else list(program)
+        assert len(words) <= PROGRAM_RAM_SIZE
+        # The program RAM once loaded, kept for reset()
+        loaded = DSPState()
+        loaded.load_program(words)
+        self.program = loaded.program
+        self.steps = loaded.steps
+        self.reset(external)
+
+    def reset(self, external: Optional[Dict[int, int]] = None):
+        """
+        Starts again from a clean state with the program loaded, to run it on other data.
+        """
+        self.state = DSPState(self.program, self.steps)
+        if external is not None:
+            self.state.external = external
+
+    def step(self):
+        """
+        Executes a single instruction.
+        """
+        st = self.state
+        pc = st.pc
+        branch = st.branch
+        if branch is None:
+            st.pc = (pc + 1) & 0xFF
+        else:
+            st.branch = None
+            st.pc = branch
+        st.steps[pc](st)
+        st.cycles += 1
+
+    def run(self, max_cycles: int = 1_000_000) -> int:
+        """
+        Runs until END/ENDI, or until max_cycles more cycles have run.
+        :return: The number of cycles run
+        """
+        st = self.state
+        steps = st.steps
+        start = st.cycles
+        limit = start + max_cycles
+        while st.running and st.cycles < limit:
+            pc = st.pc
+            branch = st.branch
+            if branch is None:
+                st.pc = (pc + 1) & 0xFF
+            else:
+                st.branch = None
+                st.pc = branch
+            steps[pc](st)
+            st.cycles += 1
+        return st.cycles - start
+
+
+# Step functions, by instruction word
+_STEP_CACHE: Dict[int, StepFunction] = {}
+
+
+def step_function(word: int) -> StepFunction:
+    """
+    Returns the function executing an instruction word, generating it the first time.
+    """
+    step = _STEP_CACHE.get(word)
+    if step is None:
+        step = _STEP_CACHE[word] = _compile_step(word)
+    return step
+
+
+def _compile_step(word: int) -> StepFunction:
+    try:
+        inst = Instruction.from_word(word)
+    except Exception as e:
+        message = f"Invalid instruction {word:#010x}: {e}"
+
+        def invalid(st: DSPState):
+            raise Exception(message)
+        return invalid
+
+    source = "def step(st):\n" + "\n".join("    " + line for line in generate_step(inst) or ["pass"])
+    namespace = dict(_HELPERS)
+    exec(compile(source, f"<dsp {word:#010x}>", "exec"), namespace)
+    return namespace["step"]
+
+
+def _sext(value: int, bits: int) -> int:
+    """
+    Sign extends a value of the given width to 32 bits, keeping it unsigned.
+    """
+    if value & (1 << (bits - 1)):
+        value -= 1 << bits
+    return value & M32
+
+
+def _sext48(value: int) -> int:
+    """
+    Sign extends a 32 bits value to 48 bits, as done when loading A or P.
+    """
+    return value | 0xFFFF00000000 if value & 0x80000000 else value
+
+
+def _sext48_code(value: str) -> str:
+    """
+    Inlined _sext48, for an expression without side effects.
+    """
+    return f"({value} | 0xFFFF00000000 if {value} & 0x80000000 else {value})"
+
+
+def _mul(rx: int, ry: int) -> int:
+    if rx & 0x80000000:
+        rx -= 1 << 32
+    if ry & 0x80000000:
+        ry -= 1 << 32
+    return (rx * ry) & M48
+
+
+def _dma(st: DSPState, to_d0: bool, ram: int, add: int, count: int, hold: bool):
+    if to_d0:
+        address = st.wa0
+        bank = st.ram[ram]
+        for _ in range(count):
+            st.external[address] = bank[st.ct[ram]]
+            st.ct[ram] = (st.ct[ram] + 1) & 0x3F
+            address = (address + add) & M32
+        st.wa0 = address
+    else:
+        address = st.ra0
+        for offset in range(count):
+            value = st.external.get(address, 0)
+            if ram == _PROGRAM_RAM:
+                # The program RAM is written from its beginning
+                st.load_program([value], offset & 0xFF)
+            else:
+                st.ram[ram][st.ct[ram]] = value
+                st.ct[ram] = (st.ct[ram] + 1) & 0x3F
+            address = (address + add) & M32
+        st.ra0 = address
+
+    if hold:
+        st.cycles += count
+    else:
+        # The current cycle is counted once the step returns
+        st.dma_until = st.cycles + 1 + count
+
+
+_PROGRAM_RAM = enum_to_field(DMADataRam.PRG)
+
+_HELPERS = {
+    "_mul": _mul,
+    "_dma": _dma,
+}
+
+# Python expression of every condition, for MVI and JMP
+_CONDITIONS = {
+    "Z": "st.z",
+    "NZ": "not st.z",
+    "S": "st.s",
+    "NS": "not st.s",
+    "C": "st.c",
+    "NC": "not st.c",
+    "T0": "st.cycles < st.dma_until",
+    "NT0": "st.cycles >= st.dma_until",
+    "ZS": "st.z or st.s",
+    "NZS": "not (st.z or st.s)",
+}
+
+
+def generate_step(inst: Instruction) -> List[str]:
+    """
+    Generates the body of the step function of an instruction, as a list of lines.
+    """
+    cmd = inst.specialCommand
+    if cmd is not None:
+        # Frozen commands of a DecodeCache are subclasses of the command types
+        generator = next(generate for command_type, generate in _SPECIAL_GENERATORS.items()
+                         if isinstance(cmd, command_type))
+        return generator(cmd)
+    return _NormalStep(inst).generate()
+
+
+class _NormalStep:
+    """
+    Generates the code of a normal instruction: reads first, then the ALU, then the writes.
+    """
+
+    def __init__(self, inst: Instruction):
+        self.inst = inst
+        self.reads: List[str] = []
+        self.body: List[str] = []
+        self.writes: List[str] = []
+        self.increments: List[int] = []  # Banks whose CT is incremented
+        self.counter_writes: List[str] = []  # Writes to CT0-CT3, which win over increments
+        self.uses_ram = False
+        self.read_banks = set()
+
+    def source(self, name: str) -> str:
+        """
+        Returns an expression for a bus source (M0-M3, MC0-MC3, ALL, ALH), reading it at the start of the cycle.
+        """
+        if name == "ALL":
+            return "(alu & 0xFFFFFFFF)"
+        if name == "ALH":
+            return "(alu >> 32 & 0xFFFF)"
+
+        bank = int(name[-1])
+        if bank not in self.read_banks:
+            self.uses_ram = True
+            self.read_banks.add(bank)
+            self.reads.append(f"m{bank} = ram[{bank}][ct[{bank}]]")
+        if name.startswith("MC") and bank not in self.increments:
+            self.increments.append(bank)
+        return f"m{bank}"
+
+    def generate(self) -> List[str]:
+        inst = self.inst
+        alu_result_used = self._uses_alu_result()
+        # The multiplier and the ALU use the registers from the start of the cycle
+        if inst.xBusControlCommand.opcode in (XBusOpcodes.MOV_MUL_P, XBusOpcodes.MOV_SRC_X_MUL_P):
+            self.body.append("mul = _mul(st.rx, st.ry)")
+        self._generate_alu(alu_result_used)
+        self._generate_x_bus()
+        self._generate_y_bus()
+        self._generate_d1_bus()
+
+        lines = []
+        if self.uses_ram:
+            lines += ["ram = st.ram", "ct = st.ct"]
+        lines += self.reads + self.body + self.writes
+        for bank in self.increments:
+            lines.append(f"ct[{bank}] = (ct[{bank}] + 1) & 0x3F")
+        lines += self.counter_writes
+        return lines
+
+    def _uses_alu_result(self) -> bool:
+        inst = self.inst
+        d1 = inst.d1BusControlCommand
+        return (inst.yBusControlCommand.opcode in (YBusOpcodes.MOV_ALU_A, YBusOpcodes.MOV_SRC_Y_ALU_A)
+                or (d1.opcode == D1BusOpcodes.MOV_SRC_DST and d1.source.name in ("ALL", "ALH")))
+
+    def _generate_alu(self, result_used: bool):
+        opcode = self.inst.aluControlCommand.opcode
+        if opcode == AluOpcodes.NOP:
+            if result_used:
+                self.body.append("alu = st.alu")
+            return
+
+        body = self.body
+        if opcode == AluOpcodes.AD2:
+            body += [
+                "r = st.a + st.p",
+                "st.c = r >> 48",
+                "r &= 0xFFFFFFFFFFFF",
+                "st.z = 0 if r else 1",
+                "st.s = r >> 47",
+                "alu = st.alu = r",
+            ]
+            return
+
+        body.append("a = st.a")
+        body.append("acl = a & 0xFFFFFFFF")
+        if opcode == AluOpcodes.AND:
+            body += ["r = acl & st.p & 0xFFFFFFFF", "st.c = 0"]
+        elif opcode == AluOpcodes.OR:
+            body += ["r = acl | (st.p & 0xFFFFFFFF)", "st.c = 0"]
+        elif opcode == AluOpcodes.XOR:
+            body += ["r = acl ^ (st.p & 0xFFFFFFFF)", "st.c = 0"]
+        elif opcode == AluOpcodes.ADD:
+            body += ["r = acl + (st.p & 0xFFFFFFFF)", "st.c = r >> 32", "r &= 0xFFFFFFFF"]
+        elif opcode == AluOpcodes.SUB:
+            body += ["r = acl - (st.p & 0xFFFFFFFF)", "st.c = 1 if r < 0 else 0", "r &= 0xFFFFFFFF"]
+        elif opcode == AluOpcodes.SR:
+            body += ["st.c = acl & 1", "r = acl >> 1 | acl & 0x80000000"]
+        elif opcode == AluOpcodes.RR:
+            body += ["st.c = acl & 1", "r = acl >> 1 | (acl & 1) << 31"]
+        elif opcode == AluOpcodes.SL:
+            body += ["st.c = acl >> 31", "r = acl << 1 & 0xFFFFFFFF"]
+        elif opcode == AluOpcodes.RL:
+            body += ["st.c = acl >> 31", "r = (acl << 1 & 0xFFFFFFFF) | acl >> 31"]
+        elif opcode == AluOpcodes.RL8:
+            body += ["st.c = acl >> 24 & 1", "r = (acl << 8 & 0xFFFFFFFF) | acl >> 24"]
+        else:
+            raise Exception(f"Unexpected ALU opcode {opcode}")
+        # 32 bits operations keep ACH in the upper part of the result
+        body += [
+            "st.z = 0 if r else 1",
+            "st.s = r >> 31",
+            "alu = st.alu = (a & 0xFFFF00000000) | r",
+        ]
+
+    def _generate_x_bus(self):
+        cmd = self.inst.xBusControlCommand
+        if cmd.opcode in (XBusOpcodes.MOV_SRC_X, XBusOpcodes.MOV_SRC_X_MUL_P):
+            self.writes.append(f"st.rx = {self.source(cmd.source.name)}")
+        if cmd.opcode in (XBusOpcodes.MOV_MUL_P, XBusOpcodes.MOV_SRC_X_MUL_P):
+            self.writes.append("st.p = mul")
+        elif cmd.opcode == XBusOpcodes.MOV_SRC_P:
+            self.writes.append(f"st.p = {_sext48_code(self.source(cmd.source.name))}")
+
+    def _generate_y_bus(self):
+        cmd = self.inst.yBusControlCommand
+        if cmd.opcode in (YBusOpcodes.MOV_SRC_Y, YBusOpcodes.MOV_SRC_Y_ALU_A):
+            self.writes.append(f"st.ry = {self.source(cmd.source.name)}")
+        if cmd.opcode in (YBusOpcodes.MOV_ALU_A, YBusOpcodes.MOV_SRC_Y_ALU_A):
+            self.writes.append("st.a = alu")
+        elif cmd.opcode == YBusOpcodes.CLR_A:
+            self.writes.append("st.a = 0")
+        elif cmd.opcode == YBusOpcodes.MOV_SRC_A:
+            self.writes.append(f"st.a = {_sext48_code(self.source(cmd.source.name))}")
+
+    def _generate_d1_bus(self):
+        cmd = self.inst.d1BusControlCommand
+        if cmd.opcode == D1BusOpcodes.NOP:
+            return
+        if cmd.opcode == D1BusOpcodes.MOV_IMM_DST:
+            value = _sext(cmd.immediate, 8)
+        else:
+            value = self.source(cmd.source.name)
+
+        destination = cmd.destination.name
+        if destination.startswith("MC"):
+            bank = int(destination[-1])
+            self.uses_ram = True
+            self.writes.append(f"ram[{bank}][ct[{bank}]] = {value}")
+            if bank not in self.increments:
+                self.increments.append(bank)
+        elif destination.startswith("CT"):
+            self.uses_ram = True
+            self.counter_writes.append(f"ct[{destination[-1]}] = {_masked(value, 0x3F)}")
+        else:
+            self.writes.append(_register_write(destination, value))
+
+
+def _masked(value: Union[int, str], mask: int) -> str:
+    """
+    Masks an immediate value when generating the code, or an expression when running it.
+    """
+    return str(value & mask) if isinstance(value, int) else f"{value} & {mask:#x}"
+
+
+def _register_write(destination: str, value: Union[int, str]) -> str:
+    """
+    Writes to the registers that D1-Bus moves and MVI have in common.
+    :param value: An immediate value, or an expression
+    """
+    if destination == "RX":
+        return f"st.rx = {value}"
+    if destination == "PL":
+        return f"st.p = {_sext48(value) if isinstance(value, int) else _sext48_code(value)}"
+    if destination == "RA0":
+        return f"st.ra0 = {value}"
+    if destination == "WA0":
+        return f"st.wa0 = {value}"
+    if destination == "LOP":
+        return f"st.lop = {_masked(value, 0xFFF)}"
+    if destination == "TOP":
+        return f"st.top = {_masked(value, 0xFF)}"
+    raise Exception(f"Unexpected destination {destination}")
+
+
+def _generate_mvi(cmd: MVICommand) -> List[str]:
+    value = _sext(cmd.immediate, 19 if cmd.condition else 25)
+    destination = cmd.destination.name
+    if destination == "PC":
+        # Used to call subroutines: TOP keeps the return address (the delay slot), for BTM
+        lines = ["st.top = st.pc", f"st.branch = {value & 0xFF}"]
+    elif destination.startswith("MC"):
+        bank = int(destination[-1])
+        lines = [f"st.ram[{bank}][st.ct[{bank}]] = {value}", f"st.ct[{bank}] = (st.ct[{bank}] + 1) & 0x3F"]
+    else:
+        lines = [_register_write(destination, value)]
+    return _conditional(cmd.condition, lines)
+
+
+def _generate_jump(cmd: JumpCommand) -> List[str]:
+    return _conditional(cmd.condition, [f"st.branch = {cmd.immediate & 0xFF}"])
+
+
+def _generate_loop(cmd: LoopCommand) -> List[str]:
+    if cmd.opcode == LoopOpcodes.BTM:
+        return [
+            "if st.lop:",
+            "    st.lop = (st.lop - 1) & 0xFFF",
+            "    st.branch = st.top",
+        ]
+    # LPS: the next instruction is run LOP + 1 times, taking one cycle each time.
+    # A repeated LPS does nothing, it would repeat itself forever otherwise.
+    return [
+        "pc = st.pc",
+        f"if st.program[pc] >> 27 == {enum_to_field(LoopOpcodes.LPS)}:",
+        "    st.cycles += st.lop + 1",
+        "else:",
+        "    step = st.steps[pc]",
+        "    for _ in range(st.lop + 1):",
+        "        st.cycles += 1",
+        "        step(st)",
+        "st.lop = 0",
+        "st.pc = (pc + 1) & 0xFF",
+    ]
+
+
+def _generate_dma(cmd: DMACommand) -> List[str]:
+    to_d0 = cmd.dma_mode == DMATransferMode.RAM_TO_D0
+    ram = enum_to_field(cmd.ram_address_pointer)
+    if to_d0 and cmd.ram_address_pointer == DMADataRam.PRG:
+        raise Exception("The program RAM can't be transferred to D0")
+
+    lines = []
+    if cmd.dma_counter_mode == DMACounterMode.IMMEDIATE:
+        count = str(cmd.data_size)
+    else:
+        # The counter is read from a data RAM, incrementing its CT when the high bit is set
+        code = enum_to_field(cmd.dma_counter_ram)
+        bank = code & 0b11
+        lines.append(f"count = st.ram[{bank}][st.ct[{bank}]] & 0xFF")
+        if code & 0b100:
+            lines.append(f"st.ct[{bank}] = (st.ct[{bank}] + 1) & 0x3F")
+        count = "count"
+    lines.append(f"_dma(st, {to_d0}, {ram}, {cmd.address_add_mode}, {count}, {cmd.hold})")
+    return lines
+
+
+def _generate_end(cmd: EndCommand) -> List[str]:
+    lines = ["st.running = False"]
+    if cmd.opcode == EndOpcodes.ENDI:
+        lines.append("st.e = 1")
+    return lines
+
+
+def _conditional(condition, lines: List[str]) -> List[str]:
+    if condition is None:
+        return lines
+    return [f"if {_CONDITIONS[condition.name]}:"] + ["    " + line for line in lines]
+
+
+_SPECIAL_GENERATORS = {
+    MVICommand: _generate_mvi,
+    JumpCommand: _generate_jump,
+    LoopCommand: _generate_loop,
+    DMACommand: _generate_dma,
+    EndCommand: _generate_end,
+}
@@ -0,0 +1,150 @@
+"""
+Run statistics: the time spent in each phase of a compilation or decompilation, the throughput and the peak memory.
+
+The library marks its phases with phase(name), which does nothing unless a Profiler is active:
+
+    with Profiler() as profiler:
+        compile_file("kernel.dsp", "kernel.bin")
+    print(profiler.report())
+
+The phases are import, read, lex, labels, instructions, encode, decode, render and write. The throughput leaves
+the import phase out. Programs decode their instructions when they are first accessed, so decode is timed there
+(see InstructionList.decode), not on loading.
+"""
+import time
+from contextlib import nullcontext
+from typing import Dict, List, Optional, Tuple
+
+# The profiler collecting the phases, if any
+_active: Optional['Profiler'] = None
+
+_NO_PHASE = nullcontext()
+
+
+class _Phase:
+    __slots__ = ("profiler", "name", "start")
+
+    def __init__(self, profiler: 'Profiler', name: str):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc):
+        self.profiler.add(self.name, time.perf_counter() - self.start)
+
+
+def phase(name: str):
+    """
+    Returns a context manager adding the time spent in it to a phase of the active profiler.
+    """
+    if _active is None:
+        return _NO_PHASE
+    return _Phase(_active, name)
+
+
+def profiling() -> bool:
+    return _active is not None
+
+
+def count_instructions(count: int):
+    """
+    Adds to the number of instructions handled by the active profiler, used for the throughput.
+    """
+    if _active is not None:
+        _active.instructions += count
+
+
+class Profiler:
+    """
+    Collects the phases run while it is active. Only one profiler can be active at a time.
+    Tracing the memory slows the run down, which shows in the phase times.
+    :param trace_memory: Whether to measure the peak memory with tracemalloc
+    :param profile_file: A file to dump cProfile statistics to, which can be read with pstats
+    """
+
+    def __init__(self, trace_memory: bool = True, profile_file: Optional[str] = None):
+        self.trace_memory = trace_memory
+        self.profile_file = profile_file
+        self.phases: Dict[str, float] = {}
+        self.instructions = 0
+        self.elapsed = 0.0
+        self.peak_memory: Optional[int] = None
+        self._start = 0.0
+        self._started_tracing = False
+        self._cprofile = None
+
+    def add(self, name: str, seconds: float):
+        self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    def __enter__(self) -> 'Profiler':
+        global _active
+        if _active is not None:
+            raise Exception("A profiler is already active")
+        _active = self
+        if self.trace_memory:
+            import tracemalloc
+            self._started_tracing = not tracemalloc.is_tracing()
+            if self._started_tracing:
+                tracemalloc.start()
+            tracemalloc.reset_peak()
+        if self.profile_file:
+            import cProfile
+            self._cprofile = cProfile.Profile()
+            self._cprofile.enable()
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        global _active
+        self.elapsed = time.perf_counter() - self._start
+        if self._cprofile is not None:
+            self._cprofile.disable()
+            self._cprofile.dump_stats(self.profile_file)
+            self._cprofile = None
+        if self.trace_memory:
+            import tracemalloc
+            self.peak_memory = tracemalloc.get_traced_memory()[1]
+            if self._started_tracing:
+                tracemalloc.stop()
+        _active = None
+        return False
+
+    def report(self) -> str:
+        lines = [f"{'Phase':<14}{'Time (ms)':>12}{'Share':>8}"]
+        for name, seconds in self.phases.items():
+            share = seconds / self.elapsed if self.elapsed else 0.0
+            lines.append(f"{name:<14}{seconds * 1000:>12.3f}{share:>8.1%}")
+        lines.append(f"{'total':<14}{self.elapsed * 1000:>12.3f}")
+        if self.instructions:
+            # Importing the modules doesn't depend on the number of instructions
+            working = self.elapsed - self.phases.get("import", 0.0)
+            rate = self.instructions / working if working > 0 else 0.0
+            lines.append(f"{self.instructions} instructions, {rate:,.0f} instructions/s")
+        if self.peak_memory is not None:
+            lines.append(f"Peak memory: {self.peak_memory / 1024:,.1f} KiB")
+        if self.profile_file:
+            lines.append(f"cProfile statistics written to {self.profile_file}")
+        return "\n".join(lines)
+
+
+def split_stats_flags(args: List[str]) -> Tuple[bool, Optional[str], List[str]]:
+    """
+    Removes the --stats and --profile[=FILE] flags from the command line arguments.
+    --profile alone is --stats, a file also gets the cProfile statistics.
+    :return: Whether statistics are asked for, the cProfile file and the remaining arguments
+    """
+    stats = False
+    profile_file = None
+    remaining = []
+    for arg in args:
+        if arg in ("--stats", "--profile"):
+            stats = True
+        elif arg.startswith("--profile="):
+            stats = True
+            profile_file = arg.split("=", 1)[1]
+        else:
+            remaining.append(arg)
+    return stats, profile_file, remaining
+
@@ -1,4 +1,18 @@
-from pathlib import Path
+import logging
+import struct
+import sys
+from typing import Iterator, List, Sequence, Tuple
+
+from despiste.stats import phase
+
+logger = logging.getLogger("despiste")
+
+# Finer than DEBUG, for messages emitted once per command or word
+TRACE = 5
+logging.addLevelName(TRACE, "TRACE")
+
+# Output file name meaning the standard output
+STDOUT = "-"
 
 
 def cut(source: str, start: int, end: int) -> str:
@@ -15,24 +29,127 @@ def cut(source: str, start: int, end: int) -> str:
     return source[size-end: size-start]
 
 
+def bit_field(source: int, start: int, end: int) -> int:
+    """
+    Integer counterpart of cut.
+    Given a word, returns the value of the bits between start and end.
+    :param source: An integer holding the encoded bits
+    :param start: Lowest bit of the field
+    :param end: Where the field ends (exclusive)
+    :return: The field value, shifted down to bit 0.
+    """
+    return (source >> start) & ((1 << (end - start)) - 1)
+
+
 def print_help_message():
-    print("\nUsage:")
-    print("\tdespite compile input.dsp [output.bin]")
-    print("\tdespite decompile input.bin [output.dsp]")
+    print("\nUsage:", file=sys.stderr)
+    print("\tdespite [-q | -v | -vv] [--stats | --profile[=FILE]] compile [--pack] [--optimize[=PASSES]] "
+          "[--optimize-report] [--cache-dir DIR [--cache-size MB]] input.dsp [output.bin]", file=sys.stderr)
+    print("\tdespite [-q | -v | -vv] [--stats | --profile[=FILE]] decompile input.bin [output.dsp]", file=sys.stderr)
+    print("\tdespite compile-many [-j WORKERS] [-m MANIFEST] [-o OUTPUT_DIR] [--cache-dir DIR] inputs...",
+          file=sys.stderr)
+    print("\tdespite decompile-many [-j WORKERS] [-m MANIFEST] [-o OUTPUT_DIR] [-f] inputs...", file=sys.stderr)
+    print("\tdespite scan [-j WORKERS] [--min-length N] [--min-score S] [--offsets-only] image", file=sys.stderr)
+    print("\tdespite watch [-r] [--interval SECONDS] [--debounce SECONDS] directory", file=sys.stderr)
+    print("\tdespite lsp (language server on the standard input and output)", file=sys.stderr)
+    print("\tdespite analyze --cycles [--budget CYCLES] input", file=sys.stderr)
+    print("\tdespite cache --cache-dir DIR [--clear]", file=sys.stderr)
     print("\nIf a third parameter is specified, it will be used as the name for the "
-          "output file. Otherwise the standard output will be used.")
+          "output file. Otherwise the standard output will be used.", file=sys.stderr)
+    print("--pack merges consecutive instructions using different buses, when it doesn't change the result.",
+          file=sys.stderr)
+    print("--optimize runs the default optimizer passes, or the comma separated PASSES in order: hardware-loops, "
+          "overlap-dma, thread-jumps, fold-ct-increment, drop-clr-a, remove-nops and pack. Each pass reports the "
+          "words it saved. --optimize-report, or -vv, also counts the cycles saved by each pass, which takes longer.",
+          file=sys.stderr)
+    print("--stats shows the time spent in each phase, the instructions per second and the peak memory on the "
+          "standard error. --profile=FILE also writes cProfile statistics to FILE.", file=sys.stderr)
+    print("--cache-dir reuses the binaries of unchanged sources, keeping the most recently used ones within "
+          "--cache-size (64 MB by default).", file=sys.stderr)
+    print(f"With '{STDOUT}' as the output file, the standard output only gets the produced file.", file=sys.stderr)
+    print("Messages go to the standard error: -q only shows errors, -v and -vv show debugging details.",
+          file=sys.stderr)
+
+
+def split_verbosity_flags(args: List[str]) -> Tuple[int, List[str]]:
+    """
+    Removes the verbosity flags from the command line arguments.
+    :return: The verbosity (-1 for -q, 0 by default, 1 for -v, 2 for -vv) and the remaining arguments
+    """
+    verbosity = 0
+    remaining = []
+    for arg in args:
+        if arg in ("-q", "--quiet"):
+            verbosity = -1
+        elif arg in ("-v", "--verbose"):
+            verbosity += 1
+        elif arg == "-vv":
+            verbosity += 2
+        else:
+            remaining.append(arg)
+    return verbosity, remaining
+
+
+def setup_logging(verbosity: int = 0):
+    """
+    Sends the messages of every despiste logger to the standard error, so that the standard output
+    only holds what the commands produce.
+    """
+    if verbosity < 0:
+        level = logging.ERROR
+    elif verbosity == 0:
+        level = logging.INFO
+    elif verbosity == 1:
+        level = logging.DEBUG
+    else:
+        level = TRACE
+
+    handler = logging.StreamHandler(sys.stderr)
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.handlers[:] = [handler]
+    logger.setLevel(level)
+    logger.propagate = False
 
 
 def read_file_content(input_file) -> bytes:
     try:
-        finput = Path(input_file)
-        return finput.read_bytes()
+        with phase("read"), open(input_file, "rb") as finput:
+            return finput.read()
     except FileNotFoundError:
-        print(f"Error: Could not find the input file {input_file}")
+        logger.error(f"Error: Could not find the input file {input_file}")
         print_help_message()
         raise SystemExit(2)
 
 
+def read_file_lines(input_file) -> Iterator[str]:
+    """
+    Yields the lines of a UTF-8 text file one at a time, without their line endings.
+    """
+    try:
+        finput = open(input_file, encoding="utf-8")
+    except FileNotFoundError:
+        logger.error(f"Error: Could not find the input file {input_file}")
+        print_help_message()
+        raise SystemExit(2)
+
+    with finput:
+        for line in finput:
+            yield line.rstrip("\r\n")
+
+
+def words_to_bytes(words: Sequence[int]) -> bytes:
+    """
+    Serializes 32 bits words as big-endian bytes, which is how the DSP expects its program.
+    """
+    return struct.pack(f">{len(words)}I", *words)
+
+
 def write_file_content(output_file, content):
-    newFile = open(output_file, "wb")
-    newFile.write(bytearray(content))
+    with phase("write"):
+        if output_file == STDOUT:
+            sys.stdout.buffer.write(content)
+            sys.stdout.buffer.flush()
+            return
+
+        with open(output_file, "wb") as newFile:
+            newFile.write(content)
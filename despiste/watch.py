@@ -0,0 +1,182 @@
+"""
+Watch mode: stays resident and recompiles source files into their binaries as soon as they are saved.
+
+Changes are detected by polling the modification time and size of the files, which works everywhere without
+extra dependencies. Each file keeps an IncrementalAssembler between compilations, so a save only pays for the
+lines that changed.
+"""
+import argparse
+import logging
+import os
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+from despiste.incremental import IncrementalAssembler
+from despiste.parallel import FileResult, format_result, output_path
+from despiste.utils import write_file_content
+
+logger = logging.getLogger(__name__)
+
+SOURCE_SUFFIXES = (".dsp", ".asm")
+
+# Modification time and size of a file
+Signature = Tuple[int, int]
+
+
+class Watcher:
+    """
+    Polls a directory for source files, and compiles those that changed.
+    A file is only compiled once its signature has been stable for the debounce delay,
+    so that bursts of saves (or editors writing in several steps) compile only once.
+    """
+
+    def __init__(self, directory: str, recursive: bool = False, debounce: float = 0.2,
+                 report: Callable[[str], None] = logger.info):
+        self.directory = directory
+        self.recursive = recursive
+        self.debounce = debounce
+        self.report = report
+
+        self.assemblers: Dict[str, IncrementalAssembler] = {}
+        self.compiled: Dict[str, Signature] = {}  # Signature of each file when it was last compiled
+        self.pending: Dict[str, Tuple[Signature, float]] = {}  # Changed files, and when they were seen so
+
+    def scan(self) -> Dict[str, Signature]:
+        """
+        Returns the signature of every source file in the directory.
+        """
+        found = {}
+        directories = [self.directory]
+        while directories:
+            try:
+                entries = list(os.scandir(directories.pop()))
+            except FileNotFoundError:
+                continue
+            for entry in entries:
+                if entry.is_dir():
+                    if self.recursive:
+                        directories.append(entry.path)
+                elif entry.name.lower().endswith(SOURCE_SUFFIXES):
+                    try:
+                        stat = entry.stat()
+                    except FileNotFoundError:
+                        continue
+                    found[entry.path] = (stat.st_mtime_ns, stat.st_size)
+        return found
+
+    def start(self) -> List[FileResult]:
+        """
+        Loads every source file, compiling those whose binary is missing or older than the source.
+        """
+        results = []
+        for path, signature in sorted(self.scan().items()):
+            output = output_path(path, "compile")
+            outdated = not os.path.exists(output) or os.stat(output).st_mtime_ns < signature[0]
+            results.append(self.compile(path, signature, write=outdated))
+        return [result for result in results if result is not None]
+
+    def poll(self, now: Optional[float] = None) -> List[FileResult]:
+        """
+        Checks the directory once, compiling the files that changed and are not being written anymore.
+        """
+        if now is None:
+            now = time.monotonic()
+
+        current = self.scan()
+        for path in list(self.compiled):
+            if path not in current:
+                # Deleted or renamed
+                del self.compiled[path]
+                self.assemblers.pop(path, None)
+                self.pending.pop(path, None)
+
+        results = []
+        for path, signature in sorted(current.items()):
+            if self.compiled.get(path) == signature:
+                self.pending.pop(path, None)
+                continue
+
+            seen = self.pending.get(path)
+            if seen is None or seen[0] != signature:
+                self.pending[path] = (signature, now)
+                if self.debounce > 0:
+                    continue
+            elif now - seen[1] < self.debounce:
+                continue
+
+            del self.pending[path]
+            result = self.compile(path, signature)
+            if result is not None:
+                results.append(result)
+        return results
+
+    def compile(self, path: str, signature: Signature, write: bool = True) -> Optional[FileResult]:
+        output = output_path(path, "compile")
+        try:
+            with open(path, encoding="utf-8") as f:
+                lines = f.read().splitlines()
+        except OSError as e:
+            return self._report(FileResult(path, output, False, str(e)))
+
+        self.compiled[path] = signature
+        start = time.perf_counter()
+        assembler = self.assemblers.get(path)
+        if assembler is None:
+            assembler = self.assemblers[path] = IncrementalAssembler(lines)
+        else:
+            assembler.update(lines)
+        elapsed = (time.perf_counter() - start) * 1000
+
+        if assembler.errors:
+            error = assembler.errors[0]
+            message = f"line {error.line_number}: {error.message}"
+            if len(assembler.errors) > 1:
+                message += f" (and {len(assembler.errors) - 1} more errors)"
+            return self._report(FileResult(path, output, False, message))
+
+        if not write:
+            return None
+        try:
+            write_file_content(output, assembler.to_bytes())
+        except OSError as e:
+            return self._report(FileResult(path, output, False, str(e)))
+        return self._report(FileResult(path, output, True, f"{len(assembler.words)} instructions, {elapsed:.1f} ms"))
+
+    def _report(self, result: FileResult) -> FileResult:
+        self.report(format_result(result))
+        return result
+
+    def run(self, interval: float = 0.2):
+        """
+        Polls forever, until interrupted.
+        """
+        self.start()
+        while True:
+            time.sleep(interval)
+            self.poll()
+
+
+def do_watch(args: List[str]):
+    """
+    Entry point for the watch command.
+    """
+    parser = argparse.ArgumentParser(prog="despiste watch",
+                                     description="Recompile .dsp and .asm files into .bin files when they change.")
+    parser.add_argument("directory", help="Directory to watch")
+    parser.add_argument("-r", "--recursive", action="store_true", help="Also watch the subdirectories")
+    parser.add_argument("--interval", type=float, default=0.2, help="Seconds between two checks")
+    parser.add_argument("--debounce", type=float, default=0.2,
+                        help="Seconds a file must stay unchanged before it is compiled")
+    options = parser.parse_args(args)
+
+    if not os.path.isdir(options.directory):
+        logger.error(f"Error: Could not find the directory {options.directory}")
+        raise SystemExit(2)
+
+    watcher = Watcher(options.directory, options.recursive, options.debounce)
+    logger.info(f"Watching {options.directory}, press Ctrl+C to stop.")
+    try:
+        watcher.run(options.interval)
+    except KeyboardInterrupt:
+        pass
+    raise SystemExit(0)
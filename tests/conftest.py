@@ -0,0 +1,35 @@
+import logging
+from typing import Dict, Iterable, Tuple
+
+import pytest
+
+from despiste.program import Program
+from despiste.sim import DSPState, Simulator
+
+# What a program leaves in the DSP, besides where and when it stops
+RESULTS = ("ram", "ct", "rx", "ry", "p", "a", "alu", "z", "s", "c", "lop", "ra0", "wa0", "external")
+
+
+@pytest.fixture(autouse=True)
+def restore_logging():
+    logger = logging.getLogger("despiste")
+    yield
+    logger.handlers.clear()
+    logger.setLevel(logging.NOTSET)
+    logger.propagate = True
+
+
+def registers(st: DSPState, names: Iterable[str] = RESULTS) -> Dict[str, object]:
+    return {name: getattr(st, name) for name in names}
+
+
+def final_state(program: Program, max_cycles: int = 10_000) -> Tuple[int, Dict[str, object]]:
+    """
+    Runs a program with distinct values in every data RAM bank.
+    :return: The number of cycles run, and the registers it leaves
+    """
+    sim = Simulator(program)
+    for bank in range(4):
+        sim.state.ram[bank] = [bank * 64 + index * 7 for index in range(64)]
+    cycles = sim.run(max_cycles)
+    return cycles, registers(sim.state)
@@ -0,0 +1,146 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+from despiste.__main__ import main
+from despiste.analyze import CycleAnalyzer, MAX_LOP, load_program
+from despiste.program import Program
+from despiste.sim import Simulator
+
+RESOURCES = Path(__file__).parent / "resources"
+
+
+def analyze(lines, entry=0):
+    return CycleAnalyzer(Program.from_text(lines)).analyze(entry)
+
+
+def simulated_cycles(lines):
+    return Simulator(Program.from_text(lines)).run()
+
+
+@pytest.mark.parametrize("lines", [
+    [" NOP", " CLR A", " ENDI"],
+    [" MVI 9,LOP", " MOV 4,TOP", " CLR A", " MOV 1,PL", " ADD MOV ALU,A", " BTM", " NOP", " END"],
+    [" MVI 20,LOP", " LPS", " ADD MOV ALU,A", " END"],
+    [" JMP SKIP", " NOP", " NOP", "SKIP:", " DMAH D0,MC0,8", " END"],
+    [" MVI 1,LOP", " MVI FUNC,PC", " NOP", " END", "FUNC:", " NOP", " BTM", " NOP"],
+    # LPS repeating END, or a jump taken after the last time
+    [" MVI 2,LOP", " LPS", " END"],
+    [" MVI 2,LOP", " LPS", " JMP SKIP", " NOP", " END", "SKIP:", " NOP", " END"],
+    # BTM, and a subroutine call, in a delay slot: the next instruction is the target of the first jump
+    [" MVI 2,LOP", " MOV 5,TOP", " JMP NEXT", " BTM", " END", "NEXT:", " NOP", " END"],
+    [" JMP NEXT", " MVI FUNC,PC", " END", "NEXT:", " NOP", " END", "FUNC:", " MVI 1,LOP", " BTM", " NOP"],
+])
+def test_straight_programs_match_the_simulator(lines):
+    report = analyze(lines)
+    assert report.best == report.worst == simulated_cycles(lines)
+
+
+def test_conditional_jumps_give_a_range():
+    lines = [" SUB", " JMP Z,SHORT", " NOP", " NOP", " NOP", "SHORT:", " END"]
+    report = analyze(lines)
+    assert (report.best, report.worst) == (4, 6)
+
+
+def test_lop_loaded_from_data():
+    lines = [" MOV M0,LOP", " LPS", " NOP", " END"]
+    report = analyze(lines)
+    assert report.best == 4
+    assert report.worst == 4 + MAX_LOP
+
+
+def test_btm_to_top_loaded_from_data_is_unknown():
+    lines = [" MOV M0,TOP", " MOV 3,LOP", " CLR A", " BTM", " NOP", " MOV 1,PL"] + [" ADD"] * 4 + [" END"]
+    report = analyze(lines)
+    assert report.worst is None
+    assert report.best <= simulated_cycles(lines)
+    assert "TOP loaded from data" in report.notes[0]
+
+
+def test_btm_returns_from_subroutines_only():
+    lines = [" MVI FUNC,PC", " NOP", " END", "FUNC:", " MOV M0,LOP", " BTM", " NOP", " END"]
+    report = analyze(lines, 3)
+    # Returning after the delay slot, or falling through to END when LOP is 0
+    assert (report.best, report.worst) == (4, 4)
+    report = analyze(lines)
+    assert (report.best, report.worst) == (simulated_cycles(lines), 7)
+
+
+def test_btm_loop_with_lop_loaded_from_data():
+    lines = [" MOV M0,LOP", " MOV 2,TOP"] + [" ADD"] * 160 + [" BTM", " NOP", " END"]
+    report = analyze(lines)
+    assert report.best == simulated_cycles(lines)
+    assert report.worst == 2 + 160 + MAX_LOP * 162 + 3
+
+    lines[0] = " MVI 100,LOP"
+    report = analyze(lines)
+    assert report.best == report.worst == simulated_cycles(lines)
+
+
+def test_data_dependent_loop_is_unbounded():
+    report = CycleAnalyzer(load_program(str(RESOURCES / "udiv.asm"))).analyze(0)
+    assert report.worst is None
+    assert report.best <= Simulator(load_program(str(RESOURCES / "udiv.asm"))).run()
+    assert "depends on data" in report.notes[0]
+
+
+def test_jumps_in_delay_slots_and_under_lps():
+    # Without its loop, the BTM in the delay slot of the call would fall through to END
+    report = analyze(["START:", " NOP", " MVI START,PC", " BTM", " END"])
+    assert report.best is None and report.worst is None
+
+    report = analyze([" MVI 2,LOP", " MOV 3,TOP", " LPS", " BTM", " END"])
+    assert report.worst is None
+    assert "repeats a jump" in report.notes[0]
+
+
+def test_entry_points_and_dmah_stalls():
+    analyzer = CycleAnalyzer(load_program(str(RESOURCES / "udiv.bin")))
+    assert analyzer.entry_points() == [0, 0x17]
+
+    analyzer = CycleAnalyzer(Program.from_text([" DMAH D0,MC0,8", " DMAH D0,MC1,MC0", " END"]))
+    assert analyzer.dmah_stalls() == ["DMAH at 0x00 stalls 8 cycles",
+                                      "DMAH at 0x01 stalls up to 255 cycles (size read from MC0)"]
+
+
+def test_dmah_with_add_mode_and_from_binaries_stall(monkeypatch, capfd, tmp_path):
+    lines = [" DMAH4 D0,MC0,100", " END"]
+    assert CycleAnalyzer(Program.from_text(lines)).dmah_stalls() == ["DMAH at 0x00 stalls 100 cycles"]
+    assert analyze(lines).worst == simulated_cycles(lines) == 102
+
+    binary = tmp_path / "kernel.bin"
+    binary.write_bytes(Program.from_text([" DMAH D0,MC0,100", " END"]).to_bytes())
+    monkeypatch.setattr(sys, "argv", ["despiste", "-q", "analyze", "--cycles", str(binary)])
+    with pytest.raises(SystemExit) as e:
+        main()
+    assert e.value.code == 0
+    out = capfd.readouterr().out
+    assert "best 102 cycles, worst 102 cycles" in out
+    assert "DMAH at 0x00 stalls 100 cycles" in out
+
+
+def test_budget_exit_code(monkeypatch, capfd, tmp_path):
+    source = tmp_path / "kernel.asm"
+    source.write_text(" MVI 9,LOP\n LPS\n NOP\n END\n")
+
+    monkeypatch.setattr(sys, "argv", ["despiste", "-q", "analyze", "--cycles", "--budget", "13", str(source)])
+    with pytest.raises(SystemExit) as e:
+        main()
+    assert e.value.code == 0
+    assert "best 13 cycles, worst 13 cycles" in capfd.readouterr().out
+
+    monkeypatch.setattr(sys, "argv", ["despiste", "-q", "analyze", "--cycles", "--budget", "12", str(source)])
+    with pytest.raises(SystemExit) as e:
+        main()
+    assert e.value.code == 1
+    assert "over the budget" in capfd.readouterr().err
+
+
+def test_too_complex_programs_fail_without_traceback(monkeypatch, capfd):
+    monkeypatch.setattr("despiste.analyze.MAX_STATES", 2)
+    monkeypatch.setattr(sys, "argv", ["despiste", "-q", "analyze", "--cycles", str(RESOURCES / "udiv.asm")])
+    with pytest.raises(SystemExit) as e:
+        main()
+    assert e.value.code == 1
+    assert "Could not analyze entry 0x00" in capfd.readouterr().err
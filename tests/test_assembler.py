@@ -0,0 +1,59 @@
+from pathlib import Path
+
+import pytest
+
+from despiste.assembler import assemble, parse_lines, LineKind
+from despiste.instruction_context import InstructionContext
+from despiste.program import Program
+
+RESOURCES = Path(__file__).parent / "resources"
+
+
+@pytest.mark.parametrize("name", ["udiv.asm", "udiv-clean.asm", "test1.dsp"])
+def test_assemble_matches_program(name):
+    lines = (RESOURCES / name).read_text().splitlines()
+
+    words = assemble(iter(lines))
+
+    assert list(words) == Program.from_text(lines).to_words()
+
+
+def test_parse_lines():
+    lines = ["; comment", "", "K = 3", "START: NOP ; trailing", "END:", "  jmp start"]
+
+    assert list(parse_lines(lines)) == [
+        (3, LineKind.CONSTANT, "K = 3"),
+        (4, LineKind.LABEL, "START:"),
+        (4, LineKind.INSTRUCTION, ["NOP"]),
+        (5, LineKind.LABEL, "END:"),
+        (6, LineKind.INSTRUCTION, ["JMP", "START"]),
+    ]
+
+
+def test_assemble_backpatches_forward_references():
+    lines = [
+        "START:",
+        "MVI VALUE,PL",
+        "MVI LATER,PC,NZ",
+        "JMP START",
+        "JMP Z,LATER:",
+        "NOP",
+        "LATER: END",
+        "VALUE = 1234",
+    ]
+    context = InstructionContext()
+
+    words = assemble(lines, context)
+
+    assert context.labels == {"START": 0, "LATER": 5}
+    assert list(words) == Program.from_text(lines).to_words()
+    p = Program.from_words(words)
+    assert p.instructions[0].to_text() == ["MVI #1234,PL"]
+    assert p.instructions[1].to_text() == ["MVI #5,PC,NZ"]
+    assert p.instructions[2].to_text() == ["JMP #0"]
+    assert p.instructions[3].to_text() == ["JMP Z,#5"]
+
+
+def test_assemble_unknown_label():
+    with pytest.raises(Exception, match="label that does not exist: NOWHERE"):
+        assemble(["JMP NOWHERE", "END"])
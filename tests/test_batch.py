@@ -0,0 +1,102 @@
+import random
+
+import pytest
+
+from despiste.batch import decode_words, decode_bytes, classify_words, is_valid_word, InstructionKind
+from despiste.instruction import Instruction
+
+
+WORDS = [
+    0x00001C00,  # MOV #0,CT0
+    0x05E41D03,  # AND MOV MC2,P MOV ALU,A MOV #3,CT1
+    0x94C00800,  # MVI #12584960,PL
+    0xAA080004,  # MVI #4,LOP,NZ
+    0xC0005104,  # DMAH0 MC1,D0,4
+    0xD3400010,  # JMP T0,#16
+    0xE8000000,  # LPS
+    0xF8000000,  # ENDI
+    0x40000000,  # Unknown
+    0x1C000000,  # Invalid ALU opcode
+]
+
+
+def test_decode_words_python():
+    decoded = decode_words(WORDS, use_numpy=False)
+
+    assert list(decoded.kind) == [
+        InstructionKind.NORMAL, InstructionKind.NORMAL, InstructionKind.MVI, InstructionKind.MVI,
+        InstructionKind.DMA, InstructionKind.JMP, InstructionKind.LOOP, InstructionKind.END,
+        InstructionKind.INVALID, InstructionKind.NORMAL,
+    ]
+    assert list(decoded.valid) == [1, 1, 1, 1, 1, 1, 1, 1, 0, 0]
+    assert decoded["d1_immediate"][1] == 3
+    assert decoded["x_source"][1] == 0b110
+    assert decoded["mvi_immediate"][2] == 12584960
+    assert decoded["mvi_immediate"][3] == 4
+    assert decoded["mvi_conditional"][3] == 1
+    assert decoded["dma_hold"][4] == 1
+    assert decoded["dma_size"][4] == 4
+    assert decoded["jmp_target"][5] == 16
+    assert decoded["loop_single"][6] == 1
+    assert decoded["end_interrupt"][7] == 1
+    # Fields of other kinds are left at 0
+    assert decoded["alu"][2] == 0
+
+    assert decoded.instruction(3).to_text() == ["MVI #4,LOP,NZ"]
+    assert decoded.program(0, 8).to_words() == WORDS[:8]
+
+
+def test_decode_bytes_python():
+    buffer = b"".join(word.to_bytes(4, "big") for word in WORDS)
+    decoded = decode_bytes(buffer, use_numpy=False)
+    assert list(decoded.words) == WORDS
+
+
+def test_decode_words_numpy_matches_python():
+    np = pytest.importorskip("numpy")
+    rng = random.Random(1)
+    words = WORDS + [rng.getrandbits(32) for _ in range(5000)]
+
+    vectorized = decode_words(np.array(words, dtype=np.uint32), use_numpy=True)
+    reference = decode_words(words, use_numpy=False)
+
+    assert set(vectorized.columns) == set(reference.columns)
+    for name in reference.columns:
+        assert vectorized[name].tolist() == list(reference[name]), name
+
+    for idx, word in enumerate(words):
+        try:
+            Instruction.from_word(word)
+            valid = True
+        except Exception:
+            valid = False
+        assert bool(vectorized.valid[idx]) == valid
+
+
+def test_decode_bytes_numpy():
+    pytest.importorskip("numpy")
+    buffer = b"".join(word.to_bytes(4, "big") for word in WORDS)
+    decoded = decode_bytes(buffer, use_numpy=True)
+    assert decoded.words.tolist() == WORDS
+    assert decoded.instruction(7).to_text() == ["ENDI"]
+
+
+def test_is_valid_word_matches_decoder():
+    rng = random.Random(2)
+    for word in WORDS + [rng.getrandbits(32) for _ in range(5000)]:
+        try:
+            Instruction.from_word(word)
+            valid = True
+        except Exception:
+            valid = False
+        assert is_valid_word(word) == valid, hex(word)
+
+
+@pytest.mark.parametrize("use_numpy", [False, True])
+def test_classify_words(use_numpy):
+    if use_numpy:
+        pytest.importorskip("numpy")
+    kind, valid = classify_words(WORDS, use_numpy)
+    decoded = decode_words(WORDS, use_numpy=False)
+    assert list(kind) == list(decoded.kind)
+    assert [bool(v) for v in valid] == [bool(v) for v in decoded.valid]
@@ -0,0 +1,44 @@
+import json
+
+import pytest
+
+from benchmarks.runner import Result, compare, do_compare, results_to_json
+from benchmarks.suite import RESOURCES, assemblable_lines, synthetic_program
+from despiste.commands import AluOpcodes, DMACommand, EndCommand, JumpCommand, LoopCommand, MVICommand
+from despiste.program import Program
+
+
+def test_synthetic_program_uses_every_command_type():
+    program = Program.from_text(synthetic_program())
+    assert len(program.instructions) == 256
+    specials = {type(inst.specialCommand) for inst in program.instructions}
+    assert {DMACommand, EndCommand, JumpCommand, LoopCommand, MVICommand} <= specials
+    assert {inst.aluControlCommand.opcode for inst in program.instructions if inst.specialCommand is None} \
+        == set(AluOpcodes)
+
+
+def test_rejected_lines_are_commented_out():
+    lines = assemblable_lines(RESOURCES / "cmpnm.asm")
+    assert [number for number, line in enumerate(lines, 1) if line.startswith(";\t")] == [502, 510]
+    assert len(Program.from_text(lines).instructions) == 240
+
+
+def test_compare_fails_on_regressions(tmp_path, capsys):
+    baseline = tmp_path / "baseline.json"
+    current = tmp_path / "current.json"
+    baseline.write_text(json.dumps(results_to_json([Result("a", 100, 1.0, 0.001), Result("b", 100, 1.0, 0.001)])))
+    current.write_text(json.dumps(results_to_json([Result("a", 100, 1.05, 0.001), Result("b", 100, 2.0, 0.002),
+                                                   Result("c", 100, 1.0, 0.001)])))
+
+    comparisons = compare({"a": 100.0, "b": 100.0}, {"a": 80.0, "c": 1.0})
+    assert [comparison.name for comparison in comparisons] == ["a", "b", "c"]
+    assert comparisons[0].change == pytest.approx(-0.2)
+    assert comparisons[1].change is comparisons[2].change is None
+
+    with pytest.raises(SystemExit) as e:
+        do_compare([str(baseline), str(current)])
+    assert e.value.code == 0
+    with pytest.raises(SystemExit) as e:
+        do_compare([str(baseline), str(current), "--threshold", "0.01"])
+    assert e.value.code == 1
+    assert "only in the results" in capsys.readouterr().out
@@ -0,0 +1,55 @@
+import logging
+import sys
+from pathlib import Path
+
+import pytest
+
+from despiste.__main__ import main
+from despiste.utils import split_verbosity_flags, TRACE
+
+RESOURCES = Path(__file__).parent / "resources"
+
+
+def run_main(monkeypatch, *args) -> int:
+    monkeypatch.setattr(sys, "argv", ["despiste", *args])
+    with pytest.raises(SystemExit) as e:
+        main()
+    return e.value.code
+
+
+def test_split_verbosity_flags():
+    assert split_verbosity_flags(["despiste", "-q", "compile", "a"]) == (-1, ["despiste", "compile", "a"])
+    assert split_verbosity_flags(["despiste", "compile", "-vv", "a"]) == (2, ["despiste", "compile", "a"])
+    assert split_verbosity_flags(["despiste", "-v", "compile"]) == (1, ["despiste", "compile"])
+
+
+def test_compile_to_stdout_only_writes_the_binary(monkeypatch, capfdbinary):
+    assert run_main(monkeypatch, "compile", str(RESOURCES / "udiv.asm"), "-") == 0
+
+    out, err = capfdbinary.readouterr()
+    assert out == (RESOURCES / "udiv.bin").read_bytes()
+    assert b"DeSPiste" in err
+
+
+def test_decompile_to_stdout_is_valid_source(monkeypatch, capfd):
+    assert run_main(monkeypatch, "-q", "decompile", str(RESOURCES / "udiv.bin"), "-") == 0
+
+    out, err = capfd.readouterr()
+    assert err == ""
+    assert out.splitlines()[1].startswith(";ALU")
+    assert "END" in out
+
+
+def test_trace_messages(monkeypatch, capfd):
+    assert run_main(monkeypatch, "-vv", "compile", str(RESOURCES / "test1.dsp"), "-") == 0
+
+    _, err = capfd.readouterr()
+    assert "generate_command data" in err
+    assert logging.getLogger("despiste").isEnabledFor(TRACE)
+
+
+def test_compile_with_pack(monkeypatch, capfdbinary):
+    assert run_main(monkeypatch, "-q", "compile", "--pack", str(RESOURCES / "udiv.asm"), "-") == 0
+
+    out, _ = capfdbinary.readouterr()
+    assert 0 < len(out) < len((RESOURCES / "udiv.bin").read_bytes())
@@ -109,9 +109,7 @@ def test_y_text(text, opcode, source):
 
 
 def test_y_special_to_text():
-    cmd = YBusControlCommand()
-    cmd.opcode = YBusOpcodes.MOV_SRC_Y_ALU_A
-    cmd.source = XYBusDataSource.M1
+    cmd = YBusControlCommand(YBusOpcodes.MOV_SRC_Y_ALU_A, XYBusDataSource.M1)
     output = cmd.to_text()
     assert len(output) == 2
     assert "MOV ALU,A" in output
@@ -157,10 +155,67 @@ def test_x_text(text, opcode, source):
 
 
 def test_x_special_to_text():
-    cmd = XBusControlCommand()
-    cmd.opcode = XBusOpcodes.MOV_SRC_X_MUL_P
-    cmd.source = XYBusDataSource.M1
+    cmd = XBusControlCommand(XBusOpcodes.MOV_SRC_X_MUL_P, XYBusDataSource.M1)
     output = cmd.to_text()
     assert len(output) == 2
     assert "MOV MUL,P" in output
     assert "MOV M1,X" in output
+
+
+# Integer codec
+
+
+@pytest.mark.parametrize(
+    "ctype,bits",
+    [
+        (AluControlCommand, "1011"),
+        (D1BusControlCommand, "00000000000000"),
+        (D1BusControlCommand, "01" + "1101" + "00000011"),
+        (D1BusControlCommand, "11" + "0100" + "00000010"),
+        (YBusControlCommand, "110" + "001"),
+        (YBusControlCommand, "001" + "000"),
+        (XBusControlCommand, "011" + "110"),
+        (XBusControlCommand, "010" + "000"),
+    ]
+)
+def test_word_matches_binary(ctype, bits):
+    from_word = ctype.from_word(int(bits, 2))
+    from_bits = ctype.from_binary(bits)
+    assert from_word.to_text() == from_bits.to_text()
+    assert from_word.to_word() == int(bits, 2)
+
+
+# Interned bus commands
+
+
+def test_bus_commands_are_interned():
+    assert AluControlCommand.from_binary("0001") is AluControlCommand.from_text(["AND"])
+    assert YBusControlCommand(YBusOpcodes.MOV_SRC_Y, XYBusDataSource.M1) is \
+        YBusControlCommand.from_text(["MOV", "M1", "Y"])
+    assert D1BusControlCommand.from_text(["MOV", "#3", "CT1"]) is \
+        D1BusControlCommand.from_binary("01" + "1101" + "00000011")
+
+    for value in range(1 << 4):
+        try:
+            AluControlCommand.from_word(value)
+        except ValueError:
+            pass
+    assert len(AluControlCommand._interned) == len(AluOpcodes)
+
+
+def test_bus_commands_are_immutable():
+    cmd = XBusControlCommand(XBusOpcodes.MOV_SRC_X, XYBusDataSource.M2)
+    with pytest.raises(AttributeError):
+        cmd.source = XYBusDataSource.M3
+    with pytest.raises(AttributeError):
+        cmd.extra = 1
+    assert not hasattr(cmd, "__dict__")
+    assert cmd.source == XYBusDataSource.M2
+
+
+def test_bus_commands_pickle_to_the_same_object():
+    import copy
+    import pickle
+    cmd = D1BusControlCommand(D1BusOpcodes.MOV_SRC_DST, D1BusDataDestination.RX, D1BusDataSource.MC0)
+    assert pickle.loads(pickle.dumps(cmd)) is cmd
+    assert copy.deepcopy(cmd) is cmd
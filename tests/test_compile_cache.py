@@ -0,0 +1,104 @@
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+from despiste.__main__ import main
+from despiste import compile_cache
+from despiste.compile import compile_file
+from despiste.compile_cache import CompileCache, normalize_source, split_cache_flags
+from despiste.parallel import run_many
+
+RESOURCES = Path(__file__).parent / "resources"
+
+
+def test_key_ignores_line_endings_and_trailing_spaces():
+    lines = normalize_source(b"\tMOV 1,CT0\n\tEND\n")
+    assert normalize_source(b"\tMOV 1,CT0  \r\n\tEND\r\n") != lines
+    assert CompileCache.key(normalize_source(b"\tMOV 1,CT0  \r\n\tEND\r\n")) == CompileCache.key(lines)
+    assert CompileCache.key(normalize_source(b"\tMOV 2,CT0\n\tEND\n")) != CompileCache.key(lines)
+    assert CompileCache.key(lines, ["pack"]) != CompileCache.key(lines)
+
+
+def test_cached_binary_is_the_assembled_one(tmp_path):
+    cache = CompileCache(str(tmp_path / "cache"))
+    first = tmp_path / "first.bin"
+    second = tmp_path / "second.bin"
+
+    words = compile_file(str(RESOURCES / "udiv.asm"), str(first), cache=cache)
+    assert (cache.hits, cache.misses) == (0, 1)
+    assert compile_file(str(RESOURCES / "udiv.asm"), str(second), cache=cache) == words
+    assert (cache.hits, cache.misses) == (1, 1)
+    assert first.read_bytes() == second.read_bytes() == (RESOURCES / "udiv.bin").read_bytes()
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    # 256 bytes per subdirectory
+    cache = CompileCache(str(tmp_path), 256 * 256)
+    keys = ["ab" + str(i) * 62 for i in range(3)]
+    cache.put(keys[0], bytes(100))
+    cache.put(keys[1], bytes(100))
+    assert cache.get(keys[0]) is not None
+    # The second entry is the least recently used, whatever the resolution of the file times
+    os.utime(tmp_path / "ab" / keys[1][2:], ns=(0, 0))
+
+    cache.put(keys[2], bytes(100))
+    assert cache.evictions == 1
+    assert cache.get(keys[1]) is None
+    assert cache.get(keys[0]) is not None and cache.get(keys[2]) is not None
+    assert cache.entries() == (2, 200)
+
+
+def test_statistics_of_parallel_builds(tmp_path):
+    inputs = []
+    for index in range(12):
+        source = tmp_path / f"kernel{index}.asm"
+        source.write_text(f" MOV {index},CT0\n END\n")
+        inputs.append(str(source))
+    cache_dir = str(tmp_path / "cache")
+
+    for _ in range(2):
+        results = run_many("compile", inputs, 4, str(tmp_path / "out"), report=lambda line: None, cache_dir=cache_dir)
+        assert all(result.ok for result in results)
+    assert CompileCache(cache_dir).load_stats() == {"hits": 12, "misses": 12, "evictions": 0}
+
+
+def test_key_changes_with_the_assembler(monkeypatch):
+    lines = normalize_source(b"\tEND\n")
+    key = CompileCache.key(lines)
+    assert os.path.basename(compile_cache.__file__) in compile_cache.implementation()
+
+    monkeypatch.setattr(compile_cache, "_implementation", "despiste 0.1.0 compile.py:1:2")
+    assert CompileCache.key(lines) != key
+
+
+def test_split_cache_flags():
+    assert split_cache_flags(["despiste", "compile", "--cache-dir=c", "--cache-size=2", "a"]) \
+        == ("c", 2 * 1024 * 1024, ["despiste", "compile", "a"])
+    assert split_cache_flags(["despiste", "compile", "--cache-dir", "c", "--cache-size", "2", "a"]) \
+        == ("c", 2 * 1024 * 1024, ["despiste", "compile", "a"])
+    with pytest.raises(Exception, match="expects a value"):
+        split_cache_flags(["despiste", "compile", "a", "--cache-dir"])
+    with pytest.raises(Exception, match="number of MB"):
+        split_cache_flags(["despiste", "compile", "--cache-size=big", "a"])
+
+
+def test_cache_statistics_from_the_command_line(monkeypatch, capsys, tmp_path):
+    cache_dir = tmp_path / "cache"
+    for _ in range(3):
+        monkeypatch.setattr(sys, "argv", ["despiste", "compile", "--cache-dir", str(cache_dir),
+                                          str(RESOURCES / "udiv.asm"), str(tmp_path / "udiv.bin")])
+        with pytest.raises(SystemExit) as e:
+            main()
+        assert e.value.code == 0
+    assert (tmp_path / "udiv.bin").read_bytes() == (RESOURCES / "udiv.bin").read_bytes()
+    capsys.readouterr()
+
+    monkeypatch.setattr(sys, "argv", ["despiste", "cache", "--cache-dir", str(cache_dir)])
+    with pytest.raises(SystemExit) as e:
+        main()
+    assert e.value.code == 0
+    out = capsys.readouterr().out
+    assert "Entries: 1," in out
+    assert "Hits: 2, misses: 1" in out
@@ -0,0 +1,77 @@
+import copy
+import pickle
+
+import pytest
+
+from despiste.commands import JumpCommand
+
+from despiste.decode_cache import DecodeCache
+from despiste.program import Program
+
+
+def test_decode_cache_hits_and_misses():
+    cache = DecodeCache()
+    words = [0x00000000, 0x00001C00, 0x00000000, 0x00000000, 0xF8000000, 0x00001C00]
+
+    p = Program.from_words(words, cache)
+
+    assert cache.misses == 3
+    assert cache.hits == 3
+    assert len(cache) == 3
+    assert p.instructions[0] is p.instructions[2]
+    assert p.to_words() == words
+
+
+def test_decode_cache_eviction():
+    cache = DecodeCache(maxsize=2)
+    cache.decode(0x00000000)
+    cache.decode(0x00001C00)
+    cache.decode(0x00000000)
+    # Least recently used is 0x00001C00
+    cache.decode(0xF8000000)
+
+    assert 0x00000000 in cache
+    assert 0x00001C00 not in cache
+    assert len(cache) == 2
+
+    cache.maxsize = 1
+    assert len(cache) == 1
+    assert 0xF8000000 in cache
+
+
+def test_decode_cache_instructions_are_frozen():
+    cache = DecodeCache()
+    inst = cache.decode(0xD00000C8)
+
+    with pytest.raises(AttributeError):
+        inst.specialCommand = None
+
+    copy = inst.copy()
+    copy.specialCommand.immediate = 3
+    assert copy.to_text() == ["JMP #3"]
+    assert cache.decode(0xD00000C8).to_text() == ["JMP #200"]
+
+
+def test_decode_cache_special_commands_are_frozen():
+    cache = DecodeCache()
+    p = Program.from_words([0xD00000C8], cache)
+
+    with pytest.raises(AttributeError):
+        p.instructions[0].specialCommand.immediate = 3
+    assert isinstance(p.instructions[0].specialCommand, JumpCommand)
+    assert Program.from_words([0xD00000C8], cache).instructions[0].to_text() == ["JMP #200"]
+
+    changed = copy.copy(p.instructions[0].specialCommand)
+    changed.immediate = 3
+    assert changed.to_text() == ["JMP #3"]
+    assert pickle.loads(pickle.dumps(p.instructions[0].specialCommand)).to_word() == 0xD00000C8
+    assert cache.decode(0xD00000C8).to_text() == ["JMP #200"]
+
+
+def test_decode_cache_clear():
+    cache = DecodeCache()
+    cache.decode(0)
+    cache.clear()
+    assert len(cache) == 0
+    assert cache.hits == 0
+    assert cache.misses == 0
@@ -0,0 +1,85 @@
+import random
+
+import pytest
+
+from despiste.dma import overlap_dma
+from despiste.program import Program
+from despiste.sim import Simulator
+
+EXTERNAL = {16 + index: index * 3 for index in range(64)}
+
+
+def overlap(lines):
+    return [" ".join(inst.to_text()) for inst in overlap_dma(Program.from_text(lines)).instructions]
+
+
+def run(program: Program):
+    sim = Simulator(program, dict(EXTERNAL))
+    cycles = sim.run(10_000)
+    st = sim.state
+    return cycles, (st.ram, st.ct, st.rx, st.ry, st.p, st.a, st.alu, st.z, st.lop, st.ra0, st.wa0, st.external)
+
+
+def test_wait_before_the_first_use():
+    lines = [" MOV 16,RA0", " DMAH D0,MC2,8", " MOV 1,MC0", " MOV 2,MC0", " MOV 3,MC0", " MOV 4,MC1", " MOV 5,MC1",
+             " MOV M2,X", " END"]
+    assert overlap(lines) == [
+        "NOP NOP NOP MOV #16,RA0",
+        "DMA1 D0,MC2,8",
+        "NOP NOP NOP MOV #1,MC0",
+        "NOP NOP NOP MOV #2,MC0",
+        "NOP NOP NOP MOV #3,MC0",
+        "NOP NOP NOP MOV #4,MC1",
+        "NOP NOP NOP MOV #5,MC1",
+        "JMP T0,#7",
+        "NOP NOP NOP NOP",
+        "NOP MOV M2,X NOP NOP",
+        "END",
+    ]
+    cycles, state = run(Program.from_text(lines))
+    overlapped_cycles, overlapped_state = run(overlap_dma(Program.from_text(lines)))
+    assert overlapped_state == state
+    assert (cycles, overlapped_cycles) == (17, 15)
+
+
+@pytest.mark.parametrize("lines", [
+    # Nothing to run during the transfer
+    [" DMAH D0,MC2,8", " MOV M2,X", " END"],
+    # Too short to be worth a wait
+    [" DMAH D0,MC2,1", " NOP", " NOP", " NOP", " MOV M2,X", " END"],
+    # The program RAM is replaced
+    [" DMAH D0,PRG,8", " NOP", " NOP", " NOP", " NOP", " END"],
+    # WA0 is used by the transfer
+    [" DMAH MC2,D0,8", " MOV 1,MC0", " MOV 2,MC0", " MOV 3,MC0", " MOV 0,WA0", " END"],
+])
+def test_transfers_left_unchanged(lines):
+    assert overlap(lines) == [" ".join(inst.to_text()) for inst in Program.from_text(lines).instructions]
+
+
+def test_wait_before_labels_and_relocated_jumps():
+    lines = [" DMAH MC2,D0,MC0", " MOV 1,MC0", " MOV 2,MC0", " MOV 3,MC0", " MOV 4,MC0", "NEXT:", " JMP NEXT",
+             " END"]
+    texts = overlap(lines)
+    assert texts[5:8] == ["JMP T0,#5", "NOP NOP NOP NOP", "JMP #7"]
+    program = overlap_dma(Program.from_text(lines))
+    assert program.context.labels == {"NEXT": 7}
+
+
+def test_random_programs_compute_the_same():
+    rng = random.Random(0)
+    choices = [" NOP", " CLR A", " ADD", " MOV 1,PL", " MOV M0,A", " MOV MC1,X", " MOV MC2,Y", " MOV 5,MC2",
+               " MOV 1,CT2", " MOV 0,RA0", " MOV 0,WA0", " MVI 2,MC1", " MOV MC3,A", " DMAH D0,MC1,4",
+               " DMAH MC2,D0,MC0", " DMAH2 D0,MC3,12", " JMP NZ,SKIP"]
+    overlapped = 0
+    for _ in range(300):
+        lines = [" MOV 16,RA0", " MOV 40,WA0"] + [rng.choice(choices) for _ in range(12)] + [" NOP", "SKIP:", " END"]
+        program = Program.from_text(lines)
+        result = overlap_dma(program)
+        overlapped += len(result.instructions) != len(program.instructions)
+        cycles, state = run(program)
+        overlapped_cycles, overlapped_state = run(result)
+        assert overlapped_state == state, lines
+        if " DMAH MC2,D0,MC0" not in lines:
+            # Sizes read from a DATA RAM are assumed to be the largest one
+            assert overlapped_cycles <= cycles, lines
+    assert overlapped > 30
@@ -0,0 +1,73 @@
+from pathlib import Path
+
+import pytest
+
+from despiste.assembler import assemble
+from despiste.incremental import IncrementalAssembler
+
+RESOURCES = Path(__file__).parent / "resources"
+
+
+def source(name):
+    return (RESOURCES / name).read_text().splitlines()
+
+
+@pytest.mark.parametrize("name", ["udiv.asm", "udiv-clean.asm", "test1.dsp", "loop_primitive.asm"])
+def test_incremental_matches_assemble(name):
+    lines = source(name)
+    asm = IncrementalAssembler(lines)
+    assert asm.errors == []
+    assert asm.words == assemble(lines)
+
+
+def test_update_only_encodes_changed_lines():
+    lines = source("udiv.asm")
+    asm = IncrementalAssembler(lines)
+
+    idx = next(i for i, line in enumerate(lines) if line.strip().upper().startswith("CLR A"))
+    lines[idx] = "    NOP"
+    asm.update(lines)
+
+    assert asm.encoded == 1
+    assert asm.words == assemble(lines)
+
+
+def test_moved_labels_patch_their_users():
+    lines = ["START:", " JMP LOOP", " NOP", "LOOP:", " MVI START,PC", " END"]
+    asm = IncrementalAssembler(lines)
+    assert asm.context.labels == {"START": 0, "LOOP": 2}
+
+    asm.edit(2, 2, [" NOP", " NOP"])
+
+    assert asm.encoded == 2
+    # Only the jump to LOOP moved
+    assert asm.patched == 3
+    assert asm.context.labels["LOOP"] == 4
+    assert asm.words == assemble(asm.text_lines)
+    assert asm.label_lines == {"START": 1, "LOOP": 6}
+
+
+def test_constants_patch_their_users():
+    lines = ["SIZE = 4", " MVI SIZE,PL", " END"]
+    asm = IncrementalAssembler(lines)
+
+    asm.edit(0, 1, ["SIZE = 7"])
+
+    assert asm.encoded == 0
+    assert asm.patched == 1
+    assert asm.words == assemble(["SIZE = 7", " MVI SIZE,PL", " END"])
+
+
+def test_errors_are_collected_per_line():
+    lines = [" NOP", " JMP NOWHERE", " MOV M0,Y CLR A", " END"]
+    asm = IncrementalAssembler(lines)
+
+    assert [error.line_number for error in asm.errors] == [2, 3]
+    assert "NOWHERE" in asm.errors[0].message
+    assert len(asm.words) == 4
+    with pytest.raises(Exception):
+        asm.to_bytes()
+
+    # Declaring the label fixes the jump
+    asm.edit(3, 3, ["NOWHERE:"])
+    assert [error.line_number for error in asm.errors] == [3]
@@ -67,3 +67,46 @@ def test_instruction_special_command_binary():
     assert instruction.specialCommand
     assert instruction.to_binary() == bits
     assert instruction.to_text() == ["DMAH0 MC1,D0,4"]
+
+
+@pytest.mark.parametrize(
+    "word",
+    [0x00000000, 0x05E41D03, 0x00021D00, 0x94C00800, 0xC0005104, 0xF8000000, 0xD3400010]
+)
+def test_instruction_word(word):
+    instruction = Instruction.from_word(word)
+    assert instruction.to_word() == word
+    assert instruction.to_binary() == format(word, "032b")
+
+
+def test_instruction_word_unknown_kind():
+    with pytest.raises(Exception):
+        Instruction.from_word(0x40000000)
+
+
+def test_instruction_word_invalid_field():
+    # 0111 is not a valid ALU opcode
+    with pytest.raises(ValueError):
+        Instruction.from_word(0b0111 << 26)
+
+
+def test_instruction_word_every_normal_field():
+    for alu in ["0000", "0100", "1111"]:
+        for x in ["000000", "011110", "110001"]:
+            for y in ["000000", "001000", "110001", "011011"]:
+                for d1 in ["00000000000000", "01110100000011", "11010000001010"]:
+                    bits = f"00{alu}{x}{y}{d1}"
+                    instruction = Instruction.from_word(int(bits, 2))
+                    assert instruction.to_binary() == bits
+                    assert Instruction.from_binary(bits).to_text() == instruction.to_text()
+
+
+def test_instruction_has_no_dict():
+    inst = Instruction.from_word(0x05E41D03)
+    assert not hasattr(inst, "__dict__")
+    assert not hasattr(inst.specialCommand, "__dict__") and inst.specialCommand is None
+
+    special = Instruction.from_word(0xC0005104).specialCommand
+    assert not hasattr(special, "__dict__")
+    special.data_size = 5
+    assert special.to_word() == 0xC0005105
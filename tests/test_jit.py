@@ -0,0 +1,72 @@
+from pathlib import Path
+
+import pytest
+
+from despiste.jit import CompiledSimulator, compile_program
+from despiste.program import Program
+from despiste.sim import DSPState, Simulator
+from tests.conftest import registers
+
+RESOURCES = Path(__file__).parent / "resources"
+
+# The whole state, the compiled program stops where and when the step functions do
+STATE = [name for name in DSPState.__slots__ if name not in ("steps", "program")]
+
+PROGRAMS = {
+    "udiv": (RESOURCES / "udiv.asm").read_text().splitlines(),
+    "btm": [" MVI 99,LOP", " MOV 4,TOP", " CLR A", " MOV 1,PL", " ADD MOV ALU,A", " BTM", " NOP", " END"],
+    "lps": [" MVI 30,LOP", " CLR A MOV 3,PL", " LPS", " ADD MOV ALU,A", " ENDI"],
+    "dma": [" MOV 16,RA0", " DMA D0,MC2,4", "LOOP:", " JMP T0,LOOP", " MVI 1,MC0", " DMAH MC2,D0,2", " END"],
+    # The delay slot of the first jump is a jump: run by the step functions
+    "nested_jumps": [" JMP A", " JMP B", "A:", " MVI 1,MC0", " END", "B:", " MVI 2,MC0", " END"],
+    # BTM returns in the middle of a block
+    "btm_inside_block": [" MVI 2,LOP", " MOV 3,TOP", " NOP", " MVI 1,MC0", " BTM", " NOP", " END"],
+}
+
+
+@pytest.mark.parametrize("name", sorted(PROGRAMS))
+def test_compiled_matches_step_functions(name):
+    program = Program.from_text(PROGRAMS[name])
+    external = {16: 1, 17: 2, 18: 3, 19: 4}
+    expected = Simulator(program, dict(external))
+    compiled = CompiledSimulator(program, dict(external))
+
+    assert compiled.run() == expected.run()
+    assert not compiled.state.running
+    assert registers(compiled.state, STATE) == registers(expected.state, STATE)
+
+
+def test_udiv_result():
+    sim = CompiledSimulator(Program.from_text(PROGRAMS["udiv"]))
+    sim.run()
+    assert sim.state.ram[1][1] == 649 // 49
+
+    # Running again after a reset uses the cached function
+    sim.reset()
+    sim.run()
+    assert sim.state.ram[1][1] == 649 // 49
+
+
+def test_compiled_programs_are_cached():
+    words = Program.from_text(PROGRAMS["btm"]).to_words()
+    assert compile_program(words) is compile_program(list(words))
+    assert compile_program(words) is not compile_program(words[:-1])
+
+
+def test_max_cycles_stops_loops():
+    sim = CompiledSimulator(Program.from_text([" MVI 4000,LOP", " MOV 2,TOP", " BTM", " NOP", " END"]))
+    cycles = sim.run(100)
+    assert 100 <= cycles < 110
+    assert sim.state.running
+
+    sim.run()
+    assert not sim.state.running
+    assert sim.state.lop == 0
+
+
+def test_program_loaded_by_dma():
+    # The loaded program replaces the running one, which continues with its second instruction
+    loaded = Program.from_text([" NOP", " MVI 5,MC0", " END"]).to_words()
+    sim = CompiledSimulator(Program.from_text([" DMAH D0,PRG,3", " NOP", " END"]), dict(enumerate(loaded)))
+    sim.run()
+    assert sim.state.ram[0][0] == 5
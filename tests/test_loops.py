@@ -0,0 +1,86 @@
+import random
+
+import pytest
+
+from despiste.loops import convert_counted_loops
+from despiste.program import Program
+from tests.conftest import final_state
+
+TAIL = [" MOV 3,CT0", " MOV M0,A MOV 1,PL", " SUB", " MOV ALL,MC0", " JMP NZ,LOOP"]
+
+
+def convert(lines):
+    return [" ".join(inst.to_text()) for inst in convert_counted_loops(Program.from_text(lines)).instructions]
+
+
+def test_loop_becomes_btm():
+    lines = [" MOV 3,CT0", " MOV 10,MC0", "LOOP:", " CLR A MOV 2,PL", " ADD MOV ALL,MC1"] + TAIL + [" NOP", " END"]
+    assert convert(lines) == [
+        "NOP NOP NOP MOV #3,CT0",
+        # The counter value of the last iteration
+        "NOP NOP NOP MOV #1,MC0",
+        "MVI #9,LOP",
+        "NOP NOP NOP MOV #4,TOP",
+        "NOP NOP CLR A MOV #2,PL",
+        "ADD NOP NOP MOV ALL,MC1",
+        "BTM",
+        "NOP NOP NOP NOP",
+        # The tail runs once
+        "NOP NOP NOP MOV #3,CT0",
+        "NOP NOP MOV M0,A MOV #1,PL",
+        "SUB NOP NOP NOP",
+        "NOP NOP NOP MOV ALL,MC0",
+        "END",
+    ]
+    cycles, state = final_state(Program.from_text(lines), 20_000)
+    converted_cycles, converted_state = final_state(convert_counted_loops(Program.from_text(lines)), 20_000)
+    assert converted_state == state
+    assert (cycles, converted_cycles) == (83, 49)
+
+
+def test_single_instruction_loop_becomes_lps():
+    lines = [" MOV 3,CT0", " MVI 20,MC0", "LOOP:", " MOV MC1,X"] + TAIL + [" NOP", " END"]
+    texts = convert(lines)
+    assert texts[2:5] == ["MVI #19,LOP", "LPS", "NOP MOV MC1,X NOP NOP"]
+    assert final_state(Program.from_text(texts), 20_000)[1] == final_state(Program.from_text(lines), 20_000)[1]
+
+
+@pytest.mark.parametrize("lines", [
+    # The body reads A, loaded by the tail of the previous iteration
+    [" MOV 3,CT0", " MOV 10,MC0", "LOOP:", " ADD", " MOV ALU,A"] + TAIL + [" NOP", " END"],
+    # The initial counter is unknown
+    [" MOV 3,CT0", "LOOP:", " MOV MC1,X", " MOV 1,RX"] + TAIL + [" NOP", " END"],
+    # The body uses the counter bank
+    [" MOV 3,CT0", " MOV 10,MC0", "LOOP:", " MOV MC0,X", " MOV 1,RX"] + TAIL + [" NOP", " END"],
+    # LOP is read after the loop, returning from a subroutine
+    [" MOV 3,CT0", " MOV 10,MC0", "LOOP:", " MOV MC1,X", " MOV 1,RX"] + TAIL + [" NOP", " BTM", " NOP"],
+])
+def test_loops_left_unchanged(lines):
+    assert convert(lines) == [" ".join(inst.to_text()) for inst in Program.from_text(lines).instructions]
+
+
+def test_random_loops_compute_the_same():
+    rng = random.Random(0)
+    body_choices = [" NOP", " CLR A", " ADD", " MOV 2,PL", " MOV ALU,A", " MOV MC1,X", " MOV MC2,Y", " MOV MUL,P",
+                    " MOV ALL,MC2", " MOV 1,CT1", " MOV M0,A", " SUB", " CLR A MOV 1,PL"]
+    tails = [
+        [" MOV {k},CT{b}", " MOV M{b},A MOV 1,PL", " SUB", " MOV ALL,MC{b}"],
+        [" MOV {k},CT{b}", " MOV M{b},A MOV 2,PL", " SUB MOV ALL,MC{b}"],
+        [" MOV {k},CT{b}", " MOV M{b},P CLR A", " MOV 1,PL AD2"],
+    ]
+    converted = 0
+    for _ in range(300):
+        bank, address, count = rng.randrange(4), rng.randrange(64), rng.randrange(1, 30)
+        lines = [f" MOV {address},CT{bank}", rng.choice([f" MOV {count},MC{bank}", f" MVI {count},MC{bank}"]),
+                 "LOOP:"]
+        lines += [rng.choice(body_choices) for _ in range(rng.randrange(1, 4))]
+        lines += [line.format(k=address, b=bank) for line in rng.choice(tails)]
+        lines += [" JMP NZ,LOOP", rng.choice([" NOP", " MOV 1,RX"]), rng.choice(body_choices), " END"]
+        program = Program.from_text(lines)
+        cycles, state = final_state(program, 20_000)
+        if cycles >= 20_000:
+            continue
+        result = convert_counted_loops(program)
+        converted += len(result.instructions) != len(program.instructions)
+        assert final_state(result, 20_000)[1] == state, lines
+    assert converted > 30
@@ -0,0 +1,100 @@
+import io
+import re
+import time
+from pathlib import Path
+
+from despiste.assembler import assemble
+from despiste.lsp import LanguageServer, read_message, write_message
+
+RESOURCES = Path(__file__).parent / "resources"
+URI = "file:///udiv.asm"
+
+
+def open_document(server, text):
+    return server.handle({"jsonrpc": "2.0", "method": "textDocument/didOpen",
+                          "params": {"textDocument": {"uri": URI, "languageId": "dsp", "version": 1, "text": text}}})
+
+
+def change(server, start, end, text):
+    return server.handle({"jsonrpc": "2.0", "method": "textDocument/didChange", "params": {
+        "textDocument": {"uri": URI, "version": 2},
+        "contentChanges": [{"range": {"start": {"line": start[0], "character": start[1]},
+                                      "end": {"line": end[0], "character": end[1]}}, "text": text}],
+    }})
+
+
+def request(server, method, line, character):
+    replies = server.handle({"jsonrpc": "2.0", "id": 7, "method": method, "params": {
+        "textDocument": {"uri": URI}, "position": {"line": line, "character": character}}})
+    assert replies[0]["id"] == 7
+    return replies[0]["result"]
+
+
+def test_initialize():
+    server = LanguageServer()
+    reply = server.handle({"jsonrpc": "2.0", "id": 1, "method": "initialize", "params": {}})
+    assert reply[0]["result"]["capabilities"]["hoverProvider"]
+
+    unknown = server.handle({"jsonrpc": "2.0", "id": 2, "method": "workspace/symbol", "params": {}})
+    assert unknown[0]["error"]["code"] == -32601
+
+
+def test_diagnostics_follow_edits():
+    server = LanguageServer()
+    published = open_document(server, " NOP\n JMP LATER\n END\n")
+    assert [d["range"]["start"]["line"] for d in published[0]["params"]["diagnostics"]] == [1]
+
+    published = change(server, (2, 0), (2, 0), "LATER:\n")
+
+    assert published[0]["params"]["diagnostics"] == []
+    # Only the line holding the end of the edit is encoded again
+    assert server.documents[URI].encoded == 1
+    assert server.documents[URI].text_lines == [" NOP", " JMP LATER", "LATER:", " END", ""]
+
+
+def test_hover_and_definition():
+    server = LanguageServer()
+    text = (RESOURCES / "udiv.asm").read_text()
+    open_document(server, text)
+    lines = text.splitlines()
+    words = assemble(lines)
+
+    jump = next(i for i, line in enumerate(lines) if line.strip().upper().startswith("JMP"))
+    hover = request(server, "textDocument/hover", jump, 2)
+    index = server.documents[URI].lines[jump].index
+    assert f"{words[index]:#010x}" in hover["contents"]["value"]
+
+    label = re.split(r"[\s,]+", lines[jump].strip())[-1]
+    target = request(server, "textDocument/definition", jump, lines[jump].rindex(label) + 1)
+    assert lines[target["range"]["start"]["line"]].strip().upper().startswith(label.upper() + ":")
+
+    normal = next(i for i, line in enumerate(lines) if line.strip().upper().startswith("CLR A"))
+    assert "- Y-bus: `CLR A`" in request(server, "textDocument/hover", normal, 0)["contents"]["value"]
+
+
+def test_edit_latency_on_full_program():
+    server = LanguageServer()
+    body = [" MOV MC0,X MOV M1,Y MOV #5,CT2", " ADD MOV ALU,A MOV ALL,MC2"] * 127 + ["LOOP:", " JMP LOOP", " END"]
+    open_document(server, "\n".join(body))
+    assert len(server.documents[URI].words) == 256
+
+    start = time.perf_counter()
+    change(server, (100, 0), (100, 5), " SUB")
+    assert time.perf_counter() - start < 0.05
+
+
+def test_serve_stream():
+    stdin = io.BytesIO()
+    write_message(stdin, {"jsonrpc": "2.0", "id": 1, "method": "initialize", "params": {}})
+    write_message(stdin, {"jsonrpc": "2.0", "id": 2, "method": "shutdown"})
+    write_message(stdin, {"jsonrpc": "2.0", "method": "exit"})
+    stdin.seek(0)
+    stdout = io.BytesIO()
+
+    server = LanguageServer()
+    server.serve(stdin, stdout)
+
+    stdout.seek(0)
+    assert read_message(stdout)["id"] == 1
+    assert read_message(stdout) == {"jsonrpc": "2.0", "id": 2, "result": None}
+    assert server.shutdown_requested and not server.running
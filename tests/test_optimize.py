@@ -0,0 +1,160 @@
+import random
+import sys
+from pathlib import Path
+
+import pytest
+
+from despiste.__main__ import main
+from despiste.optimize import DEFAULT_PASSES, PassManager, split_optimize_flags
+from despiste.program import Program
+from despiste.sim import Simulator
+from tests.conftest import final_state
+
+RESOURCES = Path(__file__).parent / "resources"
+
+
+def optimize(lines, passes=None):
+    manager = PassManager(passes, count_cycles=True)
+    program = manager.run(Program.from_text(lines))
+    return [" ".join(inst.to_text()) for inst in program.instructions], manager.results
+
+
+def test_remove_nops_keeps_delay_slots_and_targets():
+    texts, results = optimize([
+        " NOP",
+        " JMP NEXT",
+        " NOP",
+        "NEXT:",
+        " NOP",
+        " CLR A",
+        " NOP",
+        " END",
+    ], ["remove-nops"])
+    assert texts == [
+        "JMP #2",
+        "NOP NOP NOP NOP",
+        "NOP NOP NOP NOP",
+        "NOP NOP CLR A NOP",
+        "END",
+    ]
+    assert results[0].words == 2
+    assert results[0].best_cycles == results[0].worst_cycles == 2
+
+
+def test_remove_nops_keeps_dma_padding():
+    texts, results = optimize([" DMA D0,MC0,4", " NOP", " NOP", " MOV MC0,X", " NOP", " END"], ["remove-nops"])
+    assert texts[:4] == ["DMA1 D0,MC0,4", "NOP NOP NOP NOP", "NOP NOP NOP NOP", "NOP MOV MC0,X NOP NOP"]
+    assert results[0].words == 1
+
+    # Nothing to wait for after DMAH, which stalls until the transfer ends
+    texts, results = optimize([" DMAH D0,MC0,4", " NOP", " NOP", " MOV MC0,X", " NOP", " END"], ["remove-nops"])
+    assert results[0].words == 3
+
+
+def test_fold_ct_increment():
+    lines = [" MOV 5,CT0", " MOV M0,X", " MOV 6,CT0", " MOV M0,Y", " END"]
+    texts, results = optimize(lines, ["fold-ct-increment"])
+    assert texts == ["NOP NOP NOP MOV #5,CT0", "NOP MOV MC0,X NOP NOP", "NOP NOP MOV M0,Y NOP", "END"]
+    assert results[0].words == 1
+    assert final_state(Program.from_text(texts))[1] == final_state(Program.from_text(lines))[1]
+
+
+@pytest.mark.parametrize("lines", [
+    # CT0 isn't known
+    [" MOV M0,X", " MOV 6,CT0", " END"],
+    # Not the next address
+    [" MOV 5,CT0", " MOV M0,X", " MOV 7,CT0", " END"],
+    # DATA RAM0 is used in between
+    [" MOV 5,CT0", " MOV M0,X", " MOV 1,MC0", " MOV 6,CT0", " END"],
+])
+def test_fold_ct_increment_needs_the_next_address(lines):
+    texts, _ = optimize(lines, ["fold-ct-increment"])
+    assert len(texts) == len(lines)
+
+
+def test_drop_clr_a():
+    lines = [" CLR A", " ADD", " MOV 1,PL", " CLR A", " ADD", " CLR A", " MOV M0,A", " ADD", " END"]
+    texts, results = optimize(lines, ["drop-clr-a"])
+    # The second one is already cleared, the third one is overwritten before ADD reads it
+    assert texts == ["NOP NOP CLR A NOP", "ADD NOP NOP NOP", "NOP NOP NOP MOV #1,PL", "ADD NOP NOP NOP",
+                     "NOP NOP MOV M0,A NOP", "ADD NOP NOP NOP", "END"]
+    assert results[0].words == 2
+    assert final_state(Program.from_text(texts))[1] == final_state(Program.from_text(lines))[1]
+
+
+def test_thread_jumps():
+    lines = [" JMP FIRST", " NOP", " MVI 1,MC0", "FIRST:", " JMP SECOND", " NOP", " MVI 2,MC0", "SECOND:", " END"]
+    texts, results = optimize(lines, ["thread-jumps"])
+    assert texts[0] == "JMP #6"
+    assert results[0].words == 0
+    assert results[0].best_cycles == 2
+    assert final_state(Program.from_text(texts))[1] == final_state(Program.from_text(lines))[1]
+
+    # The delay slot of the second jump isn't a NOP
+    texts, _ = optimize([" JMP FIRST", " NOP", "FIRST:", " JMP SECOND", " MVI 1,MC0", "SECOND:", " END"],
+                        ["thread-jumps"])
+    assert texts[0] == "JMP #2"
+
+
+def test_unknown_pass():
+    with pytest.raises(Exception, match="Unknown pass"):
+        PassManager(["fast"])
+
+
+def test_random_programs_compute_the_same():
+    rng = random.Random(0)
+    choices = [" NOP", " CLR A", " ADD", " MOV 1,PL", " MOV ALU,A", " MOV M0,A", " MOV M1,X", " MOV MC0,Y",
+               " MOV MUL,P", " MOV M0,MC2", " MOV 1,CT0", " MOV 2,CT0", " MOV 0,CT1", " MOV 1,CT1", " SUB",
+               " JMP Z,SKIP", " JMP SKIP"]
+    for _ in range(300):
+        lines = [rng.choice(choices) for _ in range(10)]
+        lines.insert(rng.randrange(len(lines)), "SKIP:")
+        lines.append(" END")
+        program = Program.from_text(lines)
+        if Simulator(program).run(10_000) >= 10_000:
+            # Jumping back loops forever, the states depend on when the simulation stops
+            continue
+        optimized = PassManager(DEFAULT_PASSES + ["pack"]).run(program)
+        assert final_state(optimized)[1] == final_state(program)[1], lines
+
+
+def test_cycles_are_only_counted_when_asked_for(monkeypatch):
+    def fail(program):
+        raise AssertionError("the cycles were counted")
+    monkeypatch.setattr("despiste.optimize._cycles", fail)
+    manager = PassManager(["remove-nops"])
+    manager.run(Program.from_text([" CLR A", " NOP", " END"]))
+    assert manager.results[0].to_text() == "remove-nops: saved 1 word"
+
+
+def test_split_optimize_flags():
+    assert split_optimize_flags(["despiste", "compile", "a"]) == (None, False, ["despiste", "compile", "a"])
+    assert split_optimize_flags(["compile", "--optimize", "a"]) == (DEFAULT_PASSES, False, ["compile", "a"])
+    assert split_optimize_flags(["compile", "--optimize=remove-nops,pack", "a"]) == (["remove-nops", "pack"], False,
+                                                                                     ["compile", "a"])
+    assert split_optimize_flags(["compile", "--optimize-report", "a"]) == (DEFAULT_PASSES, True, ["compile", "a"])
+
+
+def test_compile_with_optimize(monkeypatch, capfd, tmp_path):
+    source = tmp_path / "kernel.asm"
+    source.write_text(" CLR A\n NOP\n CLR A\n END\n")
+    output = tmp_path / "kernel.bin"
+
+    monkeypatch.setattr(sys, "argv", ["despiste", "compile", "--optimize=remove-nops", str(source), str(output)])
+    with pytest.raises(SystemExit) as e:
+        main()
+    assert e.value.code == 0
+    assert len(output.read_bytes()) == 3 * 4
+    assert "remove-nops: saved 1 word\n" in capfd.readouterr().err
+
+    monkeypatch.setattr(sys, "argv", ["despiste", "compile", "--optimize=remove-nops", "--optimize-report",
+                                      str(source), str(output)])
+    with pytest.raises(SystemExit) as e:
+        main()
+    assert e.value.code == 0
+    assert "remove-nops: saved 1 word, 1 cycles in the best case, 1 in the worst case" in capfd.readouterr().err
+
+    monkeypatch.setattr(sys, "argv", ["despiste", "compile", "--optimize=fast", str(source), str(output)])
+    with pytest.raises(SystemExit) as e:
+        main()
+    assert e.value.code == 1
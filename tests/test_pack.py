@@ -0,0 +1,100 @@
+import random
+from pathlib import Path
+
+import pytest
+
+from despiste.instruction import Instruction
+from despiste.pack import pack_program
+from despiste.program import Program
+from tests.conftest import final_state
+
+RESOURCES = Path(__file__).parent / "resources"
+
+
+def pack_text(lines):
+    return [" ".join(inst.to_text()) for inst in pack_program(Program.from_text(lines)).instructions]
+
+
+def test_independent_commands_share_an_instruction():
+    # The product uses RX from before the load, as when they run one after the other
+    assert pack_text([" MOV 0,CT0", " CLR A", " MOV MUL,P", " MOV MC1,X", " END"]) == [
+        "NOP MOV MC1,X MOV MUL,P CLR A MOV #0,CT0",
+        "END",
+    ]
+
+
+@pytest.mark.parametrize("lines", [
+    [" MOV 5,PL", " ADD"],  # ADD reads P
+    [" MOV MC0,X", " MOV M0,Y"],  # CT0 is incremented
+    [" MOV 1,MC2", " MOV M2,X"],  # DATA RAM2 is written
+    [" MOV 2,RX", " MOV 3,RX"],  # Both write RX
+    [" MOV ALU,A", " ADD"],  # MOV ALU,A would see the new result
+])
+def test_hazards_keep_instructions_apart(lines):
+    assert len(pack_text(lines + [" END"])) == len(lines) + 1
+
+
+def test_alu_result_joins_its_operation():
+    assert pack_text([" ADD", " MOV ALU,A", " END"]) == ["ADD NOP MOV ALU,A NOP", "END"]
+
+
+def test_labels_delay_slots_and_jumps():
+    program = pack_program(Program.from_text([
+        " CLR A",
+        " MOV 1,PL",
+        " JMP NZ,DONE",
+        " MOV 0,CT0",
+        " MOV 0,CT1",
+        "DONE:",
+        " MOV 0,CT2",
+        " MOV 0,CT3",
+        " END",
+    ]))
+    texts = [" ".join(inst.to_text()) for inst in program.instructions]
+    assert texts == [
+        "NOP NOP CLR A MOV #1,PL",
+        "JMP NZ,#4",
+        # The delay slot stays alone
+        "NOP NOP NOP MOV #0,CT0",
+        "NOP NOP NOP MOV #0,CT1",
+        # The label can't be merged with the instruction before it
+        "NOP NOP NOP MOV #0,CT2",
+        "NOP NOP NOP MOV #0,CT3",
+        "END",
+    ]
+    assert program.context.labels == {"DONE": 4}
+
+
+@pytest.mark.parametrize("name", ["udiv.asm", "loop_primitive.asm", "test1.dsp"])
+def test_packed_resources_compute_the_same(name):
+    program = Program.from_text((RESOURCES / name).read_text().splitlines())
+    packed = pack_program(program)
+    assert len(packed.instructions) <= len(program.instructions)
+    assert final_state(packed)[1] == final_state(program)[1]
+
+
+def test_random_sequences_compute_the_same():
+    rng = random.Random(0)
+    end = Program.from_text([" END"]).instructions[0]
+    # Each instruction mostly uses a single slot: ALU, X-Bus, Y-Bus or D1-Bus
+    masks = [0x3C000000, 0x03F00000, 0x000FC000, 0x00003FFF, 0x3FFFFFFF]
+    for _ in range(300):
+        program = Program()
+        while len(program.instructions) < 8:
+            try:
+                inst = Instruction.from_word(rng.getrandbits(30) & rng.choice(masks))
+            except Exception:
+                continue
+            # MOV to TOP is remapped as an address
+            if "TOP" not in " ".join(inst.to_text()):
+                program.instructions.append(inst)
+        program.instructions.append(end)
+        assert final_state(pack_program(program))[1] == final_state(program)[1]
+
+
+def test_target_run_as_a_delay_slot():
+    # The second jump is in the delay slot of the first one: LOOP runs alone before jumping again
+    lines = [" CLR A", "LOOP:", " SUB", " MOV MUL,P", " MOV 1,PL", " JMP Z,LOOP", " JMP Z,LOOP", " END"]
+    program = Program.from_text(lines)
+    assert pack_text(lines)[1] == "SUB NOP NOP NOP"
+    assert final_state(pack_program(program))[1] == final_state(program)[1]
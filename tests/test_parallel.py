@@ -0,0 +1,91 @@
+import shutil
+from pathlib import Path
+
+import pytest
+
+from despiste.parallel import expand_inputs, output_path, run_many
+from despiste.program import Program
+
+RESOURCES = Path(__file__).parent / "resources"
+
+
+@pytest.fixture
+def sources(tmp_path):
+    for name in ["udiv.asm", "udiv-clean.asm", "test1.dsp"]:
+        shutil.copy(RESOURCES / name, tmp_path / name)
+    (tmp_path / "broken.asm").write_text("MOV M0,Y CLR A\n")
+    return tmp_path
+
+
+def test_expand_inputs(sources):
+    manifest = sources / "manifest.txt"
+    manifest.write_text("# Sources\n\ntest1.dsp\nudiv.asm\n")
+
+    inputs = expand_inputs([str(sources / "*.asm")], str(manifest))
+
+    assert [Path(x).name for x in inputs] == ["broken.asm", "udiv-clean.asm", "udiv.asm", "test1.dsp"]
+
+
+def test_output_path():
+    assert output_path("a/b.dsp", "compile") == str(Path("a/b.bin"))
+    assert output_path("a/b.bin", "decompile", "out") == str(Path("out/b.dsp"))
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_run_many_compile(sources, workers):
+    inputs = expand_inputs([str(sources / "*.asm"), str(sources / "*.dsp")])
+    lines = []
+
+    results = run_many("compile", inputs, workers, str(sources / "out"), report=lines.append)
+
+    assert [r.input_file for r in results] == inputs
+    assert [r.ok for r in results] == [False, True, True, True]
+    assert "Incompatible commands" in results[0].message
+    assert len(lines) == len(inputs)
+
+    binary = (sources / "out" / "udiv.bin").read_bytes()
+    expected = Program.from_text((RESOURCES / "udiv.asm").read_text().splitlines())
+    assert binary == expected.to_bytes()
+
+
+def test_run_many_decompile(sources):
+    run_many("compile", [str(sources / "test1.dsp")], 1, report=lambda line: None)
+
+    results = run_many("decompile", [str(sources / "test1.bin"), str(sources / "missing.bin")], 1,
+                       str(sources / "out"), report=lambda line: None)
+
+    assert results[0].ok
+    assert "ENDI" in (sources / "out" / "test1.dsp").read_text()
+    assert not results[1].ok
+
+
+def test_run_many_keeps_existing_outputs(sources):
+    source = sources / "test1.dsp"
+    run_many("compile", [str(source)], 1, report=lambda line: None)
+    original = source.read_text()
+
+    results = run_many("decompile", [str(sources / "test1.bin")], 1, report=lambda line: None)
+    assert not results[0].ok
+    assert "already exists" in results[0].message
+    assert source.read_text() == original
+
+    results = run_many("decompile", [str(sources / "test1.bin")], 1, report=lambda line: None, force=True)
+    assert results[0].ok
+    assert "ENDI" in source.read_text()
+
+
+def test_run_many_rebuilds_binaries(sources):
+    for _ in range(2):
+        results = run_many("compile", [str(sources / "udiv.asm"), str(sources / "test1.dsp")], 1,
+                           str(sources / "out"), report=lambda line: None)
+        assert all(result.ok for result in results)
+
+
+def test_run_many_output_collisions(sources):
+    (sources / "a").mkdir()
+    (sources / "b").mkdir()
+    inputs = [str(sources / "a" / "x.bin"), str(sources / "b" / "x.bin")]
+
+    with pytest.raises(Exception, match="would both be written"):
+        run_many("decompile", inputs, 1, str(sources / "out"), report=lambda line: None)
+    assert not (sources / "out").exists()
@@ -1,5 +1,12 @@
+from pathlib import Path
+
+import pytest
+
+from despiste.instruction import Instruction
 from despiste.program import Program
 
+RESOURCES = Path(__file__).parent / "resources"
+
 
 def test_program_from_binary_to_text():
     binary_code = [
@@ -25,3 +32,68 @@ def test_program_from_binary_to_text():
 
     assert len(p.instructions) == 13
 
+
+
+def test_program_words():
+    words = [0x00001C00, 0x00021D00, 0x02494000, 0x01000000, 0x18003209, 0xF8000000]
+
+    p = Program.from_words(words)
+
+    assert len(p.instructions) == len(words)
+    assert p.to_words() == words
+    assert p.instructions[-1].to_text() == ["ENDI"]
+
+
+def test_program_from_bytes():
+    buffer = (RESOURCES / "udiv.bin").read_bytes()
+
+    p = Program.from_bytes(memoryview(buffer))
+
+    assert len(p.instructions) == len(buffer) // 4
+    assert p.to_bytes() == buffer
+
+    bit_string = "".join(format(word, "032b") for word in reversed(p.to_words()))
+    assert Program.from_binary(bit_string).to_words() == p.to_words()
+
+
+def test_program_words_are_decoded_when_accessed():
+    buffer = (RESOURCES / "udiv.bin").read_bytes()
+    p = Program.from_bytes(buffer)
+    assert p.instructions._cache.count(None) == len(p.instructions)
+
+    # Copies and comparisons don't decode anything
+    copied = p.copy()
+    assert copied.to_bytes() == buffer
+    assert p.to_array() == copied.to_array()
+    assert p.instructions._cache.count(None) == len(p.instructions)
+
+    assert p.instructions[3] is p.instructions[3]
+    assert p.instructions._cache.count(None) == len(p.instructions) - 1
+
+
+def test_program_changes_are_encoded_back():
+    words = [0x00001C00, 0x2265B1F5, 0xD00000C8, 0xF8000000]
+    p = Program.from_words(words)
+    # Unused bits don't survive decoding, but the word is kept as long as the instruction isn't changed
+    assert p.instructions[1].to_word() != words[1]
+    assert p.to_words() == words
+
+    jump = p.instructions[2]
+    jump.specialCommand.immediate = 0x10
+    p.instructions[0] = Instruction.get_noop()
+    assert p.to_words() == [0, words[1], 0xD0000010, 0xF8000000]
+
+    p.instructions.insert(1, Instruction.from_word(0xF8000000))
+    del p.instructions[0]
+    p.instructions.append(Instruction.get_noop())
+    assert p.to_words() == [0xF8000000, words[1], 0xD0000010, 0xF8000000, 0]
+    assert [inst.to_text() for inst in p.instructions[-2:]] == [["ENDI"], ["NOP", "NOP", "NOP", "NOP"]]
+
+
+def test_invalid_words_are_rejected_when_decoded():
+    # Top nibble 0111 is not a valid instruction
+    p = Program.from_words([0xF8000000, 0x7FFFFFFF])
+    assert p.to_words() == [0xF8000000, 0x7FFFFFFF]
+    assert p.instructions[0].to_text() == ["ENDI"]
+    with pytest.raises(Exception):
+        p.instructions.decode()
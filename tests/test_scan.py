@@ -0,0 +1,98 @@
+import random
+import struct
+from pathlib import Path
+
+import pytest
+
+from despiste.batch import HAVE_NUMPY
+from despiste.program import Program
+from despiste.scan import find_candidates, scan_image, score_program
+
+RESOURCES = Path(__file__).parent / "resources"
+
+# Top nibble 0111 is not a valid instruction
+INVALID_WORD = 0x7FFFFFFF
+
+
+def make_image(path, layout):
+    """
+    Writes an image made of invalid padding words and programs.
+    :param layout: Items are either a number of padding words or a list of program words
+    """
+    words = []
+    for item in layout:
+        words += [INVALID_WORD] * item if isinstance(item, int) else item
+    path.write_bytes(struct.pack(f">{len(words)}I", *words))
+    return path
+
+
+@pytest.fixture
+def udiv_words():
+    return Program.from_bytes((RESOURCES / "udiv.bin").read_bytes()).to_words()
+
+
+@pytest.mark.parametrize("use_numpy", [False, pytest.param(True, marks=pytest.mark.skipif(
+    not HAVE_NUMPY, reason="NumPy is not installed"))])
+def test_find_candidates(udiv_words, use_numpy):
+    words = [INVALID_WORD] * 100 + [0] * 10 + udiv_words + [INVALID_WORD] * 3 + udiv_words
+
+    candidates = find_candidates(words, use_numpy=use_numpy)
+
+    start = 110
+    second = start + len(udiv_words) + 3
+    assert [(s, e) for s, e, _ in candidates] == [
+        (start, start + len(udiv_words) - 1),
+        (second, second + len(udiv_words) - 1),
+    ]
+
+
+def test_find_candidates_restricted_range(udiv_words):
+    words = [INVALID_WORD] * 10 + udiv_words + [INVALID_WORD] * 10 + udiv_words
+
+    candidates = find_candidates(words, first=20)
+
+    assert [s for s, _, _ in candidates] == [20 + len(udiv_words)]
+
+
+def test_score_program(udiv_words):
+    assert score_program(tuple(udiv_words)) > 0.9
+    # A jump far outside of the program
+    assert score_program((0xD0000000 | 0xFF, 0, 0, 0xF0000000)) == 0
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_scan_image(tmp_path, udiv_words, workers):
+    random.seed(1234)
+    noise = [random.getrandbits(32) for _ in range(3000)]
+    image = make_image(tmp_path / "image.bin", [noise, 7, udiv_words, 2000, udiv_words, 5])
+
+    candidates = scan_image(str(image), workers=workers, min_score=0.9, min_length=len(udiv_words))
+
+    offsets = [c.offset for c in candidates]
+    assert (3000 + 7) * 4 in offsets
+    assert (3000 + 7 + len(udiv_words) + 2000) * 4 in offsets
+    for candidate in candidates:
+        if candidate.offset in offsets[-2:]:
+            assert list(candidate.words) == udiv_words
+            assert candidate.program.to_words() == udiv_words
+
+
+def test_scan_image_chunks_find_the_same_windows(tmp_path, udiv_words):
+    # A single run of valid words, with END instructions too close to each other for the windows to be independent
+    random.seed(5)
+    words = []
+    while len(words) < 20000:
+        words += udiv_words[:random.randint(5, len(udiv_words))] + [0] * random.randint(0, 30)
+    image = make_image(tmp_path / "image.bin", [words])
+
+    def windows(workers):
+        return [(c.offset, c.words) for c in scan_image(str(image), workers=workers, min_score=0)]
+
+    assert windows(3) == windows(1)
+
+
+def test_scan_empty_image(tmp_path):
+    image = tmp_path / "empty.bin"
+    image.write_bytes(b"\x00\x01")
+
+    assert scan_image(str(image)) == []
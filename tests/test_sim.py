@@ -0,0 +1,148 @@
+from pathlib import Path
+
+import pytest
+
+from despiste.program import Program
+from despiste.sim import Simulator, step_function
+
+RESOURCES = Path(__file__).parent / "resources"
+
+
+def simulate(lines, max_cycles=10_000, external=None):
+    sim = Simulator(Program.from_text(lines), external)
+    sim.run(max_cycles)
+    return sim.state
+
+
+def test_udiv_computes_the_quotient():
+    lines = (RESOURCES / "udiv.asm").read_text().splitlines()
+    st = simulate(lines)
+
+    assert not st.running
+    assert st.ram[1][1] == 649 // 49
+    # The result is written to D0 at WA0
+    assert 649 // 49 in st.external.values()
+
+
+def test_alu_and_bus_moves():
+    st = simulate([
+        " MVI 5,PL",
+        " CLR A",
+        " ADD MOV ALU,A",
+        " NOP MOV ALL,MC0",
+        " MVI -3,PL",
+        " SUB MOV ALU,A",
+        " END",
+    ])
+    assert st.ram[0][0] == 5
+    assert st.ct[0] == 1
+    assert st.a == 8
+    # -3 is 0xFFFFFFFD as an unsigned operand, so the subtraction borrows
+    assert (st.z, st.s, st.c) == (0, 0, 1)
+
+
+def test_commands_read_registers_from_the_start_of_the_cycle():
+    st = simulate([
+        " MVI 7,MC0",
+        " MOV 0,CT0",
+        " MOV 3,RX",
+        " NOP MOV M0,Y",
+        # RX is loaded and multiplied in the same cycle: the product uses the old RX
+        " NOP MOV MUL,P MOV 5,RX",
+        " END",
+    ])
+    assert st.rx == 5
+    assert st.p == 21
+
+
+def test_conditional_jump_has_a_delay_slot():
+    st = simulate([
+        " MVI 1,PL",
+        " CLR A",
+        " SUB MOV ALU,A",
+        " JMP S,SKIP",
+        " MVI 1,MC0",
+        " MVI 2,MC0",
+        "SKIP:",
+        " MVI 3,MC0",
+        " END",
+    ])
+    assert st.ram[0][:3] == [1, 3, 0]
+    # 32 bits operations keep ACH
+    assert st.a == 0xFFFFFFFF
+    assert (st.z, st.s, st.c) == (0, 1, 1)
+
+
+def test_btm_loop():
+    st = simulate([
+        " MVI 9,LOP",
+        " MOV 4,TOP",
+        " CLR A",
+        " MOV 1,PL",
+        "LOOP:",
+        " ADD MOV ALU,A",
+        " BTM",
+        " NOP",
+        " END",
+    ])
+    assert st.a == 10
+    assert st.lop == 0
+
+
+def test_lps_repeats_the_next_instruction():
+    st = simulate([
+        " MVI 3,LOP",
+        " CLR A",
+        " MOV 2,PL",
+        " LPS",
+        " ADD MOV ALU,A",
+        " END",
+    ])
+    assert st.a == 8
+    assert st.lop == 0
+
+
+def test_lps_repeating_lps_does_nothing():
+    sim = Simulator([0x00000000] * 2 + [0xE8000000, 0xE8000000, 0xF0000000])
+    sim.state.lop = 5
+    sim.run(100)
+
+    assert not sim.state.running
+    # NOP, NOP, the LPS, the inner one 6 times as a no-op, END
+    assert sim.state.cycles == 2 + 1 + 6 + 1
+    assert sim.state.lop == 0
+
+
+def test_dma_sets_t0_while_transferring():
+    st = simulate([
+        " MOV 16,RA0",
+        " DMA D0,MC2,4",
+        " JMP T0,WAIT",
+        " NOP",
+        " END",
+        "WAIT:",
+        " MVI 1,MC0",
+        "LOOP:",
+        " JMP T0,LOOP",
+        " NOP",
+        " END",
+    ], external={16: 10, 17: 11, 18: 12, 19: 13})
+    assert st.ram[2][:4] == [10, 11, 12, 13]
+    assert st.ct[2] == 4
+    assert st.ram[0][0] == 1
+
+
+def test_dmah_stalls():
+    sim = Simulator(Program.from_text([" DMAH D0,MC0,8", " END"]), {})
+    assert sim.run() == 2 + 8
+
+
+def test_invalid_words_raise_when_run():
+    sim = Simulator([0x40000000])
+    with pytest.raises(Exception):
+        sim.step()
+
+
+def test_step_functions_are_shared():
+    words = Program.from_text([" NOP", " END"]).to_words()
+    assert step_function(words[0]) is step_function(words[0])
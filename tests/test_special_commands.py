@@ -199,3 +199,20 @@ def test_jump_binary(expected_text, bits):
     cmd = JumpCommand.from_binary(bits)
     assert cmd.to_binary() == bits
     assert cmd.to_text() == [expected_text]
+
+
+@pytest.mark.parametrize(
+    "ctype,word,text",
+    [
+        (EndCommand, 0xF8000000, "ENDI"),
+        (LoopCommand, 0xE8000000, "LPS"),
+        (DMACommand, 0xC0005104, "DMAH0 MC1,D0,4"),
+        (MVICommand, 0xAA080004, "MVI #4,LOP,NZ"),
+        (JumpCommand, 0xD00000C8, "JMP #200"),
+        (JumpCommand, 0xD3400010, "JMP T0,#16"),
+    ]
+)
+def test_special_word(ctype, word, text):
+    cmd = ctype.from_word(word)
+    assert cmd.to_text() == [text]
+    assert cmd.to_word() == word
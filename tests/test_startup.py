@@ -0,0 +1,40 @@
+import re
+import subprocess
+import sys
+from pathlib import Path
+
+# What running compile or decompile imports
+STATEMENT = "import despiste.__main__, despiste.compile, despiste.decompile"
+# Import time of the modules the interpreter itself doesn't import, about 45 ms when it was set (150 ms with NumPy)
+STARTUP_BUDGET_US = 100_000
+# Only imported by the commands that need them
+LATE_MODULES = ["numpy", "multiprocessing", "concurrent.futures", "argparse", "tracemalloc", "despiste.optimize",
+                "despiste.sim", "despiste.analyze", "despiste.scan", "despiste.batch", "despiste.lsp"]
+
+
+def import_times(statement: str = STATEMENT) -> dict:
+    """
+    Runs a statement in a new interpreter with -X importtime.
+    :return: The time spent importing every module itself, in microseconds
+    """
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", statement], capture_output=True, text=True,
+                            cwd=Path(__file__).parent.parent, check=True)
+    times = {}
+    for line in result.stderr.splitlines():
+        match = re.match(r"import time:\s+(\d+) \|\s+\d+ \| \s*(\S+)", line)
+        if match:
+            times[match.group(2)] = int(match.group(1))
+    return times
+
+
+def test_compile_path_imports_only_what_it_uses():
+    times = import_times()
+    assert "despiste.compile" in times
+    assert [module for module in LATE_MODULES if module in times] == []
+
+
+def test_cold_start_is_within_budget():
+    interpreter = set(import_times("pass"))
+    # The best of a few runs, to leave out a busy machine
+    best = min(sum(time for module, time in import_times().items() if module not in interpreter) for _ in range(3))
+    assert best < STARTUP_BUDGET_US
@@ -0,0 +1,86 @@
+import pstats
+import sys
+
+import pytest
+
+from despiste.__main__ import main
+from despiste.compile import compile_file
+from despiste.decompile import decompile_file
+from despiste.stats import Profiler, phase, profiling, split_stats_flags
+
+SOURCE = "START:\n MOV 3,CT0\n CLR A\n ADD MOV ALL,MC0\n JMP START\n NOP\n END\n"
+
+
+def test_phases_of_a_compilation_and_a_decompilation(tmp_path):
+    source = tmp_path / "kernel.dsp"
+    source.write_text(SOURCE)
+    output = tmp_path / "kernel.bin"
+
+    with Profiler() as profiler:
+        words = compile_file(str(source), str(output))
+    assert list(profiler.phases) == ["read", "lex", "labels", "instructions", "encode", "write"]
+    assert profiler.instructions == 6
+    assert profiler.peak_memory > 0
+    assert "instructions/s" in profiler.report()
+    assert not profiling()
+
+    # The same words as the single-pass assembler
+    assert list(words) == list(compile_file(str(source)))
+
+    with Profiler(trace_memory=False) as profiler:
+        decompile_file(str(output), str(tmp_path / "kernel.dsp"))
+    assert list(profiler.phases) == ["read", "decode", "render", "write"]
+    assert profiler.peak_memory is None
+
+    # Decoding happens when the instructions are first accessed, not when the binary is loaded
+    with Profiler(trace_memory=False) as profiler:
+        program = decompile_file(str(output))
+        assert "decode" not in profiler.phases
+        program.instructions.decode()
+    assert list(profiler.phases) == ["read", "decode"]
+
+
+def test_phases_do_nothing_without_a_profiler():
+    with phase("read"):
+        pass
+    with Profiler(trace_memory=False) as profiler:
+        with phase("read"):
+            pass
+        with phase("read"):
+            pass
+        with pytest.raises(Exception, match="already active"):
+            with Profiler():
+                pass
+    assert list(profiler.phases) == ["read"]
+
+
+def test_split_stats_flags():
+    assert split_stats_flags(["despiste", "compile", "a"]) == (False, None, ["despiste", "compile", "a"])
+    assert split_stats_flags(["--stats", "compile", "a"]) == (True, None, ["compile", "a"])
+    assert split_stats_flags(["compile", "--profile=out.prof", "a"]) == (True, "out.prof", ["compile", "a"])
+
+
+@pytest.mark.parametrize("flags", [[], ["--stats"]])
+def test_commands_run_once(monkeypatch, flags):
+    calls = []
+    monkeypatch.setattr("despiste.__main__.run", calls.append)
+    monkeypatch.setattr(sys, "argv", ["despiste", "-q", *flags, "lsp"])
+    main()
+    assert calls == [["despiste", "lsp"]]
+
+
+def test_compile_with_profile(monkeypatch, capfd, tmp_path):
+    source = tmp_path / "kernel.dsp"
+    source.write_text(SOURCE)
+    profile = tmp_path / "compile.prof"
+
+    monkeypatch.setattr(sys, "argv", ["despiste", "-q", f"--profile={profile}", "compile", str(source),
+                                      str(tmp_path / "kernel.bin")])
+    with pytest.raises(SystemExit) as e:
+        main()
+    assert e.value.code == 0
+    err = capfd.readouterr().err
+    assert "instructions" in err and "Peak memory" in err
+    # Importing the compiler is timed apart, and left out of the throughput
+    assert err.startswith("Phase") and "\nimport" in err
+    assert pstats.Stats(str(profile)).total_calls > 0
@@ -0,0 +1,73 @@
+import os
+import shutil
+from pathlib import Path
+
+import pytest
+
+from despiste.assembler import assemble
+from despiste.utils import words_to_bytes
+from despiste.watch import Watcher
+
+RESOURCES = Path(__file__).parent / "resources"
+
+
+@pytest.fixture
+def directory(tmp_path):
+    shutil.copy(RESOURCES / "udiv.asm", tmp_path / "udiv.asm")
+    shutil.copy(RESOURCES / "test1.dsp", tmp_path / "test1.dsp")
+    (tmp_path / "notes.txt").write_text("Not a source file")
+    return tmp_path
+
+
+def touch(path: Path, text: str, mtime_ns: int):
+    path.write_text(text)
+    os.utime(path, ns=(mtime_ns, mtime_ns))
+
+
+def test_start_compiles_outdated_files(directory):
+    lines = []
+    watcher = Watcher(str(directory), report=lines.append)
+
+    results = watcher.start()
+
+    assert sorted(Path(r.input_file).name for r in results) == ["test1.dsp", "udiv.asm"]
+    assert all(r.ok for r in results) and len(lines) == 2
+    assert (directory / "udiv.bin").read_bytes() == (RESOURCES / "udiv.bin").read_bytes()
+
+    # Nothing is compiled again when the binaries are up to date
+    assert Watcher(str(directory), report=lines.append).start() == []
+
+
+def test_poll_debounces_and_recompiles_changed_files(directory):
+    watcher = Watcher(str(directory), debounce=1.0, report=lambda line: None)
+    watcher.start()
+    source = directory / "udiv.asm"
+    lines = source.read_text().splitlines()
+    lines.insert(0, " NOP")
+
+    touch(source, "\n".join(lines[1:]), 1)
+    assert watcher.poll(now=100.0) == []
+    # Saved again during the debounce delay
+    touch(source, "\n".join(lines), 2)
+    assert watcher.poll(now=100.5) == []
+    assert watcher.poll(now=101.0) == []
+
+    results = watcher.poll(now=101.6)
+
+    assert [Path(r.input_file).name for r in results] == ["udiv.asm"]
+    assert results[0].ok
+    assert watcher.assemblers[str(source)].encoded == 1
+    assert (directory / "udiv.bin").read_bytes() == words_to_bytes(assemble(lines))
+    assert watcher.poll(now=105.0) == []
+
+
+def test_poll_reports_errors(directory):
+    watcher = Watcher(str(directory), debounce=0, report=lambda line: None)
+    watcher.start()
+
+    touch(directory / "broken.asm", " NOP\n JMP NOWHERE\n", 1)
+    results = watcher.poll()
+
+    assert len(results) == 1 and not results[0].ok
+    assert results[0].message.startswith("line 2:")
+    assert not (directory / "broken.bin").exists()